@@ -0,0 +1,347 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmarks for the hot paths of grading and packaging.
+
+Run all benchmarks and save the results as a baseline:
+
+    $ PYTHONPATH=src python benchmarks/run_benchmarks.py --save benchmarks/baseline.json
+
+Later, compare against the baseline: the script exits with a non-zero code if any benchmark became slower
+by more than `--tolerance`:
+
+    $ PYTHONPATH=src python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Timings depend on the machine, so baselines are only comparable when they're taken on the same one.
+"""
+
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+import click
+import numpy as np
+
+from gspack.__about__ import __version__
+from gspack.directories import RUBRIC_JSON, AUTOGRADER_ZIP
+from gspack.executor import Executor
+from gspack.grader import get_grades, reduce_type
+from gspack.packager import create_archive
+from gspack.rubric import Rubric
+from gspack.submission_metadata import read_submission_metadata
+from gspack.values_store import save_values, load_values
+
+# Version of the baselines' layout
+BASELINE_FORMAT = 1
+
+# Registry of benchmarks: name -> function which takes a temporary directory, prepares everything
+# the benchmark needs there, and returns the function to time (without arguments).
+benchmarks = {}
+
+ARRAY_SIZES = [1_000, 1_000_000]
+ARRAY_DTYPES = ["float64", "float32", "int64"]
+
+
+def benchmark(name):
+    """
+    Registers a benchmark.
+
+    :param name: unique name of the benchmark
+    :return: decorator
+    """
+    def register(setup):
+        if name in benchmarks:
+            raise ValueError(f"Benchmark {name} is registered twice")
+        benchmarks[name] = setup
+        return setup
+    return register
+
+
+def make_array(size, dtype, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.random(size) * 100).astype(dtype)
+
+
+def register_array_benchmarks():
+    for size in ARRAY_SIZES:
+        for dtype in ARRAY_DTYPES:
+
+            @benchmark(f"get_grades[{dtype},{size}]")
+            def setup_get_grades(work_dir: Path, size=size, dtype=dtype):
+                rubric = Rubric.from_dict({
+                    "test_suite": [{"test_name": "Array", "variable_name": "A", "score": 1}],
+                    "supported_platforms": ["python"],
+                })
+                # True values are memory-mapped from a values store, like during the actual grading
+                save_values({"A": make_array(size, dtype)}, work_dir / "values")
+                rubric.test_suite_values = load_values(work_dir / "values")
+                answer = {"A": make_array(size, dtype)}
+                return lambda: get_grades(rubric, "python", answer)
+
+            @benchmark(f"reduce_type[{dtype},{size}]")
+            def setup_reduce_type(work_dir: Path, size=size, dtype=dtype):
+                answer = make_array(size, dtype)
+                return lambda: reduce_type(answer)
+
+    @benchmark("reduce_type[list,10000]")
+    def setup_reduce_type_list(work_dir: Path):
+        answer = make_array(10_000, "float64").tolist()
+        return lambda: reduce_type(answer)
+
+
+@benchmark("get_grades[sparse,1000000x1000000]")
+def setup_get_grades_sparse(work_dir: Path):
+    from scipy import sparse
+
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": "Laplacian", "variable_name": "L", "score": 1}],
+        "supported_platforms": ["python"],
+    })
+    size = 1_000_000
+    laplacian = sparse.diags([-1.0, 2.0, -1.0], [-1, 0, 1], shape=(size, size), format="csr")
+    save_values({"L": laplacian}, work_dir / "values")
+    rubric.test_suite_values = load_values(work_dir / "values")
+    # The student's matrix is built in another format, so it's converted and its values are aligned
+    answer = {"L": laplacian.tocoo()}
+    return lambda: get_grades(rubric, "python", answer)
+
+
+register_array_benchmarks()
+
+
+@benchmark("execute_python[2000 statements]")
+def setup_execute_python(work_dir: Path):
+    lines = ["import numpy as np", "total = 0"]
+    for i in range(1000):
+        lines.append(f"x{i} = np.arange({i % 50 + 1}) * {i}")
+        lines.append(f"total += float(x{i}.sum())")
+    file_path = work_dir / "script.py"
+    file_path.write_text("\n".join(lines) + "\n")
+    executor = Executor(supported_platforms=["python"], variables_to_take=["total"])
+    return lambda: executor.execute(file_path)
+
+
+@benchmark("execute_jupyter[500 cells]")
+def setup_execute_jupyter(work_dir: Path):
+    cells = [{"cell_type": "code", "execution_count": None, "metadata": {}, "outputs": [],
+              "source": "import numpy as np\ntotal = 0"}]
+    for i in range(500):
+        cells.append({"cell_type": "markdown", "metadata": {}, "source": f"## Step {i}"})
+        cells.append({"cell_type": "code", "execution_count": None, "metadata": {}, "outputs": [],
+                      "source": f"x{i} = np.arange({i % 50 + 1}) * {i}\ntotal += float(x{i}.sum())\nprint(total)"})
+    file_path = work_dir / "notebook.ipynb"
+    file_path.write_text(json.dumps({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 4}))
+    executor = Executor(supported_platforms=["jupyter"], variables_to_take=["total"])
+    return lambda: executor.execute(file_path)
+
+
+def make_plotting_script(work_dir: Path):
+    lines = ["import numpy as np", "from matplotlib import pyplot as plt", "total = 0"]
+    for i in range(20):
+        lines += [f"x = np.linspace(0, {i + 1}, 10000)", "plt.figure()", "plt.plot(x, np.sin(x))",
+                  f"plt.savefig('figure_{i}.png')", "total += float(np.sin(x).sum())"]
+    file_path = work_dir / "plots.py"
+    file_path.write_text("\n".join(lines) + "\n")
+    return file_path
+
+
+@benchmark("execute_python[20 saved figures]")
+def setup_execute_plotting(work_dir: Path):
+    file_path = make_plotting_script(work_dir)
+    executor = Executor(supported_platforms=["python"], variables_to_take=["total"])
+    return lambda: executor.execute(file_path)
+
+
+@benchmark("execute_python[20 saved figures, headless]")
+def setup_execute_plotting_headless(work_dir: Path):
+    file_path = make_plotting_script(work_dir)
+    executor = Executor(supported_platforms=["python"], variables_to_take=["total"], headless=True)
+    return lambda: executor.execute(file_path)
+
+
+@benchmark("Rubric.from_json[5000 tests]")
+def setup_rubric_from_json(work_dir: Path):
+    rubric = {
+        "test_suite": [{"test_name": f"Test {i}", "variable_name": f"x{i}", "score": 1, "rtol": 1e-3,
+                        "hint_tolerance": "Check your rounding."} for i in range(5000)],
+        "supported_platforms": ["python", "jupyter"],
+        "number_of_attempts": 3,
+    }
+    with open(work_dir / RUBRIC_JSON, "w") as f:
+        json.dump(rubric, f)
+    return lambda: Rubric.from_json(work_dir / RUBRIC_JSON)
+
+
+@benchmark("create_archive[2 x 32 MB extra files]")
+def setup_create_archive(work_dir: Path):
+    rng = np.random.default_rng(0)
+    extra_files = ["data.bin", "table.csv"]
+    (work_dir / extra_files[0]).write_bytes(rng.bytes(32 * 1024 ** 2))
+    np.savetxt(work_dir / extra_files[1], rng.random((32 * 1024 ** 2 // 25, 1)))
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": "Array", "variable_name": "A", "score": 1}],
+        "supported_platforms": ["python"],
+        "extra_files": extra_files,
+        "requirements": ["numpy"],
+    })
+    rubric.test_suite_values = {"A": make_array(1_000_000, "float64")}
+    return lambda: create_archive(work_dir / AUTOGRADER_ZIP, rubric=rubric, platform="python")
+
+
+@benchmark("read_submission_metadata[500 previous submissions]")
+def setup_read_submission_metadata(work_dir: Path):
+    results = {"score": 5, "output": "x" * 1000, "extra_data": {"success": True, "pretest": False},
+               "tests": [{"name": f"Test {i}", "score": 1, "output": "y" * 1000} for i in range(10)]}
+    metadata = {"users": [{"name": "Student", "email": "student@uw.edu"}],
+                "previous_submissions": [{"score": 5, "results": results} for _ in range(500)]}
+    with open(work_dir / "submission_metadata.json", "w") as f:
+        json.dump(metadata, f)
+    return lambda: read_submission_metadata(work_dir / "submission_metadata.json")
+
+
+def measure(function, repeat):
+    """
+    Times a function like `timeit` does: the number of calls per sample is chosen so that a sample takes
+    at least 0.2 seconds.
+
+    :param function: function without arguments
+    :param repeat: number of samples
+    :return: dictionary with the best and the median time of one call, in seconds, and how it was measured.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"best": min(samples), "median": statistics.median(samples), "number": number, "repeat": repeat}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the results with a baseline by the best times.
+
+    :param results: benchmarks' results, see `measure`
+    :param baseline: benchmarks' results from the baseline
+    :param tolerance: relative slowdown which is still not a regression, e.g. 0.2 for 20%
+    :return: list of names of the benchmarks which regressed
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<45} {'(not in the baseline)':>30}")
+            continue
+        ratio = result["best"] / baseline[name]["best"]
+        verdict = ""
+        if ratio > 1 + tolerance:
+            verdict = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + tolerance):
+            verdict = "faster"
+        print(f"{name:<45} {baseline[name]['best'] * 1e3:>12.3f} ms -> {result['best'] * 1e3:>12.3f} ms"
+              f" x{ratio:.2f} {verdict}")
+    return regressions
+
+
+@click.command(
+    help="Runs gspack's micro-benchmarks"
+)
+@click.option(
+    "--filter",
+    "name_filter",
+    default=None,
+    type=str,
+    help="run only the benchmarks which names contain this string"
+)
+@click.option(
+    "--repeat",
+    default=5,
+    type=int,
+    help="number of samples per benchmark"
+)
+@click.option(
+    "--save",
+    default=None,
+    type=str,
+    help="save the results as a baseline (JSON) to this path"
+)
+@click.option(
+    "--compare",
+    "compare_path",
+    default=None,
+    type=str,
+    help="compare the results with a baseline from this path"
+)
+@click.option(
+    "--tolerance",
+    default=0.2,
+    type=float,
+    help="relative slowdown which is not yet considered a regression"
+)
+def run_benchmarks(name_filter, repeat, save, compare_path, tolerance):
+    """
+    Runs the benchmarks, saves and compares their results.
+
+    :param name_filter: substring of the names of the benchmarks to run
+    :param repeat: number of samples per benchmark
+    :param save: path to save the baseline to
+    :param compare_path: path to the baseline to compare with
+    :param tolerance: relative slowdown which is not yet considered a regression
+    :return: None. Exits with 1 if there are regressions.
+    """
+    results = {}
+    for name, setup in benchmarks.items():
+        if name_filter is not None and name_filter not in name:
+            continue
+        work_dir = Path(tempfile.mkdtemp(prefix="gspack_benchmark_"))
+        try:
+            results[name] = measure(setup(work_dir), repeat=repeat)
+        finally:
+            shutil.rmtree(work_dir)
+        print(f"{name:<45} best {results[name]['best'] * 1e3:>12.3f} ms,"
+              f" median {results[name]['median'] * 1e3:>12.3f} ms")
+
+    if save is not None:
+        baseline = {
+            "format": BASELINE_FORMAT,
+            "gspack_version": __version__,
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "benchmarks": results,
+        }
+        with open(save, "w") as f:
+            json.dump(baseline, f, indent=4)
+        print(f"Baseline saved: \n-> {save}")
+
+    if compare_path is not None:
+        with open(compare_path, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("format", None) != BASELINE_FORMAT:
+            raise click.ClickException(f"Unsupported format of the baseline: {compare_path}")
+        print(f"Comparison with the baseline from gspack {baseline['gspack_version']}:")
+        regressions = compare(results, baseline["benchmarks"], tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {tolerance:.0%}: " +
+                  ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -43,7 +43,7 @@ if __name__ == "__main__":
         },
         include_package_data=True,
 
-        python_requires='>=3.7',
+        python_requires=about['__python_requires__'],
         install_requires=install_requirements,
         tests_require=test_requirements,
         extras_require={
@@ -51,12 +51,9 @@ if __name__ == "__main__":
             'test': test_requirements,
             'dev': [doc_requirements, test_requirements]
         },
-        entry_points='''
-            [console_scripts]
-            gspack=gspack:create_autograder_from_terminal
-            gsgrade=gspack:grade_locally_from_terminal
-            gsgrade_gradescope=gspack:grade_on_gradescope
-        ''',
+        entry_points={
+            'console_scripts': about['__console_scripts__']
+        },
 
         zip_safe=False,
     )
@@ -27,6 +27,18 @@ __long_description__ = ("This package is designed to simplify setting" +
 __uri__ = "https://github.com/aksholokhov/gspack"
 
 __version__ = "0.2.12"
+__python_requires__ = ">=3.7"
+
+# Console scripts which are installed with gspack
+__console_scripts__ = [
+    "gspack = gspack:create_autograder_from_terminal",
+    "gspack_bulk = gspack:create_autograders_from_terminal",
+    "gsgrade = gspack:grade_locally_from_terminal",
+    "gsgrade_gradescope = gspack:grade_on_gradescope",
+    "gsgrade_batch = gspack:grade_batch_from_terminal",
+    "gsgrade_regrade = gspack:regrade_from_terminal",
+    "gsgrade_serve = gspack:serve_from_terminal",
+]
 
 __author__ = "Aleksei Sholokhov"
 __email__ = "aksh@uw.edu"
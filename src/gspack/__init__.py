@@ -15,6 +15,35 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import importlib
+
 from .__about__ import *
-from gspack.packager import create_autograder, create_autograder_from_terminal
-from gspack.grader import grade_locally, grade_on_gradescope, grade_locally_from_terminal
+
+# Public functions and the modules they live in. They are imported on the first access
+# (PEP 562), so that every console script only pays for importing what it actually uses.
+_lazy_attributes = {
+    "create_autograder": "gspack.packager",
+    "create_autograder_from_terminal": "gspack.packager",
+    "create_autograders": "gspack.packager",
+    "create_autograders_from_terminal": "gspack.packager",
+    "grade_locally": "gspack.grader",
+    "grade_on_gradescope": "gspack.grader",
+    "grade_locally_from_terminal": "gspack.grader",
+    "grade_batch": "gspack.grader",
+    "grade_batch_from_terminal": "gspack.grader",
+    "regrade": "gspack.grader",
+    "regrade_from_terminal": "gspack.grader",
+    "serve": "gspack.server",
+    "serve_from_terminal": "gspack.server",
+}
+
+
+def __getattr__(name):
+    module_name = _lazy_attributes.get(name, None)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module_name), name)
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy_attributes.keys()))
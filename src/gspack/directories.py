@@ -18,7 +18,6 @@
 from pathlib import Path
 
 # Names of files from autograder archive.
-DIST_DIR = Path("dist")
 TEMPLATES_DIR = Path("templates")
 REQUIREMENTS_FILE = "requirements.txt"
 RUN_AUTOGRADER_FILE = "run_autograder"
@@ -28,9 +27,18 @@ RUN_TESTS_FILE = "run_tests.py"
 AUTOGRADER_ZIP = "autograder.zip"
 CONFIG_JSON = "config.json"
 RUBRIC_JSON = "rubric.json"
-TEST_SUITE_VALUES_FILE = "test_suite_values.dump"
+TEST_SUITE_VALUES_FILE = "test_suite_values.dump"  # used by archives created with gspack<=0.2.12
+TEST_SUITE_VALUES_DIR = "test_suite_values"
+VALUES_INDEX_JSON = "index.json"
+VARIABLES_SNAPSHOT_DIR = "variables_snapshot"
+REFERENCE_SOLUTION = "reference_solution"  # name, without an extension, of the solution shipped for performance tests
 AUTOGRADER_ARCHIVE_FILES = [SETUP_FILE, RUN_AUTOGRADER_FILE, DEBUG_FILE]
 
+# Names of files which gspack keeps next to the solution for re-using work between packagings.
+PACKAGE_CACHE_DIR = ".gspack_cache"
+PACKAGE_MANIFEST_JSON = "manifest.json"
+SOLUTION_VALUES_DIR = "solution_values"
+
 # MATLAB stuff
 MATLAB_INSTALL_FILE = "matlab_setup.sh"
 RSA_KEY = "id_rsa"
@@ -43,6 +51,8 @@ MATLAB_FILES = [MATLAB_INSTALL_FILE, RSA_KEY, KNOWN_HOSTS_FILE, MATLAB_NETWORK_L
 GS_HOME_DIR = Path("/autograder")
 
 RESULTS_JSON = "results.json"
+BATCH_SUMMARY_JSON = "batch_summary.json"
+PACKAGING_REPORT_JSON = "packaging_report.json"
 
 class GSDirectoryStructure():
     def __init__(self, home_dir=GS_HOME_DIR):
@@ -18,7 +18,8 @@ import json
 
 from gspack.directories import *
 from gspack.directories import TEST_STUDENT_NAME, TEST_STUDENT_EMAIL
-from gspack.helpers import UserFailure
+from gspack.helpers import UserFailure, format_captured_output
+from gspack.submission_metadata import read_submission_metadata
 
 
 class Environment:
@@ -52,7 +53,7 @@ class Environment:
         :param submission_path: path to the main file in submission directory
         :param rubric_path: path to the rubric JSON file
         :param results_path: where to write a JSON file with results
-        :param test_values_path: path to a pickle file with true values from the rubric's test suite
+        :param test_values_path: path to the values store with true values from the rubric's test suite
         """
         self.name = name
         self.email = email
@@ -82,8 +83,9 @@ class Environment:
         gs_dirs = GSDirectoryStructure(home_dir=gs_home_dir)
 
 
-        with open(gs_dirs.submission_metadata_json(), 'r') as metadata_file:
-            submission_metadata = json.load(metadata_file)
+        # The metadata contains the full results of all previous submissions, so it can be large:
+        # it's streamed, and only what's needed is kept.
+        submission_metadata = read_submission_metadata(gs_dirs.submission_metadata_json())
 
         # Get username and email
         try:
@@ -98,20 +100,8 @@ class Environment:
             email = DEFAULT_STUDENT_EMAIL
 
         # Find how many attempts have already been used
-        previous_attempts_counter = 0
-        max_previous_score = 0
-
-        for previous_submission in submission_metadata['previous_submissions']:
-            if "results" not in previous_submission or previous_submission["results"] is None:
-                # it happens sometimes when the autograder failed to
-                # produce any output at all during one of the previous submissions
-                # due to a bug in the autograder itself.
-                continue
-            results = previous_submission["results"]
-            extra_data = results.get('extra_data', None)
-            if extra_data is not None and extra_data["success"] and not extra_data["pretest"]:
-                previous_attempts_counter += 1
-                max_previous_score = max(max_previous_score, results["score"])
+        previous_attempts_counter = submission_metadata["attempts"]
+        max_previous_score = submission_metadata["max_previous_score"]
 
         environment = Environment(
             name=name,
@@ -121,7 +111,7 @@ class Environment:
             submission_dir=gs_dirs.submission_dir(),
             results_path=gs_dirs.results_json(),
             rubric_path = gs_dirs.source_dir() / RUBRIC_JSON,
-            test_values_path=gs_dirs.source_dir() / TEST_SUITE_VALUES_FILE
+            test_values_path=gs_dirs.source_dir() / TEST_SUITE_VALUES_DIR
         )
         return environment
 
@@ -165,29 +155,33 @@ class Environment:
             json.dump(results, f, indent=4)
         return None
 
-    def write_results(self, results: dict):
+    def write_results(self, results: dict, captured_output=None):
         """
         Forms results.json based on `results` -- partially formed results.json with
         `tests` field filled in.
 
         :param results: dictionary with `tests` field filled in with grading results.
+        :param captured_output: TailBuffer with the last output of the student's code, if any.
         :return: None
         """
 
         results["output"] = (f"Executed successfully." +
                              f" Current score: {results['score']:.2f}/{self.max_score:.2f} \n")
+        results["output"] += format_captured_output(captured_output)
 
         results["score"] = round(results["score"], 2)
         self.write_down_and_exit(results)
         return None
 
-    def write_exception(self, exception: Exception):
+    def write_exception(self, exception: Exception, captured_output=None, timings=None):
         """
         Forms results.json based on `exception`. This exception can be a result of
         either student's actions, in which case the student looses an attempt, or gspack malfunctioning,
         in which case student does not loose an attempt and is asked to contact their instructor.
 
         :param exception: Exception that occurred during execution.
+        :param captured_output: TailBuffer with the last output of the student's code, if any.
+        :param timings: timings of the grading phases which finished before the exception, if any.
         :return: None
         """
         results = {
@@ -208,6 +202,9 @@ class Environment:
                                   f" total number of attempts, if limited.\n"
                                   )
             results["extra_data"]["success"] = False
+        results["output"] += format_captured_output(captured_output)
+        if timings is not None:
+            results["extra_data"]["timings"] = timings
 
         results["score"] = round(results["score"], 2)
         self.write_down_and_exit(results)
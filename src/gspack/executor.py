@@ -15,31 +15,67 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import gc
 import io
+import numbers
 import os
+import pickle
+import re
 import sys
 import types
+from contextlib import contextmanager
 from pathlib import Path
 
-from IPython import get_ipython
-from IPython.core.interactiveshell import InteractiveShell
-from matplotlib import pyplot as plt
-from nbformat import read
+import numpy as np
 
-from gspack.helpers import UserFailure, GspackFailure, redirected_output
-from gspack.helpers import determine_platform, all_supported_platforms, all_rubric_variables
+from gspack.function_tests import function_test_runners
+from gspack.helpers import UserFailure, GspackFailure, redirected_output, TailBuffer, DEFAULT_OUTPUT_TAIL_SIZE
+from gspack.helpers import determine_platform, all_supported_platforms, all_rubric_variables, is_sparse_matrix
+from gspack.sandbox import run_in_sandbox, sandbox_is_supported
+
+# Registry of platform backends: platform -> name of the Executor's method which executes files of this platform.
+# Every backend imports its heavy dependencies (IPython, Matplotlib, MATLAB Engine) by itself,
+# so only the platforms which are actually used are paid for.
+platform_backends = {
+    "python": "execute_python",
+    "jupyter": "execute_jupyter",
+    "matlab": "execute_matlab",
+}
+
+# Platforms whose files can be executed in a sandbox with limited resources, see `Executor.execute_in_sandbox`.
+# MATLAB code runs in MATLAB's own process, which is not affected by the sandbox's limits.
+sandboxed_platforms = ("python", "jupyter")
+
+# Heavy modules which executing a file from each platform relies on.
+# Long-running graders can import them upfront, see `gspack.workers.preload_modules`.
+platform_dependencies = {
+    "python": ["numpy", "matplotlib.pyplot"],
+    "jupyter": ["numpy", "matplotlib.pyplot", "IPython.core.interactiveshell", "nbformat"],
+    "matlab": ["numpy"],
+}
+
+# Notebook magics which are neutralized in the headless mode: they time code by running it many times,
+# install packages, or set up interactive plotting, none of which changes the notebook's variables.
+HEADLESS_SKIPPED_CELL_MAGICS = ("%%timeit",)
+HEADLESS_SKIPPED_LINE = re.compile(r"^([ \t]*)(%timeit|%matplotlib|%pip|%conda|!\s*pip|!\s*conda)\b.*$", re.MULTILINE)
 
 
 class Executor:
     """
-    Executor takes a path to a script file and returns either a list of values
-    for pre-specified variables (MATLAB)
-    or a dictionary with all namespace variables and their values
-    left after the script's execution (Python, Jupyter).
+    Executor takes a path to a script file and returns a dictionary with values of pre-specified variables
+    (or, for Python and Jupyter, of all namespace variables) left after the script's execution.
+    The values are detached from the script: its module, namespace, and figures are torn down
+    after the execution, so that a long-running process does not accumulate them.
     """
     def __init__(self,
                  supported_platforms=all_supported_platforms.keys(),
                  matlab_config=None,
+                 matlab_engine_pool=None,
+                 resource_limits=None,
+                 variables_to_take=None,
+                 function_tests=None,
+                 output_tail_size=DEFAULT_OUTPUT_TAIL_SIZE,
+                 headless=False,
                  verbose=False):
         """
         Creates an instance of Executor.
@@ -47,6 +83,21 @@ class Executor:
         :param supported_platforms: list of supported platforms
         :param matlab_config: dictionary with everything `matlab_executor` needs to know,
                 including `variables_to_get`, to execute a matlab file.
+        :param matlab_engine_pool: MatlabEnginePool to take MATLAB engines from.
+                Defaults to the pool shared by the whole process.
+        :param resource_limits: dictionary with `time_limit`, `cpu_time_limit` (seconds),
+                and `memory_limit` (megabytes), any of which can be None. If provided, Python and Jupyter files
+                are executed in a separate process with these limits, see `gspack.sandbox.run_in_sandbox`.
+        :param variables_to_take: names of the variables which are needed from the file's namespace.
+                Only these variables are kept after the execution. If None, all variables are.
+        :param function_tests: tests which call functions defined by Python and Jupyter files,
+                see `Rubric.get_function_tests`, or a function which makes them from the file's namespace.
+                The values they produce are taken alongside with the variables, under the tests' names.
+        :param output_tail_size: how many last bytes of the file's output (stdout and stderr) to keep
+                in `self.captured_output`. The output is never written to the disk.
+        :param headless: if True, Python and Jupyter files are executed without drawing figures
+                (see `headless_plotting`), and notebooks' cells are executed without timing magics,
+                package installations, and interactive plotting setup (see `make_headless_cell`).
         :param verbose: whether to print logs along the way to the terminal
         """
         self.supported_platforms = supported_platforms
@@ -56,7 +107,14 @@ class Executor:
             }
         else:
             self.matlab_config = matlab_config
-        self.log_path = "execution_log.txt"
+        self.matlab_engine_pool = matlab_engine_pool
+        self.resource_limits = resource_limits
+        self.variables_to_take = variables_to_take
+        self.function_tests = function_tests
+        self.output_tail_size = output_tail_size
+        self.headless = headless
+        # TailBuffer with the output of the last executed file, if it's captured for the file's platform
+        self.captured_output = None
         self.verbose = verbose
 
     def execute(self, file_path: Path, platform=None):
@@ -65,7 +123,7 @@ class Executor:
 
         :param file_path: path to the script file
         :param platform: language (platform) of this file
-        :return: tuple: platform dictionary with values from the script's namespace.
+        :return: tuple: platform, dictionary with values from the script's namespace (see `take_variables`).
         """
         if not os.path.exists(file_path):
             raise UserFailure(f"File does not exist: {file_path}")
@@ -73,23 +131,101 @@ class Executor:
             platform = determine_platform(file_path)
         if platform is None:
             raise UserFailure(f"Can't recognize the language platform for the file {file_path}")
+        self.captured_output = None
         my_dir = os.getcwd()
         os.chdir(file_path.parent)
         try:
-            if platform == "matlab":
-                output = self.execute_matlab(file_path)
-            elif platform == "jupyter":
-                output = self.execute_jupyter(file_path)
-            elif platform == "python":
-                output = self.execute_python(file_path)
-            else:
+            backend = platform_backends.get(platform, None)
+            if backend is None:
                 raise GspackFailure(f"Unrecognized platform: {platform}")
+            if self.resource_limits is not None and platform in sandboxed_platforms:
+                output = self.execute_in_sandbox(getattr(self, backend), file_path)
+            else:
+                output = getattr(self, backend)(file_path)
         finally:
             os.chdir(my_dir)
         if self.verbose:
             print(f"Found and executed successfully: \n-> {file_path}")
         return platform, output
 
+    def execute_in_sandbox(self, backend, file_path: Path):
+        """
+        Executes a file in a child process with `self.resource_limits`,
+        so that runaway code can't stall the grader.
+
+        :param backend: Executor's method which executes files of the file's platform.
+        :param file_path: path to the file
+        :return: dictionary with the values of `self.variables_to_take` from the file's namespace.
+        """
+        if not sandbox_is_supported():
+            print("WARNING: resource limits are not supported on this OS. The code is executed without them.")
+            return backend(file_path)
+
+        def run_backend():
+            # The output is captured in the child process, so it's passed back alongside with the result
+            try:
+                return backend(file_path), self.captured_output
+            except Exception as e:
+                e.captured_output = self.captured_output
+                raise
+
+        try:
+            output, self.captured_output = run_in_sandbox(run_backend, **self.resource_limits)
+        except Exception as e:
+            self.captured_output = getattr(e, "captured_output", None)
+            raise
+        return output
+
+    def take_variables(self, namespace: dict, extra_values: dict = None):
+        """
+        Takes the variables which can be passed to another process from the namespace.
+
+        :param namespace: dictionary with variables
+        :param extra_values: dictionary "name" - "value" with other values which are taken as well, if they
+                can be pickled, e.g. outputs of the namespace's functions.
+        :return: dictionary with the values of `self.variables_to_take`, or of all variables if it's None,
+                and with `extra_values`, except for those which can't be pickled (modules, functions etc.)
+        """
+        names = list(namespace.keys()) if self.variables_to_take is None else self.variables_to_take
+        candidates = [(name, namespace[name]) for name in names if name in namespace and not name.startswith("__")]
+        candidates += list((extra_values or {}).items())
+        # Functions and classes are pickled by reference: pickle would import their module
+        # by its name, i.e. execute the student's file once again. Hiding the module makes such values fail.
+        module_name = namespace.get("__name__", "")
+        saved_module = sys.modules.get(module_name, None)
+        sys.modules[module_name] = None
+        try:
+            variables = {}
+            for name, value in candidates:
+                # Numbers, strings, and arrays of them (dense or sparse) can always be pickled,
+                # so there is no need to try (and to copy them).
+                if not (isinstance(value, (numbers.Number, str, bytes))
+                        or (isinstance(value, np.ndarray) and value.dtype != object)
+                        or (is_sparse_matrix(value) and value.dtype != object)):
+                    try:
+                        pickle.dumps(value)
+                    except Exception:
+                        continue
+                variables[name] = value
+            return variables
+        finally:
+            if saved_module is None:
+                del sys.modules[module_name]
+            else:
+                sys.modules[module_name] = saved_module
+
+    def run_function_tests(self, namespace: dict):
+        """
+        Runs `self.function_tests` against the functions from the namespace of an executed file.
+
+        :param namespace: namespace of the file
+        :return: dictionary "test's name" - "value produced by the test", see `function_test_runners`.
+        """
+        function_tests = self.function_tests
+        if callable(function_tests):
+            function_tests = function_tests(namespace)
+        return {test["name"]: function_test_runners[test["type"]](namespace, test) for test in (function_tests or ())}
+
     def execute_matlab(self, file_path: Path):
         """
         Executes a MATLAB file.
@@ -105,7 +241,8 @@ class Executor:
         try:
             from .matlab_executor import execute_matlab as execute_matlab_ext
             output = execute_matlab_ext(file_path,
-                                        matlab_config=self.matlab_config)
+                                        matlab_config=self.matlab_config,
+                                        engine_pool=self.matlab_engine_pool)
         except TimeoutError:
             return UserFailure("Code did not finish before timeout.")
         return output
@@ -115,7 +252,8 @@ class Executor:
         Executes a Python script
 
         :param file_path: path to the script
-        :return: dictionary with all variables left in the namespace after the script finishes its execution.
+        :return: dictionary with the variables left in the namespace after the script finishes its execution,
+                see `take_variables`.
         """
         with open(file_path, 'r') as f:
             code = f.read()
@@ -123,34 +261,39 @@ class Executor:
         module = types.ModuleType(module_name)
         module.__file__ = os.path.abspath(file_path)
 
-        with open(self.log_path, 'w') as f:
-            with redirected_output(new_stdout=f, new_stderr=f):
+        self.captured_output = TailBuffer(self.output_tail_size)
+        try:
+            with redirected_output(new_stdout=self.captured_output, new_stderr=self.captured_output), \
+                    headless_plotting(enabled=self.headless):
                 try:
                     exec(code, module.__dict__)
+                except MemoryError:
+                    raise UserFailure("Your code ran out of memory.")
                 except Exception as e:
                     raise UserFailure(f"Exception occurred while executing your code: {str(e)}")
-            # in case the code opened plots -- close them
-            # to avoid buffer overflow
-            plt.close()
-        if os.path.exists(self.log_path):
-            os.remove(self.log_path)
-        return module.__dict__
+                function_outputs = self.run_function_tests(module.__dict__)
+            return self.take_variables(module.__dict__, extra_values=function_outputs)
+        finally:
+            release_module(module)
 
     def execute_jupyter(self, file_path: Path):
         """
         Executes a Jupyter Notebook, all coding cells top to bottom.
 
         :param file_path: path to the notebook
-        :return: dictionary with all variables left in the namespace after the the Notebook finishes its execution.
+        :return: dictionary with the variables left in the namespace after the the Notebook finishes its execution,
+                see `take_variables`.
         """
+        from IPython import get_ipython
+        from IPython.core.interactiveshell import InteractiveShell
+        from matplotlib import pyplot as plt
+        from nbformat import read
 
         # load the notebook object
         with io.open(file_path, 'r', encoding='utf-8') as f:
             nb = read(f, 4)
 
-        # create the module and add it to sys.modules
-        # if name in sys.modules:
-        #    return sys.modules[name]
+        # create the module and add it to sys.modules for the time of the execution
         shell = InteractiveShell.instance()
         fullname = file_path.stem
         module = types.ModuleType(fullname)
@@ -163,24 +306,104 @@ class Executor:
         # actually affect the notebook module's ns
         save_user_ns = shell.user_ns
         shell.user_ns = module.__dict__
-        with open(self.log_path, 'w') as f:
-            try:
-                code_cells_counter = 0
-                for cell in nb.cells:
-                    if cell.cell_type == 'code':
-                        code_cells_counter += 1
-                        # transform the input to executable Python
-                        code = shell.input_transformer_manager.transform_cell(cell.source)
-                        # run the code in module
-                        try:
-                            with redirected_output(new_stdout=f):
-                                exec(code, module.__dict__)
-                        except TimeoutError:
-                            raise UserFailure("Code did not finish before timeout")
-                        except Exception as e:
-                            raise UserFailure("Exception occurred while executing your"
-                                              " code in code cell %d: %s" % (code_cells_counter, e))
-                        plt.close()
-            finally:
-                shell.user_ns = save_user_ns
-        return module.__dict__
+        self.captured_output = TailBuffer(self.output_tail_size)
+        try:
+            code_cells_counter = 0
+            for cell in nb.cells:
+                if cell.cell_type == 'code':
+                    code_cells_counter += 1
+                    source = make_headless_cell(cell.source) if self.headless else cell.source
+                    # transform the input to executable Python
+                    code = shell.input_transformer_manager.transform_cell(source)
+                    # run the code in module
+                    try:
+                        with redirected_output(new_stdout=self.captured_output, new_stderr=self.captured_output), \
+                                headless_plotting(enabled=self.headless):
+                            exec(code, module.__dict__)
+                    except TimeoutError:
+                        raise UserFailure("Code did not finish before timeout")
+                    except MemoryError:
+                        raise UserFailure(f"Your code ran out of memory in code cell {code_cells_counter}.")
+                    except Exception as e:
+                        raise UserFailure("Exception occurred while executing your"
+                                          " code in code cell %d: %s" % (code_cells_counter, e))
+                    # Figures are never shown, so none of them is needed after its cell
+                    plt.close("all")
+            with redirected_output(new_stdout=self.captured_output, new_stderr=self.captured_output), \
+                    headless_plotting(enabled=self.headless):
+                function_outputs = self.run_function_tests(module.__dict__)
+            return self.take_variables(module.__dict__, extra_values=function_outputs)
+        finally:
+            shell.user_ns = save_user_ns
+            release_module(module)
+
+
+@contextmanager
+def headless_plotting(enabled=True):
+    """
+    Makes Matplotlib draw nothing: switches it to the non-interactive Agg backend and turns showing and
+    saving figures into no-ops. Figures can still be created and inspected, they're just never rendered,
+    which is where plotting spends most of its time.
+
+    :param enabled: if False, nothing is changed.
+    :return: context manager
+    """
+    if not enabled:
+        yield
+        return
+    import matplotlib
+    from matplotlib import pyplot as plt
+    from matplotlib.figure import Figure
+
+    patched = [(plt, "show"), (plt, "savefig"), (plt, "pause"), (plt, "draw"), (Figure, "show"), (Figure, "savefig")]
+    originals = [getattr(owner, name) for owner, name in patched]
+    # The backend is not switched back: a headless grader never needs an interactive one.
+    if matplotlib.get_backend().lower() != "agg":
+        plt.switch_backend("agg")
+    for owner, name in patched:
+        setattr(owner, name, _do_nothing)
+    try:
+        yield
+    finally:
+        for (owner, name), original in zip(patched, originals):
+            setattr(owner, name, original)
+
+
+def _do_nothing(*args, **kwargs):
+    return None
+
+
+def make_headless_cell(source: str):
+    """
+    Neutralizes the magics of a notebook's cell which are slow and don't change the notebook's variables:
+    cells with `%%timeit` are skipped, and lines with `%timeit`, `%matplotlib`, and package installations
+    (`%pip`, `!pip`, and their conda counterparts) are replaced with `pass`.
+
+    :param source: source of the cell
+    :return: source of the cell to execute
+    """
+    if source.lstrip().startswith(HEADLESS_SKIPPED_CELL_MAGICS):
+        return ""
+    return HEADLESS_SKIPPED_LINE.sub(r"\1pass", source)
+
+
+def release_module(module: types.ModuleType):
+    """
+    Tears down a module which a file was executed in: removes it from `sys.modules`, clears its namespace,
+    closes all figures, if any, and collects the garbage, so that nothing the file allocated outlives the execution.
+    Values which are still needed must be taken from the namespace beforehand, see `Executor.take_variables`.
+
+    :param module: module to tear down
+    :return: None
+    """
+    module_name = module.__name__
+    if sys.modules.get(module_name, None) is module:
+        del sys.modules[module_name]
+    # Functions defined in the module reference its namespace, so clearing the namespace breaks these cycles.
+    module.__dict__.clear()
+    # Figures only exist if the file (or anything before it) has imported pyplot: otherwise it's not imported here.
+    if "matplotlib.pyplot" in sys.modules:
+        sys.modules["matplotlib.pyplot"].close("all")
+    # Whatever the file allocated is young, so collecting the younger generations is enough,
+    # and it's much faster than a full collection in a process with many modules imported.
+    gc.collect(1)
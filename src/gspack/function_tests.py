@@ -0,0 +1,311 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import copy
+import signal
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+# Default number of times a performance test calls the function on all its input cases.
+DEFAULT_REPEAT = 5
+
+# Default speed curve of performance tests: pairs (student's time / reference's time, fraction of the points)
+# between which the fraction is interpolated linearly. It's constant beyond the first and the last pairs.
+DEFAULT_SPEED_CURVE = [[1.5, 1.0], [4.0, 0.0]]
+
+# Default memory budget of memory tests: how many times more memory than the reference solution
+# a function can use, plus how many megabytes more, so that tiny differences don't matter.
+DEFAULT_MEMORY_BUDGET = 1.5
+DEFAULT_MEMORY_SLACK_MB = 1.0
+
+
+class FunctionCallFailure:
+    """
+    Outcome of a function's call which did not return a value: the function is not defined,
+    raised an exception, or exceeded its time limit. It's stored in place of the call's output.
+    """
+    def __init__(self, message):
+        self.message = message
+
+    def __repr__(self):
+        return f"FunctionCallFailure({self.message!r})"
+
+
+class CallTimeout(BaseException):
+    """
+    Raised inside a function's call when it exceeds its time limit, see `call_time_limit`.
+    It's not an `Exception`, so that a function which catches all exceptions (e.g. to retry) can't swallow it.
+    """
+    pass
+
+
+def run_function_test(namespace: dict, spec: dict):
+    """
+    Calls a function from a file's namespace on every input case of a function test.
+
+    :param namespace: namespace of the executed file
+    :param spec: function test, see `Rubric.get_function_tests`
+    :return: list of the calls' outputs, one per input case. Calls which failed give `FunctionCallFailure`.
+            If the function or the inputs are not defined, it's a `FunctionCallFailure` itself.
+    """
+    function, inputs = get_function_and_inputs(namespace, spec)
+    if isinstance(function, FunctionCallFailure):
+        return function
+    return [call_function(function, case, spec.get("call_time_limit", None))[0] for case in inputs]
+
+
+def run_performance_test(namespace: dict, spec: dict):
+    """
+    Times a function from a file's namespace on the input cases of a performance test. The function is called
+    on every case once to take its outputs, which are checked like the ones of a function test, and then `repeat`
+    more times. The best of the repetitions is taken: the slower ones were slowed down by something else.
+
+    :param namespace: namespace of the executed file
+    :param spec: performance test, see `Rubric.get_function_tests`
+    :return: dictionary with the "outputs" (see `run_function_test`) and the "seconds" which the function
+            took to process all the input cases, or None if any call failed.
+    """
+    outputs = run_function_test(namespace, spec)
+    measurement = {"outputs": outputs, "seconds": None}
+    if isinstance(outputs, FunctionCallFailure) or any(isinstance(output, FunctionCallFailure) for output in outputs):
+        return measurement
+    function, inputs = get_function_and_inputs(namespace, spec)
+    best_seconds = None
+    for _ in range(spec.get("repeat", None) or DEFAULT_REPEAT):
+        seconds = 0.0
+        for i, case in enumerate(inputs):
+            output, call_seconds = call_function(function, case, spec.get("call_time_limit", None))
+            if isinstance(output, FunctionCallFailure):
+                outputs[i] = output
+                return measurement
+            seconds += call_seconds
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+    measurement["seconds"] = best_seconds
+    return measurement
+
+
+def get_function_and_inputs(namespace: dict, spec: dict):
+    """
+    Finds the function which a test calls, and its input cases.
+
+    :param namespace: namespace of the executed file
+    :param spec: function test, see `Rubric.get_function_tests`
+    :return: tuple: the function and the list of input cases, or `FunctionCallFailure` and None
+            if either is not defined.
+    """
+    function = namespace.get(spec["function_name"], None)
+    if not callable(function):
+        return FunctionCallFailure(f"Function {spec['function_name']} is not defined."), None
+    inputs = spec["inputs"]
+    if isinstance(inputs, str):
+        inputs = namespace.get(inputs, None)
+        if inputs is None:
+            return FunctionCallFailure(f"Inputs {spec['inputs']} are not defined."), None
+    return function, inputs
+
+
+def run_memory_test(namespace: dict, spec: dict):
+    """
+    Measures the peak memory which a function from a file's namespace allocates on the input cases
+    of a memory test, see `PeakMemory`. The function's outputs are taken in the same calls.
+
+    :param namespace: namespace of the executed file
+    :param spec: memory test, see `Rubric.get_function_tests`
+    :return: dictionary with the "outputs" (see `run_function_test`) and the "peak_memory" (bytes) which
+            the function allocated on top of its arguments, the largest over the input cases,
+            or None if any call failed or could not be measured.
+    """
+    function, inputs = get_function_and_inputs(namespace, spec)
+    if isinstance(function, FunctionCallFailure):
+        return {"outputs": function, "peak_memory": None}
+    outputs = []
+    peak_memory = 0
+    for case in inputs:
+        peak = PeakMemory()
+        output, _ = call_function(function, case, spec.get("call_time_limit", None), measurement=peak)
+        outputs.append(output)
+        if peak.peak_memory is None:
+            peak_memory = None
+        elif peak_memory is not None:
+            peak_memory = max(peak_memory, peak.peak_memory)
+    failed = any(isinstance(output, FunctionCallFailure) for output in outputs)
+    return {"outputs": outputs, "peak_memory": None if failed else peak_memory}
+
+
+class PeakMemory:
+    """
+    Context manager which measures the peak memory allocated inside it, in two ways: the peak of the memory traced
+    by `tracemalloc` (Python objects and NumPy arrays), and the growth of the process' peak resident memory, which
+    also catches what native libraries allocate on their own. The larger of the two is taken. The resident peak
+    is only used when it could be reset on entering (Linux 4.0+ with a writable /proc/self/clear_refs):
+    otherwise it's the peak of the whole process so far, and the earlier allocations would be charged to the code.
+    """
+    def __init__(self):
+        self.traced_peak = None
+        self.resident_growth = None
+        self.peak_memory = None
+        self._resident_before = None
+        self._tracing = False
+
+    def __enter__(self):
+        if _reset_resident_peak():
+            self._resident_before = _read_proc_status("VmRSS")
+        # The code inside can trace the memory on its own, then its tracing is not interfered with
+        self._tracing = not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._tracing:
+            self.traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if self._resident_before is not None:
+            resident_peak = _read_proc_status("VmHWM")
+            if resident_peak is not None:
+                self.resident_growth = max(0, resident_peak - self._resident_before)
+        measured = [value for value in (self.traced_peak, self.resident_growth) if value is not None]
+        self.peak_memory = max(measured) if measured else None
+        return False
+
+
+def _read_proc_status(field):
+    # Memory fields of /proc/self/status are in kB. It's only there on Linux.
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_resident_peak():
+    # Writing 5 to clear_refs resets the peak resident memory to the current one (Linux 4.0+).
+    # It fails without the permission, in some containers, on older kernels, and on other OSes.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def call_function(function, case, time_limit=None, measurement=None):
+    """
+    Calls a function on an input case. Only the call itself is timed, without copying the arguments.
+
+    :param function: function to call
+    :param case: input case, see `get_call_arguments`
+    :param time_limit: time limit of the call, seconds, see `call_time_limit`
+    :param measurement: context manager to enter around the call only, e.g. `PeakMemory`.
+    :return: tuple: the function's output or a `FunctionCallFailure`, and the duration of the call, seconds.
+    """
+    args, kwargs = get_call_arguments(case)
+    start = time.perf_counter()
+    try:
+        with call_time_limit(time_limit), (measurement or nullcontext()):
+            output = function(*args, **kwargs)
+    except CallTimeout:
+        output = FunctionCallFailure(f"the call did not finish in {time_limit:g} seconds.")
+    except MemoryError:
+        output = FunctionCallFailure("the call ran out of memory.")
+    except Exception as e:
+        output = FunctionCallFailure(f"{type(e).__name__}: {e}")
+    return output, time.perf_counter() - start
+
+
+def get_call_failure(value):
+    """
+    Finds the first failed call in the value produced by a function test.
+
+    :param value: value produced by `run_function_test` or `run_performance_test`
+    :return: tuple: index of the input case (None if the function itself is not defined) and
+            `FunctionCallFailure`, or None if all the calls succeeded.
+    """
+    outputs = value["outputs"] if isinstance(value, dict) else value
+    if isinstance(outputs, FunctionCallFailure):
+        return None, outputs
+    for i, output in enumerate(outputs):
+        if isinstance(output, FunctionCallFailure):
+            return i, output
+    return None
+
+
+def get_call_arguments(case):
+    """
+    Makes the arguments of a function's call from an input case: a list or a tuple is a list of positional
+    arguments, a dictionary has the positional arguments in "args" and the keyword ones in "kwargs",
+    and anything else is the only argument. The arguments are copied, so that a function which modifies
+    its arguments in place doesn't affect the other calls, and so that read-only arrays become writable.
+
+    :param case: input case
+    :return: tuple: list of positional arguments, dictionary of keyword arguments
+    """
+    if isinstance(case, (list, tuple)):
+        args, kwargs = list(case), {}
+    elif isinstance(case, dict):
+        args, kwargs = list(case.get("args", [])), dict(case.get("kwargs", {}))
+    else:
+        args, kwargs = [case], {}
+    return [_copy_argument(arg) for arg in args], {name: _copy_argument(arg) for name, arg in kwargs.items()}
+
+
+def _copy_argument(arg):
+    if isinstance(arg, np.ndarray):
+        # Memory-mapped arrays from a values store are copied to plain, writable ones
+        return np.array(arg)
+    return copy.deepcopy(arg)
+
+
+@contextmanager
+def call_time_limit(seconds):
+    """
+    Interrupts the code inside with `CallTimeout` when it runs for longer than `seconds` of wall-clock time.
+    It relies on SIGALRM, so the limit is not applied outside of the main thread or on OSes without it.
+
+    :param seconds: time limit, or None for no limit
+    :return: context manager
+    """
+    if (seconds is None or not hasattr(signal, "setitimer")
+            or threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+
+    def on_timeout(signum, frame):
+        raise CallTimeout()
+
+    previous_handler = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+# Registry of the tests which call functions from the executed file's namespace: test's type -> function
+# which takes the namespace and the test (see `Rubric.get_function_tests`), and returns the value to check.
+function_test_runners = {
+    "function": run_function_test,
+    "performance": run_performance_test,
+    "memory": run_memory_test,
+}
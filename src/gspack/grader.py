@@ -15,21 +15,34 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import cProfile
+import json
 import numbers
 import os
-import pickle
 import shutil
+from itertools import chain
+from multiprocessing import Pool
 from pathlib import Path
 
 import click
 import numpy as np
 
 from gspack.__about__ import __version__
-from gspack.directories import TEST_SUITE_VALUES_FILE, RESULTS_JSON
+from gspack.directories import TEST_SUITE_VALUES_DIR, RESULTS_JSON, BATCH_SUMMARY_JSON, VARIABLES_SNAPSHOT_DIR
+from gspack.directories import REFERENCE_SOLUTION, REQUIREMENTS_FILE
 from gspack.environment import Environment
-from gspack.executor import Executor
-from gspack.helpers import UserFailure, GspackFailure, determine_platform
-from gspack.rubric import Rubric
+from gspack.executor import Executor, platform_dependencies
+from gspack.function_tests import FunctionCallFailure, DEFAULT_SPEED_CURVE
+from gspack.function_tests import DEFAULT_MEMORY_BUDGET, DEFAULT_MEMORY_SLACK_MB
+from gspack.helpers import UserFailure, GspackFailure, determine_platform, all_supported_platforms, is_sparse_matrix
+from gspack.result_cache import ResultCache, DEFAULT_CACHE_SIZE
+from gspack.rubric import Rubric, get_test_type, get_test_value_name
+from gspack.timings import PhaseTimer, profiling, not_profiling
+from gspack.values_store import load_values, save_values
+from gspack.workers import ForkServerPool, fork_is_supported, preload_modules, requirement_to_module_name
+
+# Number of elements which `compare_arrays` compares at once.
+COMPARISON_CHUNK_SIZE = 1 << 16
 
 
 @click.command(
@@ -58,30 +71,71 @@ def grade_on_fake_gradescope(gs_home_dir_override):
 @click.version_option(
     version=__version__
 )
+@click.option(
+    "--cache-dir",
+    default=None,
+    type=str,
+    help="directory for caching results of identical submissions (default: no caching)"
+)
+@click.option(
+    "--cache-size",
+    default=DEFAULT_CACHE_SIZE // 1024 ** 2,
+    type=int,
+    help="maximal size of the results cache, in megabytes"
+)
+@click.option(
+    "--snapshot",
+    is_flag=True,
+    help="save the submission's variables from the rubric next to the results, so that it can be regraded later"
+)
+@click.option(
+    "--timings-log",
+    default=None,
+    type=str,
+    help="JSON-lines file to append the timings of the grading phases to"
+)
+@click.option(
+    "--profile",
+    default=None,
+    type=str,
+    help="file to save a cProfile dump of the grading to (the student's code is excluded)"
+)
 @click.argument(
     "submission_path",
 )
 @click.argument(
     "rubric_path",
 )
-def grade_locally_from_terminal(submission_path, rubric_path):
+def grade_locally_from_terminal(submission_path, rubric_path, cache_dir, cache_size, snapshot, timings_log, profile):
     """
     Wrapper function which is called when gsgrade is called from the terminal.
 
     :param submission_path: path to the submission's file
     :param rubric_path: path to the rubric's JSON file.
+    :param cache_dir: directory for caching results, see ResultCache.
+    :param cache_size: maximal size of the cache, in megabytes.
+    :param snapshot: whether to save a snapshot of the submission's variables, see `run_grader`.
+    :param timings_log: JSON-lines log for the timings, see `run_grader`.
+    :param profile: path to save a cProfile dump to.
     :return: 0 (zero) if everything goes okay, otherwise -1
     """
-    return grade_locally(submission_path, rubric_path)
+    result_cache = ResultCache(cache_dir, max_size=cache_size * 1024 ** 2) if cache_dir is not None else None
+    return grade_locally(submission_path, rubric_path, result_cache=result_cache, snapshot=snapshot,
+                         timings_log=timings_log, profile_path=profile)
 
 
-def grade_locally(submission_path, rubric_path):
+def grade_locally(submission_path, rubric_path, result_cache=None, snapshot=False, timings_log=None,
+                  profile_path=None):
     """
     Grades solution assuming grading outside of a Gradescope server. Meant to be used for
     debugging.
 
     :param submission_path: path to the submission's file
     :param rubric_path: path to the rubric's JSON file.
+    :param result_cache: ResultCache to reuse results of identical submissions from, if any.
+    :param snapshot: whether to save a snapshot of the submission's variables, see `run_grader`.
+    :param timings_log: JSON-lines log to append the timings of the grading phases to, if any.
+    :param profile_path: if provided, the grading is profiled, and the cProfile dump is saved to this path.
     :return: 0 (zero) if everything goes okay, otherwise -1
     """
     submission_path_absolute = Path(submission_path).absolute()
@@ -90,48 +144,485 @@ def grade_locally(submission_path, rubric_path):
         submission_path=submission_path_absolute,
         submission_dir=submission_path_absolute.parent,
         rubric_path=rubric_path_absolute,
-        test_values_path=rubric_path_absolute.parent / TEST_SUITE_VALUES_FILE,
+        test_values_path=rubric_path_absolute.parent / TEST_SUITE_VALUES_DIR,
         results_path=submission_path_absolute.parent / RESULTS_JSON
     )
-    return run_grader(environment)
+    profiler = cProfile.Profile() if profile_path is not None else None
+    return_code = run_grader(environment, result_cache=result_cache, snapshot=snapshot,
+                             timings_log=timings_log, profiler=profiler)
+    if profiler is not None:
+        profiler.dump_stats(profile_path)
+    return return_code
+
+
+@click.command(
+    help="Grades all submissions from a directory in parallel"
+)
+@click.version_option(
+    version=__version__
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="number of worker processes (default: number of CPUs)"
+)
+@click.option(
+    "--fork-server/--no-fork-server",
+    default=None,
+    help="grade every submission in a fresh process forked from a pre-imported runtime (default: on, if supported)"
+)
+@click.option(
+    "--cache-dir",
+    default=None,
+    type=str,
+    help="directory for caching results of identical submissions (default: no caching)"
+)
+@click.option(
+    "--cache-size",
+    default=DEFAULT_CACHE_SIZE // 1024 ** 2,
+    type=int,
+    help="maximal size of the results cache, in megabytes"
+)
+@click.option(
+    "--snapshot",
+    is_flag=True,
+    help="save every submission's variables from the rubric next to its results, so that it can be regraded later"
+)
+@click.option(
+    "--timings-log",
+    default=None,
+    type=str,
+    help="JSON-lines file to append the timings of the grading phases of every submission to"
+)
+@click.argument(
+    "submissions_dir",
+)
+@click.argument(
+    "rubric_path",
+)
+def grade_batch_from_terminal(submissions_dir, rubric_path, workers, fork_server, cache_dir, cache_size, snapshot,
+                              timings_log):
+    """
+    Wrapper function which is called when gsgrade_batch is called from the terminal.
+
+    :param submissions_dir: path to the directory with one sub-directory per student's submission
+    :param rubric_path: path to the rubric's JSON file.
+    :param workers: number of worker processes
+    :param fork_server: whether to fork a fresh process for every submission, see `grade_batch`.
+    :param cache_dir: directory for caching results, see ResultCache.
+    :param cache_size: maximal size of the cache, in megabytes.
+    :param snapshot: whether to save snapshots of the submissions' variables, see `run_grader`.
+    :param timings_log: JSON-lines log for the timings, see `run_grader`.
+    :return: 0 (zero) if everything goes okay, otherwise -1
+    """
+    result_cache = ResultCache(cache_dir, max_size=cache_size * 1024 ** 2) if cache_dir is not None else None
+    try:
+        grade_batch(submissions_dir, rubric_path, workers=workers, fork_server=fork_server,
+                    result_cache=result_cache, snapshot=snapshot, timings_log=timings_log)
+    except UserFailure as e:
+        print(f"ERROR: {e}")
+        return -1
+    return 0
+
+
+def get_runtime_modules(rubric: Rubric, rubric_path: Path):
+    """
+    Lists the modules which grading against a rubric imports: the dependencies of the supported platforms
+    and the packages which the solution requires. The requirements come from the rubric's `requirements`
+    variable or, if the solution didn't set it, from the requirements.txt file which `gspack` put
+    next to the rubric's JSON file after scanning the solution's imports.
+
+    :param rubric: rubric to grade against
+    :param rubric_path: path to the rubric's JSON file
+    :return: list of module names, see `gspack.workers.preload_modules`
+    """
+    runtime_modules = list(chain(*[platform_dependencies.get(platform, ())
+                                   for platform in rubric.supported_platforms]))
+    requirements = rubric.requirements
+    requirements_path = Path(rubric_path).parent / REQUIREMENTS_FILE
+    if requirements is None and requirements_path.is_file():
+        with open(requirements_path, "r") as f:
+            requirements = [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+    runtime_modules += [requirement_to_module_name(r) for r in (requirements or ())]
+    return list(dict.fromkeys(runtime_modules))
+
+
+def grade_batch(submissions_dir, rubric_path, workers=None, fork_server=None, result_cache=None, snapshot=False,
+                timings_log=None):
+    """
+    Grades every submission from `submissions_dir` assuming grading outside of a Gradescope server.
+    Every sub-directory of `submissions_dir` is treated as one student's submission directory,
+    and results.json is written into it. The rubric and its true values are loaded only once
+    and shared by all worker processes.
+
+    :param submissions_dir: path to the directory with one sub-directory per student's submission
+    :param rubric_path: path to the rubric's JSON file.
+    :param workers: number of worker processes. Defaults to the number of CPUs.
+    :param fork_server: if True, the grading runtime and the rubric's requirements are imported once,
+            and every submission is graded in a fresh process forked from this one, so that submissions
+            can't affect each other. Otherwise, submissions are graded by a pool of long-lived processes.
+            Defaults to True when the OS supports forking, unless the rubric supports MATLAB: long-lived
+            processes keep their MATLAB engines between submissions, while forked ones would start a new one
+            every time.
+    :param result_cache: ResultCache to reuse results of identical submissions from, if any.
+    :param snapshot: whether to save snapshots of the submissions' variables, see `run_grader`.
+    :param timings_log: JSON-lines log to append the timings of every submission's grading phases to, if any.
+    :return: summary -- list of dictionaries with the grading outcome for every submission.
+    """
+    submissions_dir_absolute = Path(submissions_dir).absolute()
+    rubric_path_absolute = Path(rubric_path).absolute()
+    if not submissions_dir_absolute.is_dir():
+        raise UserFailure(f"Submissions directory does not exist: \n -> {submissions_dir_absolute}")
+    rubric = load_rubric(rubric_path_absolute, rubric_path_absolute.parent / TEST_SUITE_VALUES_DIR)
+    # Submissions are graded with the same rubric and options
+    run_grader_options = {"rubric": rubric, "result_cache": result_cache, "snapshot": snapshot,
+                          "timings_log": Path(timings_log).absolute() if timings_log is not None else None}
+    if result_cache is not None:
+        # Hash the rubric and its values once: workers inherit the memorized hash.
+        result_cache.hash_rubric(rubric_path_absolute, rubric_path_absolute.parent / TEST_SUITE_VALUES_DIR)
+
+    environments = []
+    for submission_dir in sorted(submissions_dir_absolute.iterdir()):
+        if not submission_dir.is_dir() or submission_dir.name.startswith("."):
+            continue
+        environments.append(Environment(
+            submission_dir=submission_dir,
+            rubric_path=rubric_path_absolute,
+            test_values_path=rubric_path_absolute.parent / TEST_SUITE_VALUES_DIR,
+            results_path=submission_dir / RESULTS_JSON
+        ))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if fork_server is None:
+        fork_server = fork_is_supported() and "matlab" not in rubric.supported_platforms
+    if fork_server:
+        # Import everything grading needs once: forked children inherit it, alongside with the rubric.
+        preload_modules(get_runtime_modules(rubric, rubric_path_absolute))
+        _init_batch_worker(run_grader_options)
+        exit_codes = ForkServerPool(workers=workers).map(_grade_forked_submission, environments)
+        return_codes = {environment.submission_dir.name: code for environment, code in zip(environments, exit_codes)}
+    else:
+        # Workers are long-lived: each one receives the rubric once, when it starts,
+        # and then grades submissions one by one as they come.
+        with Pool(processes=max(1, min(workers, len(environments) or 1)),
+                  initializer=_init_batch_worker,
+                  initargs=(run_grader_options,)) as pool:
+            return_codes = dict(pool.imap_unordered(_grade_batch_submission, environments, chunksize=1))
+
+    summary = [get_batch_summary_entry(environment, return_codes.get(environment.submission_dir.name, -1))
+               for environment in environments]
+    write_batch_summary(summary, submissions_dir_absolute, verb="Graded")
+    return summary
+
+
+@click.command(
+    help="Regrades all submissions from a directory using the snapshots of their variables"
+)
+@click.version_option(
+    version=__version__
+)
+@click.argument(
+    "submissions_dir",
+)
+@click.argument(
+    "rubric_path",
+)
+def regrade_from_terminal(submissions_dir, rubric_path):
+    """
+    Wrapper function which is called when gsgrade_regrade is called from the terminal.
+
+    :param submissions_dir: path to the directory with one sub-directory per student's submission
+    :param rubric_path: path to the rubric's JSON file.
+    :return: 0 (zero) if everything goes okay, otherwise -1
+    """
+    try:
+        regrade(submissions_dir, rubric_path)
+    except UserFailure as e:
+        print(f"ERROR: {e}")
+        return -1
+    return 0
+
+
+def regrade(submissions_dir, rubric_path):
+    """
+    Regrades every submission from `submissions_dir` against a (possibly updated) rubric without executing it:
+    only the snapshots of variables, which were saved by grading with `snapshot=True`, are used.
+    Submissions without a snapshot (e.g. those which failed to execute) keep their results.json as it is.
+
+    :param submissions_dir: path to the directory with one sub-directory per student's submission
+    :param rubric_path: path to the rubric's JSON file.
+    :return: summary -- list of dictionaries with the grading outcome for every submission.
+    """
+    submissions_dir_absolute = Path(submissions_dir).absolute()
+    rubric_path_absolute = Path(rubric_path).absolute()
+    if not submissions_dir_absolute.is_dir():
+        raise UserFailure(f"Submissions directory does not exist: \n -> {submissions_dir_absolute}")
+    rubric = load_rubric(rubric_path_absolute, rubric_path_absolute.parent / TEST_SUITE_VALUES_DIR)
+
+    summary = []
+    for submission_dir in sorted(submissions_dir_absolute.iterdir()):
+        if not submission_dir.is_dir() or submission_dir.name.startswith("."):
+            continue
+        environment = Environment(
+            submission_dir=submission_dir,
+            rubric_path=rubric_path_absolute,
+            test_values_path=rubric_path_absolute.parent / TEST_SUITE_VALUES_DIR,
+            results_path=submission_dir / RESULTS_JSON,
+            max_number_of_attempts=rubric.number_of_attempts,
+            max_score=rubric.total_score
+        )
+        snapshot_path = environment.results_path.parent / VARIABLES_SNAPSHOT_DIR
+        if not snapshot_path.is_dir():
+            entry = get_batch_summary_entry(environment, -1)
+            entry["output"] = f"No snapshot of variables, the results are left as they are: \n -> {snapshot_path}"
+            summary.append(entry)
+            continue
+        try:
+            snapshot = load_values(snapshot_path)
+            results = get_grades(rubric, snapshot.metadata.get("platform", "python"), snapshot)
+            environment.write_results(results=results)
+            return_code = 0
+        except Exception as e:
+            environment.write_exception(exception=e)
+            return_code = -1
+        summary.append(get_batch_summary_entry(environment, return_code))
+    write_batch_summary(summary, submissions_dir_absolute, verb="Regraded")
+    return summary
+
+
+# Arguments of `run_grader` (the rubric, the results cache etc.) which are shared by all submissions graded by
+# a batch worker process. They are set once per process by `_init_batch_worker`.
+_batch_run_grader_options = {}
+
+
+def _init_batch_worker(run_grader_options):
+    global _batch_run_grader_options
+    _batch_run_grader_options = run_grader_options
+
+
+def _grade_batch_submission(environment: Environment):
+    return environment.submission_dir.name, run_grader(environment, **_batch_run_grader_options)
+
+
+def _grade_forked_submission(environment: Environment):
+    return 0 if run_grader(environment, **_batch_run_grader_options) == 0 else 1
+
+
+def write_batch_summary(summary: list, submissions_dir: Path, verb="Graded"):
+    """
+    Writes the summary of a batch to `submissions_dir` and reports how many submissions succeeded.
+
+    :param summary: list of entries from `get_batch_summary_entry`
+    :param submissions_dir: directory with the submissions
+    :param verb: what was done to the submissions, for the report
+    :return: None
+    """
+    with open(submissions_dir / BATCH_SUMMARY_JSON, "w") as f:
+        json.dump(summary, f, indent=4)
+    succeeded = sum(1 for entry in summary if entry["success"])
+    print(f"{verb} {succeeded}/{len(summary)} submissions successfully: \n-> {submissions_dir / BATCH_SUMMARY_JSON}")
+
+
+def get_batch_summary_entry(environment: Environment, return_code: int):
+    """
+    Summarizes the results of one submission graded in a batch.
+
+    :param environment: Environment which the submission was graded in.
+    :param return_code: what `run_grader` returned for this submission.
+    :return: dictionary with the submission's name, score, and whether the grading succeeded.
+    """
+    entry = {"submission": environment.submission_dir.name, "score": 0, "success": return_code == 0}
+    try:
+        with open(environment.results_path, "r") as f:
+            results = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        entry["success"] = False
+        entry["output"] = f"No results were produced: {e}"
+        return entry
+    entry["score"] = results.get("score", 0)
+    if not entry["success"]:
+        # Keep the error message so that failures can be investigated without opening every results.json
+        entry["output"] = results.get("output", "")
+    return entry
+
+
+def load_rubric(rubric_path: Path, test_values_path: Path, timer: PhaseTimer = None):
+    """
+    Loads a rubric from a JSON file and attaches the true values of its test suite's variables.
+
+    :param rubric_path: path to the rubric's JSON file.
+    :param test_values_path: path to the values store with the test suite's true values.
+    :param timer: PhaseTimer to record the loading phases to, if any.
+    :return: an instance of Rubric with `test_suite_values` attached.
+    """
+    if timer is None:
+        timer = PhaseTimer()
+    # Load a rubric from a JSON file
+    with timer.phase("load_rubric"):
+        rubric = Rubric.from_json(rubric_path)
+    # Open true variables for the rubric's variables and attaches them to the rubric.
+    # Values are memory-mapped and read lazily, only when a test needs them.
+    with timer.phase("load_values"):
+        rubric.test_suite_values = load_values(test_values_path)
+    return rubric
 
 
-def run_grader(environment: Environment):
+def run_grader(environment: Environment, rubric: Rubric = None, result_cache: ResultCache = None,
+               snapshot=False, timings_log: Path = None, profiler=None):
     """
     Contains high-level grading logic. Navigates the outer world via `environment`.
 
     :param environment: An instance of Environment class
+    :param rubric: An instance of Rubric with `test_suite_values` attached. If not provided,
+            it's loaded from `environment.rubric_path` and `environment.test_values_path`.
+    :param result_cache: ResultCache to reuse results of identical submissions from. If the submission
+            is found there, it's not executed at all.
+    :param snapshot: if True, the submission's values of the rubric's variables are saved to
+            a values store next to the results, so that the submission can be regraded without execution,
+            see `regrade`.
+    :param timings_log: path to a JSON-lines log to append the timings of the grading phases to, if any.
+            The timings are also saved to `results["extra_data"]["timings"]`.
+    :param profiler: cProfile.Profile to profile the grading with, if any. The execution of the student's
+            code is excluded from the profile.
     :return: 0 (zero) if everything goes okay, otherwise -1
     """
+    executor = None
+    timer = PhaseTimer()
+    return_code = -1
     try:
-        # Load a rubric from a JSON file
-        rubric = Rubric.from_json(environment.rubric_path)
-        # Read true variables for the rubric's variables and attaches them to the rubric
-        with open(environment.test_values_path, 'rb') as f:
-            rubric.test_suite_values = pickle.load(f)
-        # Environment needs some extra information to the rubric to write results correctly.
-        environment.max_number_of_attempts = rubric.number_of_attempts
-        environment.max_score = rubric.total_score
-        # Identify the main submission file's name.
-        submission_file_path = get_submission_file_path(environment.submission_dir,
-                                                        main_file_name=rubric.main_file_name)
-        # Copy extra files, if any, to the submission's directory
-        for extra_file in rubric.extra_files:
-            shutil.copyfile(environment.rubric_path.parent / extra_file, environment.submission_dir / extra_file)
-        # Initialize an Executor and execute the submission file
-        executor = Executor(supported_platforms=rubric.supported_platforms,
-                            matlab_config=rubric.matlab_config)
-        platform, submission_variables = executor.execute(submission_file_path)
-        # Generates grading results based on rubric, true variables, and submission variables.
-        results = get_grades(rubric, platform, submission_variables)
-        # Write down results
-        environment.write_results(results=results)
-        return 0
+        with profiling(profiler):
+            if rubric is None:
+                rubric = load_rubric(environment.rubric_path, environment.test_values_path, timer=timer)
+            # Environment needs some extra information to the rubric to write results correctly.
+            environment.max_number_of_attempts = rubric.number_of_attempts
+            environment.max_score = rubric.total_score
+            # Identify the main submission file's name.
+            with timer.phase("find_submission"):
+                submission_file_path = get_submission_file_path(environment.submission_dir,
+                                                                main_file_name=rubric.main_file_name)
+            snapshot_path = environment.results_path.parent / VARIABLES_SNAPSHOT_DIR
+            # Look up results of an identical submission, if caching is on
+            cache_key = None
+            if result_cache is not None:
+                with timer.phase("cache_lookup"):
+                    cache_key = result_cache.get_key(environment.submission_dir,
+                                                     rubric_path=environment.rubric_path,
+                                                     test_values_path=environment.test_values_path,
+                                                     ignored_files=list(rubric.extra_files) + [
+                                                         RESULTS_JSON, VARIABLES_SNAPSHOT_DIR])
+                    results = result_cache.get(cache_key)
+                # Cached results are of no use when a snapshot is needed but was not saved with the same submission
+                snapshot_is_current = get_snapshot_key(snapshot_path) == cache_key
+                if results is not None and (not snapshot or snapshot_is_current):
+                    # A snapshot of another submission must not stay next to these results
+                    if not snapshot_is_current and snapshot_path.exists():
+                        shutil.rmtree(snapshot_path)
+                    results.setdefault("extra_data", {})["timings"] = timer.phases
+                    environment.write_results(results=results)
+                    return_code = 0
+                    return return_code
+            # Drop the previous snapshot, if any: it must not outlive the results it was taken with
+            if snapshot_path.exists():
+                shutil.rmtree(snapshot_path)
+            # Copy extra files, if any, to the submission's directory
+            for extra_file in rubric.extra_files:
+                shutil.copyfile(environment.rubric_path.parent / extra_file,
+                                environment.submission_dir / extra_file)
+            # Initialize an Executor and execute the submission file
+            executor = Executor(supported_platforms=rubric.supported_platforms,
+                                matlab_config=rubric.matlab_config,
+                                resource_limits=rubric.get_resource_limits(),
+                                variables_to_take=rubric.get_test_variables(),
+                                function_tests=rubric.get_function_tests(rubric.test_suite_values),
+                                headless=rubric.headless)
+            with timer.phase("execute"), not_profiling(profiler):
+                platform, submission_variables = executor.execute(submission_file_path)
+            if snapshot:
+                with timer.phase("snapshot"):
+                    save_values(submission_variables, snapshot_path,
+                                metadata={"platform": platform, "cache_key": cache_key})
+            # Performance tests compare the submission's time with the reference solution's one on this machine
+            reference_values = None
+            if rubric.needs_reference_solution():
+                with timer.phase("time_reference"), not_profiling(profiler):
+                    reference_values = time_reference_solution(rubric, environment.rubric_path.parent,
+                                                               submission_variables)
+            # Generates grading results based on rubric, true variables, and submission variables.
+            with timer.phase("grade"):
+                results = get_grades(rubric, platform, submission_variables, reference_values=reference_values)
+            if cache_key is not None:
+                result_cache.put(cache_key, results)
+            # Write down results alongside with the last output of the student's code, and the timings
+            results["extra_data"]["timings"] = timer.phases
+            environment.write_results(results=results, captured_output=executor.captured_output)
+            return_code = 0
+            return return_code
     except Exception as e:
         # If, at any point above, something goes wrong,
         # write the result with error details
-        environment.write_exception(exception=e)
-        return -1
+        environment.write_exception(exception=e,
+                                    captured_output=executor.captured_output if executor is not None else None,
+                                    timings=timer.phases)
+        return return_code
+    finally:
+        if timings_log is not None:
+            timer.write_log(timings_log, submission=str(environment.submission_dir), return_code=return_code)
+
+
+def get_snapshot_key(snapshot_path: Path):
+    """
+    Finds which submission a snapshot of variables was saved for, see `run_grader`.
+
+    :param snapshot_path: path to the snapshot's values store
+    :return: the submission's key in the result cache (see `ResultCache.get_key`), or None if the snapshot
+            does not exist, is incomplete, or was saved without a result cache.
+    """
+    if not snapshot_path.is_dir():
+        return None
+    try:
+        return load_values(snapshot_path).metadata.get("cache_key", None)
+    except Exception:
+        return None
+
+
+def time_reference_solution(rubric: Rubric, source_dir: Path, submission_variables: dict):
+    """
+    Executes the reference solution which comes with the archive, and times its functions for the rubric's
+    performance tests, so that submissions are compared with the reference on the same machine.
+    Only the tests which the submission's functions were timed for are run.
+
+    :param rubric: An instance of Rubric with `test_suite_values` attached.
+    :param source_dir: directory with the rubric and the reference solution
+    :param submission_variables: variables from the submission, with its measurements
+    :return: dictionary "test's value name" - "measurement", see `run_performance_test`,
+            or None if the reference solution can't be timed. Then the measurements taken when the archive
+            was built are used.
+    """
+    reference_paths = [source_dir / (REFERENCE_SOLUTION + suffix) for platform in ("python", "jupyter")
+                       for suffix in all_supported_platforms[platform]]
+    reference_paths = [path for path in reference_paths if path.exists()]
+    if len(reference_paths) == 0:
+        return None
+    timed_names = [name for name, value in submission_variables.items()
+                   if isinstance(value, dict) and value.get("seconds", None) is not None]
+    performance_tests = [test for test in rubric.get_function_tests(rubric.test_suite_values)
+                         if test["type"] == "performance" and test["name"] in timed_names]
+    if len(performance_tests) == 0:
+        return None
+    executor = Executor(resource_limits=rubric.get_resource_limits(),
+                        variables_to_take=[],
+                        function_tests=performance_tests,
+                        headless=rubric.headless)
+    try:
+        _, reference_values = executor.execute(reference_paths[0])
+    except Exception as e:
+        print(f"WARNING: the reference solution can't be timed, the timings from packaging are used: {e}")
+        return None
+    # Only the successful measurements are used
+    return {name: measurement for name, measurement in reference_values.items()
+            if isinstance(measurement, dict) and measurement["seconds"] is not None}
 
 
 # TODO why do we have a submission_path on the environment if we're just going
@@ -191,7 +682,7 @@ def get_submission_file_path(submission_dir: Path, main_file_name=None):
     return main_file
 
 
-def get_grades(rubric: Rubric, platform: str, solution: dict):
+def get_grades(rubric: Rubric, platform: str, solution: dict, reference_values: dict = None):
     """
     Grade student's solution results
 
@@ -199,6 +690,8 @@ def get_grades(rubric: Rubric, platform: str, solution: dict):
     :param platform: Solution's platform. Does not affect grades, only used for getting
                     language-specific hints.
     :param solution: variables from student's submission
+    :param reference_values: measurements of the reference solution's performance taken on the grading machine,
+                    see `time_reference_solution`. If not provided, the ones taken when the archive was built are used.
     :return: results -- dictionary obeying Gradescope formatting for results.json if everything goes okay,
                     otherwise raises an error.
     """
@@ -216,7 +709,8 @@ def get_grades(rubric: Rubric, platform: str, solution: dict):
     # Iterate over tests in the rubric and compare their values from `rubric.test_suite_values`
     # with the ones from the student submission
     for i, test in enumerate(rubric.test_suite):
-        true_answer = rubric.test_suite_values[test["variable_name"]]
+        value_name = get_test_value_name(test)
+        true_answer = rubric.test_suite_values[value_name]
         test_result = {
             "name": f"{i + 1}. {test['test_name']}",
             "score": 0,
@@ -228,74 +722,36 @@ def get_grades(rubric: Rubric, platform: str, solution: dict):
 
         results["tests"].append(test_result)
 
-        # Get student's answer and simplify its type, if possible
-        answer = solution.get(test["variable_name"], None)
-        if answer is None:
-            test_result["output"] = (f"Variable {test['variable_name']} is not defined in your solution file. " +
-                                     get_hint(test, "hint_not_defined", platform))
+        # Get student's answer
+        answer = solution.get(value_name, None)
+        if get_test_type(test) == "performance":
+            reference_measurement = (reference_values or {}).get(value_name, None) or true_answer
+            test_result["output"], fraction, seconds = check_performance(test, answer, true_answer,
+                                                                          reference_measurement, platform)
+            test_result["score"] = round(test["score"] * fraction, 2)
+            total_score += test_result["score"]
+            if seconds is not None:
+                # Gradescope shows the leaderboard's entries on the assignment's leaderboard, fastest first
+                results.setdefault("leaderboard", []).append({"name": test["test_name"], "value": round(seconds, 6),
+                                                              "order": "asc"})
             continue
-
-        try:
-            reduced_answer = reduce_type(answer)
-        except GspackFailure:
-            # This is a student's failure.
-            test_result["output"] = f"Variable {test['variable_name']} has an unrecognized type. "
+        if get_test_type(test) == "memory":
+            test_result["output"], passed = check_memory(test, answer, true_answer, platform)
+            if passed:
+                test_result["score"] = test["score"]
+                total_score += test["score"]
             continue
-
-        # The error from this one is not captured here because
-        # if it happens then it's an error which is a result of a bug in gspack which happened when
-        # the rubric was created, so the whole process should be aborted.
-        reduced_true_answer = reduce_type(true_answer)
-
-        # Check whether types match
-        if not ((type(reduced_answer) == type(reduced_true_answer)) or (
-                type(reduced_answer) in (float, int) and (type(reduced_true_answer) in (float, int)))):
-            test_result[
-                "output"] = (f"Wrong answer type: the type of your variable {test['variable_name']}" +
-                             f" is {print_reduced_type(reduced_answer)}, " +
-                             f"but it should be a {print_reduced_type(reduced_true_answer)}. ")
-            test_result["output"] += get_hint(test, "hint_wrong_type", platform)
-
+        if get_test_type(test) == "function":
+            feedback = check_function_outputs(test, answer, true_answer, platform)
+        elif answer is None:
+            feedback = (f"Variable {test['variable_name']} is not defined in your solution file. " +
+                        get_hint(test, "hint_not_defined", platform))
+        else:
+            feedback = check_answer(test, answer, true_answer, platform, f"variable {test['variable_name']}")
+        if feedback is not None:
+            test_result["output"] = feedback
             continue
 
-        if (type(reduced_answer) is np.ndarray) or (type(reduced_answer) is float):
-            # Check whether dimensions match in case when the answers are arrays
-            if (type(reduced_answer) is np.ndarray) and (type(reduced_true_answer) is np.ndarray):
-                if reduced_answer.shape != reduced_true_answer.shape:
-                    test_result[
-                        "output"] = (f"Wrong dimensions: the shape of your variable" +
-                                     f" {test['variable_name']} is {reduced_answer.shape}, " +
-                                     f"but it should be {reduced_true_answer.shape}. ")
-                    test_result["output"] += get_hint(test, "hint_wrong_size", platform)
-                    continue
-
-                if reduced_answer.dtype != reduced_true_answer.dtype:
-                    test_result[
-                        "output"] = (f"Wrong data type of the array: the data type" +
-                                     f" of your array {test['variable_name']} is {reduced_answer.dtype}, " +
-                                     f"but it should be {reduced_true_answer.dtype}. ")
-                    test_result["output"] += get_hint(test, "hint_wrong_type", platform)
-                    continue
-            # Check whether there are NaNs in the answer
-            if np.isnan(reduced_answer).any():
-                test_result["output"] = f"Your variable {test['variable_name']} contains NaNs. "
-                test_result["output"] += get_hint(test, "hint_nans", platform)
-                continue
-
-            # Check if the answers are close enough
-            rtol = float(test.get("rtol", None) or 1e-5)
-            atol = float(test.get("atol", None) or 1e-8)
-            if not np.allclose(reduced_answer, reduced_true_answer, rtol=rtol, atol=atol):
-                test_result["output"] = f"Your answer is not within tolerance from the right answer. "
-                test_result["output"] += get_hint(test, "hint_tolerance", platform)
-                continue
-
-        # Strings are compared in lower capital.
-        elif type(reduced_answer) == str:
-            if not reduced_answer.lower().strip() == reduced_true_answer.lower().strip():
-                test_result["output"] = f"Your answer does not match the right answer. "
-                continue
-
         test_result["output"] = "Correct."
         test_result["score"] = test["score"]
         total_score += test["score"]
@@ -303,10 +759,307 @@ def get_grades(rubric: Rubric, platform: str, solution: dict):
     return results
 
 
+def check_answer(test, answer, true_answer, platform, subject):
+    """
+    Compares a student's answer with the right one.
+
+    :param test: test from the rubric, with the tolerances and the hints
+    :param answer: student's answer
+    :param true_answer: the right answer
+    :param platform: Solution's platform, for language-specific hints.
+    :param subject: what the answer is, for the feedback, e.g. "variable x".
+    :return: feedback for the student if the answer is wrong, or None if it's right.
+    """
+    # Simplify the answer's type, if possible
+    try:
+        reduced_answer = reduce_type(answer)
+    except GspackFailure:
+        # This is a student's failure.
+        return f"{subject[0].upper()}{subject[1:]} has an unrecognized type. "
+
+    # The error from this one is not captured here because
+    # if it happens then it's an error which is a result of a bug in gspack which happened when
+    # the rubric was created, so the whole process should be aborted.
+    reduced_true_answer = reduce_type(true_answer)
+
+    # A sparse matrix can be compared with a dense one, which is converted to sparse then
+    if is_sparse_matrix(reduced_answer) != is_sparse_matrix(reduced_true_answer):
+        reduced_answer, reduced_true_answer = [
+            to_canonical_csr(value) if type(value) is np.ndarray and value.ndim == 2 else value
+            for value in (reduced_answer, reduced_true_answer)]
+
+    # Check whether types match
+    if not ((type(reduced_answer) == type(reduced_true_answer)) or (
+            type(reduced_answer) in (float, int) and (type(reduced_true_answer) in (float, int)))):
+        return (f"Wrong answer type: the type of your {subject}" +
+                f" is {print_reduced_type(reduced_answer)}, " +
+                f"but it should be a {print_reduced_type(reduced_true_answer)}. " +
+                get_hint(test, "hint_wrong_type", platform))
+
+    if (type(reduced_answer) is np.ndarray) or (type(reduced_answer) is float) or is_sparse_matrix(reduced_answer):
+        # Check whether dimensions match in case when the answers are arrays
+        if type(reduced_answer) is not float and type(reduced_true_answer) is not float:
+            if reduced_answer.shape != reduced_true_answer.shape:
+                return (f"Wrong dimensions: the shape of your {subject} is {reduced_answer.shape}, " +
+                        f"but it should be {reduced_true_answer.shape}. " +
+                        get_hint(test, "hint_wrong_size", platform))
+
+            # Sparse matrices of floats and of complex numbers are compared by their values
+            if reduced_answer.dtype != reduced_true_answer.dtype and not is_sparse_matrix(reduced_answer):
+                return (f"Wrong data type of the array: the data type" +
+                        f" of your {subject} is {reduced_answer.dtype}, " +
+                        f"but it should be {reduced_true_answer.dtype}. " +
+                        get_hint(test, "hint_wrong_type", platform))
+        verdict = compare_numbers(test, reduced_answer, reduced_true_answer)
+
+        # Check whether there are NaNs in the answer
+        if verdict == "nans":
+            return f"Your {subject} contains NaNs. " + get_hint(test, "hint_nans", platform)
+
+        # Check if the answers are close enough
+        if verdict == "tolerance":
+            return f"Your answer is not within tolerance from the right answer. " + \
+                   get_hint(test, "hint_tolerance", platform)
+
+    # Strings are compared in lower capital.
+    elif type(reduced_answer) == str:
+        if not reduced_answer.lower().strip() == reduced_true_answer.lower().strip():
+            return f"Your answer does not match the right answer. "
+    return None
+
+
+def compare_numbers(test, reduced_answer, reduced_true_answer):
+    """
+    Compares numbers or arrays of the same shape and data type with the test's tolerances.
+
+    :param test: test from the rubric, with its tolerances
+    :param reduced_answer: student's answer, see `reduce_type`
+    :param reduced_true_answer: the right answer, see `reduce_type`
+    :return: None if the answer is within tolerance, "nans" if it contains NaNs, and "tolerance" otherwise.
+    """
+    rtol = float(test.get("rtol", None) or 1e-5)
+    atol = float(test.get("atol", None) or 1e-8)
+    if type(reduced_answer) is np.ndarray:
+        # Arrays are checked for NaNs and tolerance in one pass, chunk by chunk.
+        return compare_arrays(reduced_answer, reduced_true_answer, rtol=rtol, atol=atol)
+    elif is_sparse_matrix(reduced_answer):
+        return compare_sparse_matrices(reduced_answer, reduced_true_answer, rtol=rtol, atol=atol)
+    elif np.isnan(reduced_answer):
+        return "nans"
+    elif not np.isclose(reduced_answer, reduced_true_answer, rtol=rtol, atol=atol):
+        return "tolerance"
+    return None
+
+
+def check_function_outputs(test, outputs, true_outputs, platform):
+    """
+    Compares the outputs of a student's function with the right ones, see `run_function_test`.
+
+    :param test: function test from the rubric
+    :param outputs: list of the outputs of the student's function, one per input case
+    :param true_outputs: list of the right outputs
+    :param platform: Solution's platform, for language-specific hints.
+    :return: feedback for the student if any output is wrong, or None if all of them are right.
+    """
+    function_name = test["function_name"]
+    if outputs is None:
+        return (f"Outputs of your function {function_name} can not be checked. " +
+                "Make sure that it returns numbers, arrays, or strings. ")
+    if isinstance(outputs, FunctionCallFailure):
+        return f"{outputs.message} " + get_hint(test, "hint_not_defined", platform)
+    for i, output in enumerate(outputs):
+        if isinstance(output, FunctionCallFailure):
+            return f"Your function {function_name} failed for input #{i + 1}: {output.message} "
+    if len(outputs) != len(true_outputs):
+        raise GspackFailure(f"{test['test_name']}: {len(outputs)} outputs for {len(true_outputs)} input cases.")
+
+    # When all outputs are numbers or arrays of the same shape, they're compared at once
+    stacked_outputs = stack_outputs(outputs)
+    stacked_true_outputs = stack_outputs(true_outputs)
+    if (stacked_outputs is not None and stacked_true_outputs is not None
+            and stacked_outputs.shape == stacked_true_outputs.shape
+            and compare_numbers(test, stacked_outputs, stacked_true_outputs) is None):
+        return None
+    # Otherwise, or if some output is wrong, they're compared one by one, so that the first wrong one is reported
+    for i, (output, true_output) in enumerate(zip(outputs, true_outputs)):
+        feedback = check_answer(test, output, true_output, platform, f"output of {function_name}")
+        if feedback is not None:
+            return f"Your function {function_name} gives a wrong output for input #{i + 1}. " + feedback
+    return None
+
+
+def check_performance(test, measurement, true_measurement, reference_measurement, platform):
+    """
+    Scores the performance of a student's function. Its outputs must be right, see `check_function_outputs`,
+    and then the points are given by the test's speed curve, according to how much slower (or faster)
+    the function is than the reference one.
+
+    :param test: performance test from the rubric
+    :param measurement: measurement of the student's function, see `run_performance_test`
+    :param true_measurement: measurement of the reference function when the archive was built, with the right outputs
+    :param reference_measurement: measurement of the reference function to compare the time with
+    :param platform: Solution's platform, for language-specific hints.
+    :return: tuple: feedback for the student, fraction of the test's points, and the student's time in seconds
+            (None if the outputs are wrong).
+    """
+    outputs = measurement["outputs"] if isinstance(measurement, dict) else measurement
+    feedback = check_function_outputs(test, outputs, true_measurement["outputs"], platform)
+    if feedback is not None:
+        return feedback, 0, None
+    seconds = measurement["seconds"]
+    reference_seconds = max(reference_measurement["seconds"], 1e-9)
+    ratio = seconds / reference_seconds
+    speed_curve = test.get("speed_curve", None) or DEFAULT_SPEED_CURVE
+    fraction = float(np.interp(ratio, [float(point[0]) for point in speed_curve],
+                               [float(point[1]) for point in speed_curve]))
+    feedback = (f"Your function {test['function_name']} gives the right outputs and takes {seconds:.3g} seconds " +
+                f"on all the inputs, which is {ratio:.2f} times the time of the reference solution " +
+                f"({reference_seconds:.3g} seconds). You get {fraction:.0%} of the points for its speed.")
+    return feedback, fraction, seconds
+
+
+def check_memory(test, measurement, true_measurement, platform):
+    """
+    Checks that a student's function gives the right outputs (see `check_function_outputs`) and fits into
+    the test's memory budget: `memory_budget` times the peak memory of the reference function,
+    plus `memory_slack` megabytes.
+
+    :param test: memory test from the rubric
+    :param measurement: measurement of the student's function, see `run_memory_test`
+    :param true_measurement: measurement of the reference function, with the right outputs
+    :param platform: Solution's platform, for language-specific hints.
+    :return: tuple: feedback for the student with the measured peak memory, and whether the function passes.
+    """
+    outputs = measurement["outputs"] if isinstance(measurement, dict) else measurement
+    feedback = check_function_outputs(test, outputs, true_measurement["outputs"], platform)
+    if feedback is not None:
+        return feedback, False
+    peak_memory = measurement["peak_memory"]
+    if peak_memory is None:
+        return "The memory used by your function can not be measured. ", False
+    memory_slack = test.get("memory_slack", None)
+    budget = (float(test.get("memory_budget", None) or DEFAULT_MEMORY_BUDGET) * true_measurement["peak_memory"] +
+              float(DEFAULT_MEMORY_SLACK_MB if memory_slack is None else memory_slack) * 1024 ** 2)
+    feedback = (f"Your function {test['function_name']} gives the right outputs and allocates at most " +
+                f"{peak_memory / 1024 ** 2:.2f} MB on top of its arguments. The budget is {budget / 1024 ** 2:.2f} MB" +
+                f" (the reference solution allocates {true_measurement['peak_memory'] / 1024 ** 2:.2f} MB). ")
+    if peak_memory > budget:
+        return feedback + get_hint(test, "hint_memory", platform), False
+    return feedback, True
+
+
+def stack_outputs(outputs):
+    """
+    Stacks the outputs of a function's calls into one array, if all of them are numbers,
+    or arrays of numbers of the same shape.
+
+    :param outputs: list of outputs
+    :return: array of floats with the outputs along its first axis, or None if they can't be stacked.
+    """
+    reduced_outputs = []
+    for output in outputs:
+        if isinstance(output, (str, FunctionCallFailure)):
+            return None
+        try:
+            reduced_output = reduce_type(output)
+        except GspackFailure:
+            return None
+        if not isinstance(reduced_output, (float, np.ndarray)):
+            return None
+        reduced_outputs.append(reduced_output)
+    if len(reduced_outputs) == 0 or len(set(np.shape(output) for output in reduced_outputs)) != 1:
+        return None
+    return np.array(reduced_outputs, dtype=float)
+
+
+def compare_arrays(answer: np.ndarray, true_answer: np.ndarray, rtol=1e-5, atol=1e-8,
+                   chunk_size=COMPARISON_CHUNK_SIZE):
+    """
+    Compares two arrays of the same shape chunk by chunk, so that the extra memory it needs is bounded
+    by `chunk_size` regardless of the arrays' sizes. Gives the same verdict as checking
+    `np.isnan(answer).any()` first and then `np.allclose(answer, true_answer, rtol=rtol, atol=atol)`.
+
+    :param answer: student's answer
+    :param true_answer: the right answer
+    :param rtol: relative tolerance
+    :param atol: absolute tolerance
+    :param chunk_size: number of elements which are compared at once
+    :return: None if the answer is within tolerance, "nans" if it contains NaNs, and "tolerance" otherwise.
+    """
+    within_tolerance = True
+    # nditer walks both arrays in the same order, whatever their memory layouts are,
+    # and yields them in chunks of at most `chunk_size` elements.
+    chunks = np.nditer([answer, true_answer],
+                       flags=["external_loop", "buffered", "zerosize_ok"],
+                       op_flags=[["readonly"], ["readonly"]],
+                       buffersize=chunk_size)
+    for answer_chunk, true_answer_chunk in chunks:
+        if np.isnan(answer_chunk).any():
+            return "nans"
+        # Once the answer is out of tolerance, the rest of it only needs to be checked for NaNs,
+        # since NaNs take precedence.
+        if within_tolerance and not np.isclose(answer_chunk, true_answer_chunk, rtol=rtol, atol=atol).all():
+            within_tolerance = False
+    return None if within_tolerance else "tolerance"
+
+
+def compare_sparse_matrices(answer, true_answer, rtol=1e-5, atol=1e-8):
+    """
+    Compares two sparse matrices of the same shape in the canonical CSR format (see `to_canonical_csr`)
+    on their stored entries only, so that the memory it needs is proportional to their numbers of nonzeros.
+    Gives the same verdict as `compare_arrays` on the dense matrices.
+
+    :param answer: student's answer
+    :param true_answer: the right answer
+    :param rtol: relative tolerance
+    :param atol: absolute tolerance
+    :return: None if the answer is within tolerance, "nans" if it contains NaNs, and "tolerance" otherwise.
+    """
+    # When the sparsity structures are the same, the stored values are compared directly
+    if np.array_equal(answer.indptr, true_answer.indptr) and np.array_equal(answer.indices, true_answer.indices):
+        return compare_arrays(answer.data, true_answer.data, rtol=rtol, atol=atol)
+
+    # Otherwise the stored values of both are placed on the union of the structures, with zeros where
+    # a matrix has no entry. Entries are identified by their positions in the flattened matrix,
+    # which are sorted since the matrices are canonical.
+    positions = [np.repeat(np.arange(matrix.shape[0], dtype=np.int64), np.diff(matrix.indptr)) * matrix.shape[1]
+                 + matrix.indices for matrix in (answer, true_answer)]
+    all_positions = np.union1d(positions[0], positions[1])
+    aligned_values = []
+    for matrix, matrix_positions in zip((answer, true_answer), positions):
+        values = np.zeros(len(all_positions), dtype=matrix.dtype)
+        values[np.searchsorted(all_positions, matrix_positions)] = matrix.data
+        aligned_values.append(values)
+    return compare_arrays(aligned_values[0], aligned_values[1], rtol=rtol, atol=atol)
+
+
+def to_canonical_csr(a):
+    """
+    Brings a sparse matrix (or a 2-D array) to the canonical CSR format of floats (complex numbers, if the matrix
+    is complex), in which two matrices have the same structure if and only if they have the same `indptr`
+    and `indices`: column indices are sorted within rows, and duplicates are summed. Only the stored entries
+    are copied, and only if they have to be.
+
+    :param a: SciPy sparse matrix or array, or a 2-D NumPy array
+    :return: `scipy.sparse.csr_matrix`
+    """
+    from scipy import sparse
+
+    # csr_matrix shares the data of a CSR matrix or array of floats instead of copying it.
+    # Complex data is kept complex: casting it to floats would drop the imaginary parts.
+    matrix = sparse.csr_matrix(a, dtype=complex if a.dtype.kind == "c" else float)
+    if not matrix.has_canonical_format:
+        if is_sparse_matrix(a) and np.shares_memory(matrix.data, a.data):
+            matrix = matrix.copy()
+        matrix.sum_duplicates()
+    return matrix
+
+
 def reduce_type(a):
     """
     Attempts to simplify the type of a: brings all numbers and matrices of one element to Python floats,
-    and all lists, sets, and NumPy arrays of any type to Numpy arrays of floats, if possible.
+    all lists, sets, and NumPy arrays of any type to Numpy arrays of floats, if possible,
+    and all SciPy sparse matrices to the canonical CSR format, see `to_canonical_csr`.
 
     Meant to make 3, 3.0+1e-16, and np.array([3], dtype=double) to be just 3.
 
@@ -315,14 +1068,26 @@ def reduce_type(a):
     """
     if isinstance(a, numbers.Number):
         return float(a)
-    elif isinstance(a, np.ndarray) and a.flatten().shape == (1,):
-        return float(a.flatten()[0])
+    elif isinstance(a, np.ndarray) and a.size == 1:
+        # reshape doesn't copy the array, unlike flatten
+        return float(a.reshape(-1)[0])
     elif isinstance(a, np.ndarray) or isinstance(a, list) or isinstance(a, set):
         try:
-            res = np.array(a, dtype=float)
+            # Arrays of floats are taken as they are, without a copy.
+            res = np.asarray(a, dtype=float) if isinstance(a, np.ndarray) else np.array(a, dtype=float)
         except Exception as e:
             raise GspackFailure(f"Conversion error to numpy array: {e}. \n Object: {a}")
         return res
+    elif is_sparse_matrix(a):
+        if np.prod(a.shape) == 1 and a.dtype.kind != "c":
+            return float(a.toarray().reshape(-1)[0])
+        if len(a.shape) != 2:
+            # Only 2-D sparse arrays have the CSR format
+            return reduce_type(a.toarray())
+        try:
+            return to_canonical_csr(a)
+        except Exception as e:
+            raise GspackFailure(f"Conversion error to sparse matrix: {e}. \n Object: {a!r}")
     else:
         return a
 
@@ -336,6 +1101,8 @@ def print_reduced_type(a):
     """
     if isinstance(a, numbers.Number):
         return "number"
+    elif is_sparse_matrix(a):
+        return f"sparse matrix of shape {a.shape}"
     elif isinstance(a, np.ndarray) or isinstance(a, list) or isinstance(a, set):
         try:
             res = np.array(a, dtype=float)
@@ -15,7 +15,7 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-import subprocess
+import io
 import sys
 from contextlib import contextmanager
 from pathlib import Path
@@ -44,31 +44,6 @@ class GspackFailure(Exception):
     pass
 
 
-def generate_requirements(path, output_path):
-    """
-    Generates a requirements.txt file using pipreqs package.
-
-    WARNING: pipreqs executes and scans ALL files in the `path` directory, related to the solution or not.
-    It's because it treats the `path` directory as a Python project's root and all .py files inside it,
-    including the ones in subdirectories, as the project's code. In past it led to many confusing situations
-    when pipreqs was failing to produce the file because the instructor had other python files in the same directory,
-    and those failed to execute.
-    Putting the solution file into a temporary folder is also not a solution because then we won't be able
-    to accommodate solutions with multiple files: how would you decide what is relevant and what is not?
-    The best advice to manage failures of this function is start with checking
-    whether there are irrelevant Python files in the directory.
-    Another solution would be to list all the packages explicitly in
-    "requirements" variable, in which case this function won't be called.
-
-    :param path: Path to the directory which contains the solution file.
-    :param output_path: Path where to save the requirements file
-    :return:
-    """
-    process = subprocess.Popen(["pipreqs", "--no-pin", "--savepath", f"{output_path}", f"{path}"], stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT)
-    return process.communicate()
-
-
 @contextmanager
 def redirected_output(new_stdout=None, new_stderr=None):
     """
@@ -91,6 +66,120 @@ def redirected_output(new_stdout=None, new_stderr=None):
         sys.stderr = save_stderr
 
 
+# How much of the student's output is kept, in bytes: only the last part of it is shown in the results.
+DEFAULT_OUTPUT_TAIL_SIZE = 64 * 1024
+
+
+class TailBuffer(io.TextIOBase):
+    """
+    Text stream which keeps only the last `capacity` bytes (UTF-8) of what was written to it,
+    in a fixed-size in-memory ring buffer, and counts the bytes which were dropped.
+    Meant for capturing the student's output: printing in a loop can't exhaust memory or the disk.
+    """
+    def __init__(self, capacity=DEFAULT_OUTPUT_TAIL_SIZE):
+        """
+        Creates an instance of TailBuffer.
+
+        :param capacity: how many last bytes to keep
+        """
+        super().__init__()
+        self.capacity = capacity
+        self.dropped_bytes = 0
+        self._buffer = bytearray(capacity)
+        # Position where the next byte goes, and how many bytes are kept
+        self._position = 0
+        self._size = 0
+        # Small writes are collected first and moved to the ring buffer in bulk, since `print` makes
+        # several writes per call, and each of them would be too slow to encode and copy separately.
+        self._pending = []
+        self._pending_length = 0
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if not isinstance(s, str):
+            raise TypeError(f"write() argument must be str, not {type(s).__name__}")
+        self._pending.append(s)
+        self._pending_length += len(s)
+        if self._pending_length >= self.capacity:
+            self._flush_pending()
+        return len(s)
+
+    def _flush_pending(self):
+        data = "".join(self._pending).encode("utf-8", errors="replace")
+        self._pending = []
+        self._pending_length = 0
+        if len(data) >= self.capacity:
+            # The new data alone fills the whole buffer
+            self.dropped_bytes += self._size + len(data) - self.capacity
+            self._buffer[:] = data[len(data) - self.capacity:]
+            self._position = 0
+            self._size = self.capacity
+            return
+        # Write the data after the current position, wrapping around the buffer's end if needed
+        end = self._position + len(data)
+        if end <= self.capacity:
+            self._buffer[self._position:end] = data
+        else:
+            split = self.capacity - self._position
+            self._buffer[self._position:] = data[:split]
+            self._buffer[:len(data) - split] = data[split:]
+        self._position = end % self.capacity
+        overflow = self._size + len(data) - self.capacity
+        if overflow > 0:
+            self.dropped_bytes += overflow
+            self._size = self.capacity
+        else:
+            self._size += len(data)
+
+    def getvalue(self):
+        """
+        Returns the kept tail of the output.
+
+        :return: string with the last (at most) `capacity` bytes of the output
+        """
+        self._flush_pending()
+        if self._size < self.capacity:
+            data = bytes(self._buffer[:self._size])
+        else:
+            data = bytes(self._buffer[self._position:] + self._buffer[:self._position])
+        # The tail might start in the middle of a multi-byte character
+        return data.decode("utf-8", errors="ignore")
+
+    def __getstate__(self):
+        # Streams can't be pickled, but the captured output has to be passed back from the sandbox.
+        value = self.getvalue()
+        return {"capacity": self.capacity, "dropped_bytes": self.dropped_bytes, "value": value}
+
+    def __setstate__(self, state):
+        self.__init__(state["capacity"])
+        self.write(state["value"])
+        self.dropped_bytes += state["dropped_bytes"]
+
+    def __reduce__(self):
+        return TailBuffer, (self.capacity,), self.__getstate__()
+
+
+def format_captured_output(captured_output: TailBuffer):
+    """
+    Formats the tail of the student's output for the results.
+
+    :param captured_output: TailBuffer with the output, or None
+    :return: string to append to the results' output; empty if there was no output.
+    """
+    if captured_output is None:
+        return ""
+    output = captured_output.getvalue()
+    if not output:
+        return ""
+    header = "Output of your code"
+    if captured_output.dropped_bytes > 0:
+        header += (f" (only the last {captured_output.capacity} bytes are shown," +
+                   f" {captured_output.dropped_bytes} bytes before them are dropped)")
+    return f"{header}:\n{output}\n"
+
+
 # List of all supported platforms with their extensions
 all_supported_platforms = {
     "python": [".py", ],
@@ -106,6 +195,10 @@ all_rubric_variables = [
     "supported_platforms",
     "extra_files",
     "main_file_name",
+    "time_limit",
+    "cpu_time_limit",
+    "memory_limit",
+    "headless",
 ]
 
 
@@ -122,3 +215,15 @@ def determine_platform(file_path: Path):
             if str(file_path).endswith(extension):
                 return platform
     return None
+
+
+def is_sparse_matrix(value):
+    """
+    Checks whether a value is a SciPy sparse matrix or array. SciPy is not imported for that:
+    if it has not been imported yet, the value can't be one.
+
+    :param value: any value
+    :return: True if the value is sparse
+    """
+    sparse = sys.modules.get("scipy.sparse", None)
+    return sparse is not None and sparse.issparse(value)
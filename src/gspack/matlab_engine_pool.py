@@ -0,0 +1,230 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import atexit
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from gspack.helpers import GspackFailure
+
+# MATLAB commands which bring an engine back to a clean state after a submission:
+# they drop all variables, globals, and cached functions, and close all figures and files.
+MATLAB_RESET_COMMAND = "clear all; clear global; close all force; fclose('all');"
+
+
+def start_matlab_engine():
+    """
+    Starts a new MATLAB engine. MATLAB Engine API is imported here so that this module
+    (and the pool in it) can be used without MATLAB installed.
+
+    :return: an instance of MATLAB engine
+    """
+    import matlab.engine
+    return matlab.engine.start_matlab()
+
+
+class _PooledEngine:
+    """
+    A MATLAB engine alongside with its state right after the start, which is restored after every use.
+    """
+    def __init__(self, engine, initial_path, initial_dir):
+        self.engine = engine
+        self.initial_path = initial_path
+        self.initial_dir = initial_dir
+
+
+class MatlabEnginePool:
+    """
+    Keeps MATLAB engines alive between executions, since starting an engine is by far
+    the slowest step of grading a MATLAB submission. Every engine is reset
+    (workspace cleared, figures closed, path and working directory restored) when it's returned to the pool,
+    and engines which fail to reset, e.g. because they crashed, are replaced by new ones.
+    """
+    def __init__(self, size=1, start_engine=start_matlab_engine):
+        """
+        Creates an instance of MatlabEnginePool. Engines are started lazily, on the first request.
+
+        :param size: maximal number of idle engines to keep alive.
+        :param start_engine: function which starts and returns a new engine.
+        """
+        self.size = size
+        self.start_engine = start_engine
+        self.engines_started = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def engine(self, working_dir: Path):
+        """
+        Provides an engine for one execution.
+
+        :param working_dir: directory which the engine is moved to before the execution
+        :return: context manager which yields a MATLAB engine
+        """
+        pooled_engine = self._acquire(working_dir)
+        try:
+            yield pooled_engine.engine
+        finally:
+            self._release(pooled_engine)
+
+    def close(self):
+        """
+        Quits all idle engines.
+
+        :return: None
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled_engine in idle:
+            _quit_quietly(pooled_engine.engine)
+
+    def _acquire(self, working_dir):
+        # Idle engines could have died while waiting in the pool: those are replaced by new ones.
+        while True:
+            with self._lock:
+                pooled_engine = self._idle.pop() if self._idle else None
+            if pooled_engine is None:
+                break
+            try:
+                pooled_engine.engine.cd(str(working_dir), nargout=0)
+                return pooled_engine
+            except Exception:
+                _quit_quietly(pooled_engine.engine)
+        pooled_engine = self._start()
+        try:
+            pooled_engine.engine.cd(str(working_dir), nargout=0)
+        except Exception as e:
+            _quit_quietly(pooled_engine.engine)
+            raise GspackFailure(f"MATLAB Engine can't access the directory {working_dir}: \n {e}.")
+        return pooled_engine
+
+    def _start(self):
+        try:
+            engine = self.start_engine()
+            initial_path = engine.path(nargout=1)
+            initial_dir = engine.cd(nargout=1)
+        except Exception as e:
+            raise GspackFailure(f"MATLAB Engine failed to start with the following error: \n {e}.")
+        self.engines_started += 1
+        return _PooledEngine(engine, initial_path, initial_dir)
+
+    def _release(self, pooled_engine):
+        engine = pooled_engine.engine
+        try:
+            engine.eval(MATLAB_RESET_COMMAND, nargout=0)
+            engine.path(pooled_engine.initial_path, nargout=0)
+            engine.cd(pooled_engine.initial_dir, nargout=0)
+        except Exception:
+            # The engine is likely dead. It's dropped and a new one will be started when needed.
+            _quit_quietly(engine)
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(pooled_engine)
+                return
+        _quit_quietly(engine)
+
+
+def _quit_quietly(engine):
+    try:
+        engine.quit()
+    except Exception:
+        pass
+
+
+_default_pool = None
+
+
+def get_default_pool():
+    """
+    Returns the pool shared by all MATLAB executions of the current process.
+    Its engines are quit when the process exits.
+
+    :return: an instance of MatlabEnginePool
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = MatlabEnginePool()
+        atexit.register(_default_pool.close)
+    return _default_pool
+
+
+class FakeMatlabEngine:
+    """
+    A stand-in for MATLAB engine which implements only what gspack uses: `eval`, `cd`, `path`, `quit`,
+    `workspace`, and calling scripts by their names. Scripts are Python functions which take the workspace
+    (a dictionary) and modify it. Meant for testing the engine pool and the executor without MATLAB.
+    """
+    def __init__(self, scripts=None, initial_dir="/", initial_path="/matlab/toolbox"):
+        """
+        Creates an instance of FakeMatlabEngine.
+
+        :param scripts: dictionary "script name" - "function(workspace)"
+        :param initial_dir: the engine's working directory after the start
+        :param initial_path: the engine's search path after the start
+        """
+        self.scripts = scripts if scripts is not None else {}
+        self.workspace = {}
+        self.current_dir = initial_dir
+        self.current_path = initial_path
+        self.commands = []
+        self.alive = True
+
+    def crash(self):
+        """
+        Simulates MATLAB crash: every following call raises an error.
+
+        :return: None
+        """
+        self.alive = False
+
+    def _check_alive(self):
+        if not self.alive:
+            raise RuntimeError("MATLAB process cannot be found")
+
+    def eval(self, command, nargout=0):
+        self._check_alive()
+        self.commands.append(command)
+        if command.startswith("clear all"):
+            self.workspace.clear()
+
+    def cd(self, new_dir=None, nargout=1):
+        self._check_alive()
+        previous_dir = self.current_dir
+        if new_dir is not None:
+            self.current_dir = new_dir
+        return previous_dir
+
+    def path(self, new_path=None, nargout=1):
+        self._check_alive()
+        previous_path = self.current_path
+        if new_path is not None:
+            self.current_path = new_path
+        return previous_path
+
+    def quit(self):
+        self.alive = False
+
+    def __getattr__(self, name):
+        scripts = self.__dict__.get("scripts", {})
+        if name not in scripts:
+            raise AttributeError(f"Undefined function or variable '{name}'.")
+
+        def run_script(nargout=0):
+            self._check_alive()
+            scripts[name](self.workspace)
+        return run_script
@@ -22,6 +22,7 @@ import io
 
 import matlab
 from gspack.helpers import UserFailure, GspackFailure, redirected_output
+from gspack.matlab_engine_pool import MatlabEnginePool, get_default_pool
 
 from pathlib import Path
 
@@ -73,7 +74,7 @@ def get_from_workspace(workspace, key: str, default=None):
     return item
 
 
-def execute_matlab(file_path: Path, matlab_config: dict):
+def execute_matlab(file_path: Path, matlab_config: dict, engine_pool: MatlabEnginePool = None):
     """
     Executes MATLAB solution script and returns variables from it's namespace.
 
@@ -82,31 +83,32 @@ def execute_matlab(file_path: Path, matlab_config: dict):
 
         - `variables_to_take`: list of variables' names which should be pulled from MATLAB's namespace
 
+    :param engine_pool: pool of MATLAB engines to take an engine from. Defaults to the pool shared
+            by the whole process, so that engines are reused between executions.
     :return: Dictionary "name" - "value" for variables listed in matlab_config["variables_to_take"]
     """
-    try:
-        # Launch MATLAB engione
-        eng = matlab.engine.start_matlab()
-    except Exception as e:
-        raise GspackFailure(f"MATLAB Engine failed to start with the following error: \n {e}.")
-    try:
-        # Execute MATLAB script
-        eval(f"eng.{file_path.stem}(nargout=0)")
-    except Exception as e:
-        err_msg = f"Exception occurred while executing your code: \n {str(e)}"
-        raise UserFailure(err_msg)
-    try:
-        # pull variables from MATLAB workspace `eng.workspace` into `workspace` dict.
-        # The reason to explicitly require the list of variables' names is because
-        # MATLAB engine and all its components die once the execution leaves this scope,
-        # so `return eng.workspace` would not work.
-        workspace = {}
-        variables_to_take = matlab_config.get("variables_to_take", ())
-        for name in variables_to_take:
-            item = get_from_workspace(eng.workspace, name)
-            if item is not None:
-                workspace[name] = matlab2python(item)
-        eng.quit()
-        return workspace
-    except Exception as e:
-        raise GspackFailure(f"Failure while exporting data from MATLAB environment: \n {str(e)}")
+    if engine_pool is None:
+        engine_pool = get_default_pool()
+    # Takes a running engine from the pool (or launches a new one), and moves it to the script's directory.
+    # The engine's workspace, path and working directory are reset once it's returned to the pool.
+    with engine_pool.engine(file_path.parent) as eng:
+        try:
+            # Execute MATLAB script
+            getattr(eng, file_path.stem)(nargout=0)
+        except Exception as e:
+            err_msg = f"Exception occurred while executing your code: \n {str(e)}"
+            raise UserFailure(err_msg)
+        try:
+            # pull variables from MATLAB workspace `eng.workspace` into `workspace` dict.
+            # The reason to explicitly require the list of variables' names is because
+            # the workspace is cleared once the engine is returned to the pool,
+            # so `return eng.workspace` would not work.
+            workspace = {}
+            variables_to_take = matlab_config.get("variables_to_take", ())
+            for name in variables_to_take:
+                item = get_from_workspace(eng.workspace, name)
+                if item is not None:
+                    workspace[name] = matlab2python(item)
+            return workspace
+        except Exception as e:
+            raise GspackFailure(f"Failure while exporting data from MATLAB environment: \n {str(e)}")
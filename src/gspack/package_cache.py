@@ -0,0 +1,262 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from gspack.__about__ import __version__
+from gspack.directories import PACKAGE_CACHE_DIR, PACKAGE_MANIFEST_JSON, SOLUTION_VALUES_DIR, AUTOGRADER_ZIP
+from gspack.requirements_scanner import find_local_sources
+from gspack.result_cache import hash_file
+from gspack.values_store import save_values, load_values
+
+# Version of the manifest's layout.
+MANIFEST_FORMAT = 1
+
+# Fields of function tests which affect what the solution's execution produces, see `PackageCache.get_execution_key`.
+# The others, like hints, scores, and tolerances, are only used when grading.
+FUNCTION_TEST_EXECUTION_FIELDS = ("type", "name", "function_name", "inputs", "call_time_limit", "repeat")
+
+
+class PackageCache:
+    """
+    Keeps the results of the slow steps of packaging next to the solution (in `.gspack_cache`),
+    so that packaging the same solution again only redoes the steps which inputs have changed:
+
+    - the variables from the solution's namespace, which are reused while the solution's sources
+      and extra files are unchanged;
+    - the requirements found by scanning the solution's imports, which are reused while the sources are unchanged,
+      and the imports of every scanned file, which are reused while the file's content is the same;
+    - the archive itself, which is not rebuilt at all when nothing has changed.
+
+    Inputs are identified by hashes of their content. The manifest also remembers the sizes and modification times
+    of the hashed files, so that files which were not touched since the previous packaging are not read again.
+    """
+    def __init__(self, solution_path: Path, force=False):
+        """
+        Opens the cache of the solution.
+
+        :param solution_path: path to the solution file
+        :param force: if True, the cached results are ignored (and overwritten as the packaging goes).
+        """
+        self.solution_path = Path(solution_path).absolute()
+        self.solution_dir = self.solution_path.parent
+        self.cache_dir = self.solution_dir / PACKAGE_CACHE_DIR / self.solution_path.name
+        self.manifest = {"format": MANIFEST_FORMAT, "files": {}}
+        if not force:
+            try:
+                with open(self.cache_dir / PACKAGE_MANIFEST_JSON, "r") as f:
+                    manifest = json.load(f)
+                if manifest.get("format", None) == MANIFEST_FORMAT:
+                    self.manifest = manifest
+            except (OSError, json.JSONDecodeError):
+                pass
+        # Imports of the scanned source files by their content's hash, see `find_requirements`.
+        self.import_cache = self.manifest.setdefault("imports", {})
+
+    def hash_files(self, paths):
+        """
+        Hashes files' contents. Files which size and modification time haven't changed since they were hashed
+        last time are not read again.
+
+        :param paths: list of paths to files
+        :return: dictionary "path" - "hex digest", or None for the files which don't exist.
+        """
+        hashes = {}
+        for path in paths:
+            path = str(Path(path).absolute())
+            try:
+                stat = os.stat(path)
+            except OSError:
+                hashes[path] = None
+                continue
+            stamp = [stat.st_size, stat.st_mtime_ns]
+            entry = self.manifest["files"].get(path, None)
+            if entry is None or entry["stamp"] != stamp:
+                digest = hashlib.sha256()
+                hash_file(Path(path), digest)
+                entry = {"stamp": stamp, "hash": digest.hexdigest()}
+                self.manifest["files"][path] = entry
+            hashes[path] = entry["hash"]
+        return hashes
+
+    def hash_sources(self):
+        """
+        Hashes the source files which the solution can run, alongside with the version of gspack:
+        for Python and Jupyter, the solution and the local modules which it imports (see `find_local_sources`),
+        and for MATLAB, which calls functions from the files in the current folder, the .m files
+        in the solution's directory. Other files in the directory don't matter.
+
+        :return: hex digest
+        """
+        if self.solution_path.suffix == ".m":
+            sources = sorted(path for path in self.solution_dir.iterdir() if path.suffix == ".m" and path.is_file())
+        else:
+            sources = find_local_sources(self.solution_path, import_cache=self.import_cache)
+        return _hash_json({"version": __version__, "sources": self.hash_files(sources)})
+
+    def get_execution_key(self, sources_hash, platform, matlab_config=None, function_tests=None):
+        """
+        Computes the key of the solution's execution.
+
+        :param sources_hash: hash of the sources, see `hash_sources`
+        :param platform: platform of the solution
+        :param matlab_config: configuration of MATLAB Engine the solution is executed with, if any
+        :param function_tests: tests which call the solution's functions during the execution, if any
+        :return: hex digest
+        """
+        key = {"sources": sources_hash, "platform": platform, "matlab_config": matlab_config}
+        if function_tests:
+            key["function_tests"] = [{field: test[field] for field in FUNCTION_TEST_EXECUTION_FIELDS if field in test}
+                                     for test in function_tests]
+        return _hash_json(key)
+
+    def get_solution_variables(self, execution_key, extra_files=None):
+        """
+        Looks up the variables from the solution's namespace.
+
+        :param execution_key: key from `get_execution_key`
+        :param extra_files: extra files listed in the rubric, if the rubric is known before the execution.
+        :return: dictionary "name" - "value", or None if the solution needs to be executed again.
+        """
+        entry = self.manifest.get("execution", None)
+        if entry is None or entry["key"] != execution_key:
+            return None
+        # The solution could read the extra files, so the values are only valid while the files are the same.
+        if extra_files is not None and sorted(entry["extra_files"]) != sorted(extra_files):
+            return None
+        paths = [self.solution_dir / extra_file for extra_file in entry["extra_files"]]
+        if list(self.hash_files(paths).values()) != list(entry["extra_files"].values()):
+            return None
+        try:
+            return dict(load_values(self.cache_dir / SOLUTION_VALUES_DIR))
+        except Exception:
+            return None
+
+    def put_solution_variables(self, execution_key, variables: dict, extra_files=()):
+        """
+        Saves the variables from the solution's namespace.
+
+        :param execution_key: key from `get_execution_key`
+        :param variables: dictionary "name" - "value"
+        :param extra_files: extra files listed in the rubric
+        :return: None
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # The values are saved to a temporary directory first, so that an interrupted packaging
+        # never leaves a partial store behind.
+        temp_dir = Path(tempfile.mkdtemp(dir=self.cache_dir))
+        try:
+            save_values(variables, temp_dir)
+            shutil.rmtree(self.cache_dir / SOLUTION_VALUES_DIR, ignore_errors=True)
+            os.replace(temp_dir, self.cache_dir / SOLUTION_VALUES_DIR)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        paths = [self.solution_dir / extra_file for extra_file in extra_files]
+        self.manifest["execution"] = {
+            "key": execution_key,
+            "extra_files": dict(zip(extra_files, self.hash_files(paths).values()))
+        }
+
+    def get_requirements(self, sources_hash):
+        """
+        Looks up the requirements which were generated for the solution.
+
+        :param sources_hash: hash of the sources, see `hash_sources`
+        :return: list of requirements, or None if they need to be generated again.
+        """
+        entry = self.manifest.get("requirements", None)
+        if entry is None or entry["key"] != sources_hash:
+            return None
+        return entry["requirements"]
+
+    def put_requirements(self, sources_hash, requirements):
+        """
+        Saves the requirements which were generated for the solution.
+
+        :param sources_hash: hash of the sources, see `hash_sources`
+        :param requirements: list of requirements
+        :return: None
+        """
+        self.manifest["requirements"] = {"key": sources_hash, "requirements": requirements}
+
+    def get_archive_key(self, execution_key, rubric, requirements=None, compression=None, extra_paths=()):
+        """
+        Computes the key of the archive: everything that the archive's content depends on.
+
+        :param execution_key: key from `get_execution_key`, which identifies the true values
+        :param rubric: the rubric
+        :param requirements: requirements generated for the solution, if any
+        :param compression: compression method of the archive
+        :param extra_paths: other files which are copied to the archive, e.g. MATLAB credentials
+        :return: hex digest
+        """
+        extra_paths = [self.solution_dir / extra_file for extra_file in rubric.extra_files] + list(extra_paths)
+        return _hash_json({
+            "execution": execution_key,
+            "rubric": rubric.to_dict(),
+            "rubric_requirements": rubric.requirements,
+            "matlab_credentials": rubric.matlab_credentials,
+            "requirements": requirements,
+            "compression": compression,
+            "files": self.hash_files(extra_paths),
+        })
+
+    def archive_is_current(self, archive_key):
+        """
+        Checks whether the archive next to the solution was built from the same inputs and was not changed since.
+
+        :param archive_key: key from `get_archive_key`
+        :return: True if the archive doesn't need to be rebuilt.
+        """
+        entry = self.manifest.get("archive", None)
+        if entry is None or entry["key"] != archive_key:
+            return False
+        try:
+            stat = os.stat(self.solution_dir / AUTOGRADER_ZIP)
+        except OSError:
+            return False
+        return entry["stamp"] == [stat.st_size, stat.st_mtime_ns]
+
+    def put_archive(self, archive_key):
+        """
+        Records that the archive next to the solution was built from the inputs identified by the key.
+
+        :param archive_key: key from `get_archive_key`
+        :return: None
+        """
+        stat = os.stat(self.solution_dir / AUTOGRADER_ZIP)
+        self.manifest["archive"] = {"key": archive_key, "stamp": [stat.st_size, stat.st_mtime_ns]}
+
+    def save(self):
+        """
+        Saves the manifest.
+
+        :return: None
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(temp_path, self.cache_dir / PACKAGE_MANIFEST_JSON)
+
+
+def _hash_json(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
@@ -14,10 +14,16 @@
 #     You should have received a copy of the GNU General Public License
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import cProfile
+import io
 import json
 import os
 import shutil
-from zipfile import ZipFile
+import stat
+import time
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA
 
 import click
 
@@ -27,8 +33,37 @@ from gspack.directories import *
 from gspack.directories import AUTOGRADER_ZIP
 from gspack.executor import Executor
 from gspack.helpers import UserFailure, GspackFailure, determine_platform
-from gspack.helpers import generate_requirements
-from gspack.rubric import Rubric
+from gspack.package_cache import PackageCache
+from gspack.requirements_scanner import find_requirements
+from gspack.rubric import Rubric, get_namespace_function_tests
+from gspack.timings import PhaseTimer, profiling, not_profiling
+from gspack.values_store import iter_value_files
+from gspack.wheel_builder import build_wheel, get_wheel_name, get_package_files
+
+# Compression methods which archives can be created with
+ARCHIVE_COMPRESSIONS = {
+    "deflated": ZIP_DEFLATED,
+    "stored": ZIP_STORED,
+    "bzip2": ZIP_BZIP2,
+    "lzma": ZIP_LZMA,
+}
+DEFAULT_ARCHIVE_COMPRESSION = "deflated"
+
+# All entries of an archive get the same timestamp (the earliest one zip supports),
+# so that archives built from the same inputs are byte-identical.
+ARCHIVE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Permissions of the archive's entries. All the others are 0o644.
+ARCHIVE_FILE_MODES = {
+    SETUP_FILE: 0o755,
+    RUN_AUTOGRADER_FILE: 0o755,
+    DEBUG_FILE: 0o755,
+    MATLAB_INSTALL_FILE: 0o755,
+    RSA_KEY: 0o600,
+}
+
+# Size of blocks in which files are copied into an archive.
+ARCHIVE_BLOCK_SIZE = 1024 ** 2
 
 
 @click.command(
@@ -43,58 +78,157 @@ from gspack.rubric import Rubric
     type=str,
     help="path to the rubric file"
 )
+@click.option(
+    "--timings-log",
+    default=None,
+    type=str,
+    help="JSON-lines file to append the timings of the packaging phases to"
+)
+@click.option(
+    "--profile",
+    default=None,
+    type=str,
+    help="file to save a cProfile dump of the packaging to (the solution's code is excluded)"
+)
+@click.option(
+    "--compression",
+    default=DEFAULT_ARCHIVE_COMPRESSION,
+    type=click.Choice(list(ARCHIVE_COMPRESSIONS)),
+    help="compression method of the archive"
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="ignore the results of previous packagings and redo everything"
+)
 @click.argument(
     'solution'
 )
-def create_autograder_from_terminal(solution, rubric, verbose=True):
+def create_autograder_from_terminal(solution, rubric, timings_log, profile, compression, force, verbose=True):
     """
     Wrapper function for creating autograder archives from a terminal.
 
     :param solution: path to solution file
     :param rubric: path to a rubric file (.json). If not provided then the rubric is assumed to be in the solution file.
+    :param timings_log: JSON-lines log for the timings, see `create_autograder`.
+    :param profile: path to save a cProfile dump to.
+    :param compression: compression method of the archive, see `create_archive`.
+    :param force: whether to ignore the results of previous packagings, see `create_autograder`.
     :param verbose: whether to print detailed outputs.
     :return: None
     """
-    return create_autograder(solution, rubric, verbose)
+    return create_autograder(solution, rubric, verbose, timings_log=timings_log, profile_path=profile,
+                             compression=compression, force=force)
 
 
-def create_autograder(solution, rubric=None, verbose=True):
+def create_autograder(solution, rubric=None, verbose=True, timings_log=None, profile_path=None,
+                      compression=DEFAULT_ARCHIVE_COMPRESSION, force=False):
     """
     Creates autograder archive based on the solution. The archive is named "autograder.zip", and
     is placed alongside the solution file.
 
+    Packaging is incremental: the results of its slow steps are kept in `.gspack_cache` next to the solution
+    (see `PackageCache`). The solution is executed again only when its sources or extra files have changed,
+    requirements are looked for again only when the sources have changed, and the archive is not rebuilt when nothing has.
+
     :param solution: path to solution file
     :param rubric: path to a rubric file (.json). If not provided then the rubric is assumed to be in the solution file.
     :param verbose: whether to print detailed outputs.
-    :return: None
+    :param timings_log: JSON-lines log to append the timings of the packaging phases to, if any.
+    :param profile_path: if provided, the packaging is profiled (except for the solution's own code),
+            and the cProfile dump is saved to this path.
+    :param compression: compression method of the archive, see `create_archive`.
+    :param force: if True, the results of previous packagings are ignored and everything is redone.
+    :return: path to the archive if it was created successfully, otherwise None.
     """
     solution_path = Path(solution).resolve()
+    timer = PhaseTimer()
+    profiler = cProfile.Profile() if profile_path is not None else None
     try:
-        platform = determine_platform(solution_path)
-
-        if rubric is not None:
-            # If path to a rubric file is provided then it's loaded first,
-            # and the rubric inside the solution file, if any, is ignored.
-            rubric_path = Path(rubric).resolve()
-            rubric = Rubric.from_json(rubric_path, verbose=verbose, solution_platform=platform)
-            # The solution file is executed, the variables from its namespace are stored in solution_variables
-            # See the docstring for Executor.execute() for more details.
-            _, solution_variables = Executor(verbose=True,
-                                             matlab_config=rubric.matlab_config).execute(solution_path)
-        else:
-            if platform == "matlab":
-                # For MATLAB solutions a separate rubric file has to be provided
-                # since there is no way to put it inside the solution file itself.
-                raise UserFailure("You need to provide a rubric file with your MATLAB solution.\n" +
-                                  "Use argument '--rubric path/to/rubric.json'")
-            _, solution_variables = Executor(verbose=True).execute(solution_path)
-            # When rubric is not provided as a separate file, gspack looks for it in the solution file's namespace.
-            rubric = Rubric.from_dict(solution_variables, verbose=verbose, solution_platform=platform)
-
-        # Scan the rubric and pull the values of variables from test suite from solution_variables.
-        # These values are going to be saved to autograder.zip alongside with the rubric.
-        rubric.fetch_values_for_tests(solution_variables)
-        create_archive(solution_path.parent / AUTOGRADER_ZIP, rubric=rubric, platform=platform, verbose=verbose)
+        with profiling(profiler):
+            platform = determine_platform(solution_path)
+            with timer.phase("hash_sources"):
+                cache = PackageCache(solution_path, force=force)
+                sources_hash = cache.hash_sources()
+
+            if rubric is not None:
+                # If path to a rubric file is provided then it's loaded first,
+                # and the rubric inside the solution file, if any, is ignored.
+                rubric_path = Path(rubric).resolve()
+                with timer.phase("load_rubric"):
+                    rubric = Rubric.from_json(rubric_path, verbose=verbose, solution_platform=platform)
+                # The solution file is executed, the variables from its namespace are stored in solution_variables
+                # See the docstring for Executor.execute() for more details.
+                # If neither the solution nor the extra files have changed since the previous packaging,
+                # the variables are taken from the cache instead.
+                # Outputs of the solution's functions are taken during the execution, so they depend on the tests too
+                execution_key = cache.get_execution_key(sources_hash, platform, rubric.matlab_config,
+                                                        function_tests=rubric.get_function_tests())
+                with timer.phase("execute"), not_profiling(profiler):
+                    solution_variables = cache.get_solution_variables(execution_key, rubric.extra_files)
+                    executed = solution_variables is None
+                    if executed:
+                        _, solution_variables = Executor(verbose=True,
+                                                         matlab_config=rubric.matlab_config,
+                                                         function_tests=rubric.get_function_tests(),
+                                                         headless=rubric.headless).execute(solution_path)
+            else:
+                if platform == "matlab":
+                    # For MATLAB solutions a separate rubric file has to be provided
+                    # since there is no way to put it inside the solution file itself.
+                    raise UserFailure("You need to provide a rubric file with your MATLAB solution.\n" +
+                                      "Use argument '--rubric path/to/rubric.json'")
+                execution_key = cache.get_execution_key(sources_hash, platform)
+                with timer.phase("execute"), not_profiling(profiler):
+                    solution_variables = cache.get_solution_variables(execution_key)
+                    executed = solution_variables is None
+                    if executed:
+                        # The function tests are only known once the solution defines its test suite
+                        _, solution_variables = Executor(verbose=True,
+                                                         function_tests=get_namespace_function_tests
+                                                         ).execute(solution_path)
+                # When rubric is not provided as a separate file,
+                # gspack looks for it in the solution file's namespace.
+                with timer.phase("load_rubric"):
+                    rubric = Rubric.from_dict(solution_variables, verbose=verbose, solution_platform=platform)
+            if executed:
+                cache.put_solution_variables(execution_key, solution_variables, rubric.extra_files)
+            else:
+                print(f"Solution and extra files are unchanged, re-using the results of its previous execution: " +
+                      f"\n-> {solution_path}")
+
+            # Scan the rubric and pull the values of variables from test suite from solution_variables.
+            # These values are going to be saved to autograder.zip alongside with the rubric.
+            with timer.phase("fetch_values"):
+                rubric.fetch_values_for_tests(solution_variables)
+
+            # Requirements are only looked for if the rubric does not list them, and only when the sources have changed.
+            requirements = None
+            if rubric.requirements is None and platform in ("python", "jupyter"):
+                with timer.phase("find_requirements"):
+                    requirements = cache.get_requirements(sources_hash)
+                    if requirements is None:
+                        requirements = find_requirements(solution_path, import_cache=cache.import_cache)
+                        cache.put_requirements(sources_hash, requirements)
+
+            with timer.phase("create_archive"):
+                matlab_paths = []
+                if "matlab" in rubric.supported_platforms and rubric.matlab_credentials is not None:
+                    matlab_folder_path = Path(rubric.matlab_credentials).expanduser().absolute()
+                    matlab_paths = [matlab_folder_path / file for file in MATLAB_FILES]
+                # The archive also contains the wheel of gspack, which is built from its own files.
+                gspack_paths = [path for _, path in get_package_files()]
+                archive_key = cache.get_archive_key(execution_key, rubric, requirements=requirements,
+                                                    compression=compression, extra_paths=matlab_paths + gspack_paths)
+                if cache.archive_is_current(archive_key):
+                    print("Nothing has changed since the previous packaging, the archive is up to date.")
+                else:
+                    create_archive(solution_path.parent / AUTOGRADER_ZIP, rubric=rubric, platform=platform,
+                                   verbose=verbose, compression=compression, requirements=requirements,
+                                   reference_solution=solution_path if rubric.needs_reference_solution() else None,
+                                   solution_path=solution_path, import_cache=cache.import_cache)
+                    cache.put_archive(archive_key)
+                cache.save()
 
     except UserFailure as e:
         # This error indicates that something went wrong because the user did something wrong,
@@ -109,95 +243,253 @@ def create_autograder(solution, rubric=None, verbose=True):
         # raise e
         print(e)
         return None
+    finally:
+        if timings_log is not None:
+            timer.write_log(timings_log, solution=str(solution_path))
+        if profiler is not None:
+            profiler.dump_stats(profile_path)
     print(f"Archive created successfully: \n-> {solution_path.parent / AUTOGRADER_ZIP}")
+    return solution_path.parent / AUTOGRADER_ZIP
 
 
-def create_archive(archive_path: Path, rubric: Rubric, platform: str, verbose=False):
+@click.command(
+    help="Finds all assignments in a course's directory and generates their archives in parallel"
+)
+@click.version_option(
+    version=__version__
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="number of worker processes (defaults to the number of CPUs)"
+)
+@click.option(
+    "--compression",
+    default=DEFAULT_ARCHIVE_COMPRESSION,
+    type=click.Choice(list(ARCHIVE_COMPRESSIONS)),
+    help="compression method of the archives"
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="ignore the results of previous packagings and redo everything"
+)
+@click.argument(
+    "course_dir"
+)
+def create_autograders_from_terminal(course_dir, workers, compression, force):
+    """
+    Wrapper function which is called when gspack_bulk is called from the terminal.
+
+    :param course_dir: directory with the course's assignments, see `find_assignments`.
+    :param workers: number of worker processes
+    :param compression: compression method of the archives, see `create_archive`.
+    :param force: whether to ignore the results of previous packagings, see `create_autograder`.
+    :return: 0 (zero) if all assignments were packaged successfully, otherwise -1
+    """
+    try:
+        report = create_autograders(course_dir, workers=workers, compression=compression, force=force)
+    except UserFailure as e:
+        print(f"ERROR: {e}")
+        return -1
+    return 0 if all(entry["success"] for entry in report) else -1
+
+
+def create_autograders(course_dir, workers=None, compression=DEFAULT_ARCHIVE_COMPRESSION, force=False):
+    """
+    Generates the archives of all assignments of a course in parallel, see `find_assignments`.
+    Every assignment is packaged in its own worker process, which is not reused for other assignments,
+    and which works in the assignment's directory. Outputs of the packagings are collected
+    to `packaging_report.json` in `course_dir` alongside with their outcomes and durations.
+
+    :param course_dir: directory with the course's assignments
+    :param workers: number of worker processes. Defaults to the number of CPUs.
+    :param compression: compression method of the archives, see `create_archive`.
+    :param force: if True, the results of previous packagings are ignored, see `create_autograder`.
+    :return: report -- list of dictionaries with the packaging outcome for every assignment.
+    """
+    course_dir_absolute = Path(course_dir).absolute()
+    if not course_dir_absolute.is_dir():
+        raise UserFailure(f"Course directory does not exist: \n -> {course_dir_absolute}")
+    assignments = find_assignments(course_dir_absolute)
+    if len(assignments) == 0:
+        raise UserFailure(f"No assignments were found in the course directory: \n -> {course_dir_absolute}")
+    tasks = [(assignment, compression, force) for assignment in assignments if assignment["error"] is None]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    outcomes = []
+    if len(tasks) > 0:
+        # Every worker packages one assignment and exits, so that assignments can't affect each other
+        # (through imported modules, global state of the solutions, or memory they leave behind).
+        with Pool(processes=max(1, min(workers, len(tasks))), maxtasksperchild=1) as pool:
+            outcomes = pool.map(_create_autograder_in_worker, tasks, chunksize=1)
+    outcomes = iter(outcomes)
+
+    report = []
+    for assignment in assignments:
+        if assignment["error"] is None:
+            outcome = next(outcomes)
+        else:
+            outcome = {"success": False, "seconds": 0.0, "output": assignment["error"]}
+        entry = {
+            "assignment": str(assignment["solution"].parent.relative_to(course_dir_absolute)),
+            "solution": str(assignment["solution"].relative_to(course_dir_absolute)),
+            "rubric": (str(assignment["rubric"].relative_to(course_dir_absolute))
+                       if assignment["rubric"] is not None else None),
+        }
+        entry.update(outcome)
+        report.append(entry)
+        status = "OK" if entry["success"] else "FAILED"
+        print(f"-> {entry['solution']}: {status} ({entry['seconds']:.1f} s)")
+
+    with open(course_dir_absolute / PACKAGING_REPORT_JSON, "w") as f:
+        json.dump(report, f, indent=4)
+    succeeded = sum(1 for entry in report if entry["success"])
+    print(f"Packaged {succeeded}/{len(report)} assignments successfully: " +
+          f"\n-> {course_dir_absolute / PACKAGING_REPORT_JSON}")
+    return report
+
+
+def find_assignments(course_dir: Path):
+    """
+    Finds the assignments in a course's directory and its sub-directories (except for hidden ones).
+    A solution is a Python, Jupyter, or MATLAB file which name contains "solution".
+    If there is a rubric.json in the same directory then it's the solution's rubric; otherwise the rubric is
+    expected to be inside the solution itself. Each directory can contain only one solution,
+    since its archive is saved to the same directory.
+
+    :param course_dir: directory with the course's assignments
+    :return: list of dictionaries with the paths to the "solution" and to its "rubric" (or None),
+            and the "error" which prevents packaging the assignment, if any.
+    """
+    assignments = []
+    for root, dirs, files in os.walk(course_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        solutions = [Path(root) / file for file in sorted(files)
+                     if "solution" in file.lower() and determine_platform(file) is not None]
+        if len(solutions) == 0:
+            continue
+        rubric_path = Path(root) / RUBRIC_JSON
+        error = None
+        if len(solutions) > 1:
+            error = (f"ERROR: There are several solutions in one directory, but only one archive can be created " +
+                     f"there: \n -> {', '.join(solution.name for solution in solutions)}")
+        for solution_path in solutions:
+            assignments.append({"solution": solution_path, "rubric": rubric_path if rubric_path.exists() else None,
+                                "error": error})
+    return assignments
+
+
+def _create_autograder_in_worker(task):
+    assignment, compression, force = task
+    solution_path = assignment["solution"]
+    os.chdir(solution_path.parent)
+    output = io.StringIO()
+    start = time.monotonic()
+    # Packagings run in parallel, so their outputs are collected to the report instead of being interleaved.
+    with redirect_stdout(output):
+        try:
+            archive_path = create_autograder(solution_path, rubric=assignment["rubric"], verbose=True,
+                                             compression=compression, force=force)
+        except Exception as e:
+            print(f"ERROR: {e}")
+            archive_path = None
+    outcome = {
+        "success": archive_path is not None,
+        "seconds": round(time.monotonic() - start, 3),
+        "output": output.getvalue(),
+    }
+    if archive_path is not None:
+        outcome["archive"] = str(archive_path)
+    return outcome
+
+
+def create_archive(archive_path: Path, rubric: Rubric, platform: str, verbose=False,
+                   compression=DEFAULT_ARCHIVE_COMPRESSION, requirements=None, reference_solution=None,
+                   solution_path: Path = None, import_cache: dict = None):
     """
     Creates a Gradescope autograder archive (autograder.zip).
+    Files are streamed right into the archive: templates, credentials and extra files are copied
+    from their places, and generated files are written from memory. The archive only depends on its inputs,
+    so building it twice from the same inputs gives byte-identical archives.
 
     :param archive_path: path where archive should be saved.
     :param rubric: rubric with attached true values.
     :param platform: which language was used for writing the solution file
     :param verbose: whether to print detailed outputs.
+    :param compression: name of the compression method, one of ARCHIVE_COMPRESSIONS.
+    :param requirements: requirements found for a Python or Jupyter solution,
+            see `gspack.requirements_scanner.find_requirements`.
+            If neither these nor the rubric's requirements are provided, they're found here from `solution_path`.
+    :param reference_solution: path to the solution file, if the rubric needs it for grading,
+            see `Rubric.needs_reference_solution`.
+    :param solution_path: path to the solution file, whose imports are scanned for the requirements
+            if they're not provided.
+    :param import_cache: imports of the already parsed files, see `gspack.requirements_scanner.find_requirements`.
     :return: None. Saves the archive to archive_path or aborts.
     """
     if verbose:
         print("Generating the archive:")
+    if compression not in ARCHIVE_COMPRESSIONS:
+        raise UserFailure(f"Unknown compression method: {compression}. " +
+                          f"Supported ones are: {', '.join(ARCHIVE_COMPRESSIONS)}")
     program_dir = Path(os.path.dirname(__file__))
-    archive_dir = archive_path.parent.absolute()
+    archive_path = Path(archive_path).absolute()
+    archive_dir = archive_path.parent
+    # The archive is written to a temporary file first, so that a failure never leaves a partial archive behind.
+    temp_archive_path = archive_path.with_name(archive_path.name + ".tmp")
     try:
-        # This function puts all the files for the archive to a newly created DIST_DIR and
-        # deletes it once it's packed into autograder.zip
-        os.mkdir(archive_dir / DIST_DIR)
-
-        # Copy necessary files (setup.sh, run_autograder). See AUTOGRADER_ARCHIVE_FILES.
-        for file in AUTOGRADER_ARCHIVE_FILES:
-            full_path = program_dir / TEMPLATES_DIR / file
-            if not os.path.exists(full_path):
-                raise GspackFailure(f"-> {file}: the file {full_path} does not exist." +
-                                    f" It's likely a gspack installation bug." +
-                                    f" You should contact authors" +
-                                    f" or post the issue on the project's Github page.")
-            shutil.copyfile(full_path, archive_dir / DIST_DIR / file)
-            if verbose:
-                print(f"-> {file}: OK")
-
-        # Generate requirements file. It's either in 'requirements' variable or it can be generated via pipreqs.
-        if verbose:
-            print("Looking for package requirements for your solution:")
-        if rubric.requirements is not None:
-            with open(archive_dir / DIST_DIR / REQUIREMENTS_FILE, "w") as f:
-                f.write("\n".join(rubric.requirements))
-                print("-> saved from 'requirements' variable, OK.")
-        else:
-            # pipreqs package scans the solution and generates the list of (non-standard) Python packages used.
-            if platform == "python":
-                generate_reqs_output = generate_requirements(archive_dir,
-                                                             output_path=archive_dir / DIST_DIR / REQUIREMENTS_FILE)
-                if not generate_reqs_output[0].startswith(b"INFO: Successfully saved"):
-                    raise GspackFailure("Extra package requirements identification FAILED. " +
-                                        "Make sure all solution files in the solution's " +
-                                        "directory (including subdirectories), " +
-                                        "can be executed without errors, and there are no other," +
-                                        " irrelevant python files in the solution directory.")
-                if verbose:
-                    print(f"-> Generated via pipreqs: OK")
-            elif platform == "jupyter":
+        with ZipFile(temp_archive_path, "w", compression=ARCHIVE_COMPRESSIONS[compression]) as zip_archive:
+            archive = ArchiveWriter(zip_archive)
+
+            # Add necessary files (setup.sh, gs_debug.sh). See AUTOGRADER_ARCHIVE_FILES.
+            # run_autograder is generated from its template below.
+            for file in AUTOGRADER_ARCHIVE_FILES:
+                full_path = program_dir / TEMPLATES_DIR / file
+                if not os.path.exists(full_path):
+                    raise GspackFailure(f"-> {file}: the file {full_path} does not exist." +
+                                        f" It's likely a gspack installation bug." +
+                                        f" You should contact authors" +
+                                        f" or post the issue on the project's Github page.")
+                if file != RUN_AUTOGRADER_FILE:
+                    archive.add_file(file, full_path)
                 if verbose:
-                    print("-> Not provided, assumed no extra packages are needed")
-            elif platform == "matlab":
-                print("-> If you need extra MATLAB toolboxes for your solution contact your department " +
-                      "to make sure they're added to the department's MATLAB distribution for Gradescope.")
-            else:
-                pass
+                    print(f"-> {file}: OK")
 
-        # This file will contain all the information that setup.sh needs during
-        # the Docker initialization process.
-        config = {}
+            # Add the wheel of the running gspack: setup.sh installs it on Gradescope,
+            # so that the archive is graded by the same version of gspack which created it.
+            archive.add_bytes(get_wheel_name(), build_wheel())
+            if verbose:
+                print(f"-> {get_wheel_name()}: OK")
 
-        if "matlab" in rubric.supported_platforms:
-            # Add MATLAB support
-            if rubric.matlab_credentials is None:
-                raise UserFailure("MATLAB support is requested but no matlab_credentials path is provided")
+            # Generate requirements file. It's either in 'requirements' variable or it's found by scanning the imports.
             if verbose:
-                print("Adding MATLAB support...")
-
-            # Check that all the necessary files are in the credentials folder
-            matlab_folder_path = Path(rubric.matlab_credentials).expanduser().absolute()
-            if not matlab_folder_path.exists() or not matlab_folder_path.is_dir():
-                raise UserFailure(
-                    f"matlab_credentials: the directory {matlab_folder_path} does not exist" +
-                    f" or it's not a directory.")
-
-            # Move all necessary files to the archive's directory
-            for file in MATLAB_FILES:
-                if not (matlab_folder_path / file).exists():
-                    raise UserFailure(f"-> {file}: File {(matlab_folder_path / file).absolute()} does not exist.")
-                shutil.copyfile(matlab_folder_path / file,
-                                archive_dir / DIST_DIR / file)
+                print("Looking for package requirements for your solution:")
+            if rubric.requirements is not None:
+                archive.add_bytes(REQUIREMENTS_FILE, "\n".join(rubric.requirements).encode("utf-8"))
                 if verbose:
-                    print(f"-> {file}: OK")
+                    print("-> saved from 'requirements' variable, OK.")
+            else:
+                # The solution's imports are scanned, and the (non-standard) Python packages they come from are listed.
+                if platform in ("python", "jupyter"):
+                    if requirements is None:
+                        if solution_path is None:
+                            raise GspackFailure("Requirements can't be found without the solution's path.")
+                        requirements = find_requirements(solution_path, import_cache=import_cache)
+                    archive.add_bytes(REQUIREMENTS_FILE, "\n".join(requirements).encode("utf-8"))
+                    if verbose:
+                        print(f"-> Found by scanning the solution's imports: {', '.join(requirements) or 'none'}, OK")
+                elif platform == "matlab":
+                    print("-> If you need extra MATLAB toolboxes for your solution contact your department " +
+                          "to make sure they're added to the department's MATLAB distribution for Gradescope.")
+                else:
+                    pass
+
+            # This file will contain all the information that setup.sh needs during
+            # the Docker initialization process.
+            config = {}
 
             # Getting prefix and suffix commands for the run_autograder script, if any.
             # These _prefix and _suffix normally contain all the commands
@@ -206,65 +498,149 @@ def create_archive(archive_path: Path, rubric: Rubric, platform: str, verbose=Fa
             # MATLAB license servers, if used.
             run_autograder_prefix = ""
             run_autograder_suffix = ""
-            if (matlab_folder_path / PROXY_SETTINGS).exists():
-                with open(matlab_folder_path / PROXY_SETTINGS, "r") as proxy_settings_file:
-                    proxy_settings = json.load(proxy_settings_file)
-                    if proxy_settings['open_tunnel'] is not None:
-                        run_autograder_prefix += proxy_settings['open_tunnel']
-                    if proxy_settings['close_tunnel'] is not None:
-                        run_autograder_suffix += proxy_settings['close_tunnel']
+
+            if "matlab" in rubric.supported_platforms:
+                # Add MATLAB support
+                if rubric.matlab_credentials is None:
+                    raise UserFailure("MATLAB support is requested but no matlab_credentials path is provided")
+                if verbose:
+                    print("Adding MATLAB support...")
+
+                # Check that all the necessary files are in the credentials folder
+                matlab_folder_path = Path(rubric.matlab_credentials).expanduser().absolute()
+                if not matlab_folder_path.exists() or not matlab_folder_path.is_dir():
+                    raise UserFailure(
+                        f"matlab_credentials: the directory {matlab_folder_path} does not exist" +
+                        f" or it's not a directory.")
+
+                # Add all necessary files to the archive
+                for file in MATLAB_FILES:
+                    if not (matlab_folder_path / file).exists():
+                        raise UserFailure(f"-> {file}: File {(matlab_folder_path / file).absolute()} does not exist.")
+                    archive.add_file(file, matlab_folder_path / file)
+                    if verbose:
+                        print(f"-> {file}: OK")
+
+                if (matlab_folder_path / PROXY_SETTINGS).exists():
+                    with open(matlab_folder_path / PROXY_SETTINGS, "r") as proxy_settings_file:
+                        proxy_settings = json.load(proxy_settings_file)
+                        if proxy_settings['open_tunnel'] is not None:
+                            run_autograder_prefix += proxy_settings['open_tunnel']
+                        if proxy_settings['close_tunnel'] is not None:
+                            run_autograder_suffix += proxy_settings['close_tunnel']
+                config["matlab_support"] = 1
+                if verbose:
+                    print("MATLAB support added successfully.", end='\n')
+            else:
+                config["matlab_support"] = 0
 
             # Create run_autograder file given the prefix and suffix
-            with open(archive_dir / DIST_DIR / RUN_AUTOGRADER_FILE, 'w') as run_autograder_dest:
-                run_autograder_dest.write("#!/usr/bin/env bash \n")
-                if run_autograder_prefix is not None:
-                    run_autograder_dest.write(run_autograder_prefix + "\n")
-                with open(program_dir / TEMPLATES_DIR / RUN_AUTOGRADER_FILE, 'r') as run_autograder_src:
-                    run_autograder_dest.write(run_autograder_src.read() + "\n")
-                if run_autograder_suffix is not None:
-                    run_autograder_dest.write(run_autograder_suffix)
-            config["matlab_support"] = 1
-            if verbose:
-                print("MATLAB support added successfully.", end='\n')
-        else:
-            config["matlab_support"] = 0
-            # Create run_autograder file only adding bash prefix to the template
-            with open(archive_dir / DIST_DIR / RUN_AUTOGRADER_FILE, 'w') as run_autograder_dest:
-                run_autograder_dest.write("#!/usr/bin/env bash \n")
-                with open(program_dir / TEMPLATES_DIR / RUN_AUTOGRADER_FILE, 'r') as run_autograder_src:
-                    run_autograder_dest.write(run_autograder_src.read() + "\n")
-
-        # Add Jupyter Notebooks support.
-        if "jupyter" in rubric.supported_platforms:
-            config["jupyter_support"] = 1
-        else:
-            config["jupyter_support"] = 0
+            with open(program_dir / TEMPLATES_DIR / RUN_AUTOGRADER_FILE, 'r') as run_autograder_src:
+                run_autograder = "#!/usr/bin/env bash \n"
+                if run_autograder_prefix:
+                    run_autograder += run_autograder_prefix + "\n"
+                run_autograder += run_autograder_src.read() + "\n"
+                run_autograder += run_autograder_suffix
+            archive.add_bytes(RUN_AUTOGRADER_FILE, run_autograder.encode("utf-8"))
 
-        # save the config.json file
-        with open(archive_dir / DIST_DIR / CONFIG_JSON, 'w') as f:
-            json.dump(config, f)
+            # Add Jupyter Notebooks support.
+            if "jupyter" in rubric.supported_platforms:
+                config["jupyter_support"] = 1
+            else:
+                config["jupyter_support"] = 0
 
-        # Check and add extra files from extra_files list,
-        if verbose and rubric.extra_files is not None:
-            print("Find extra files list:")
+            # save the config.json file
+            archive.add_bytes(CONFIG_JSON, json.dumps(config).encode("utf-8"))
 
-        for extra_file in rubric.extra_files:
-            if not (archive_dir / extra_file).exists():
-                raise UserFailure(f"{extra_file}: can't find {archive_dir / extra_file}")
-            shutil.copyfile(archive_dir / extra_file, archive_dir / DIST_DIR / extra_file)
-            if verbose:
-                print(f"-> {extra_file}: OK")
+            # Check and add extra files from extra_files list,
+            if verbose and rubric.extra_files is not None:
+                print("Find extra files list:")
+
+            for extra_file in rubric.extra_files:
+                if not (archive_dir / extra_file).exists():
+                    raise UserFailure(f"{extra_file}: can't find {archive_dir / extra_file}")
+                archive.add_file(extra_file, archive_dir / extra_file)
+                if verbose:
+                    print(f"-> {extra_file}: OK")
 
-        # save the rubric and true values from the rubric to the archive's folder.
-        rubric.save_to(archive_dir / DIST_DIR)
+            # Add the solution itself, if performance tests need to time it on the grading machine
+            if reference_solution is not None:
+                reference_solution = Path(reference_solution)
+                archive.add_file(REFERENCE_SOLUTION + reference_solution.suffix, reference_solution)
+                if verbose:
+                    print(f"-> {reference_solution.name} as the reference for performance tests: OK")
 
-        # Zip all files in DIST directory
-        zip_archive = ZipFile(archive_dir / AUTOGRADER_ZIP, 'w')
-        for extra_file in os.listdir(archive_dir / DIST_DIR):
-            zip_archive.write(archive_dir / DIST_DIR / extra_file, arcname=extra_file)
-        zip_archive.close()
+            # save the rubric and true values from the rubric to the archive.
+            archive.add_bytes(RUBRIC_JSON, json.dumps(rubric.to_dict()).encode("utf-8"))
+            if rubric.test_suite_values is not None:
+                for file_name, write in iter_value_files(rubric.test_suite_values):
+                    archive.add_stream(f"{TEST_SUITE_VALUES_DIR}/{file_name}", write)
+        os.replace(temp_archive_path, archive_path)
         return True
     finally:
-        # Delete the temporary dist directory
-        if os.path.exists(archive_dir / DIST_DIR):
-            shutil.rmtree(archive_dir / DIST_DIR)
+        if os.path.exists(temp_archive_path):
+            os.remove(temp_archive_path)
+
+
+class ArchiveWriter:
+    """
+    Adds files to a zip archive in a reproducible way: all entries get the same timestamp
+    and fixed permissions, whatever the files' timestamps and permissions on the disk are.
+    """
+    def __init__(self, zip_archive: ZipFile):
+        """
+        Creates an instance of ArchiveWriter.
+
+        :param zip_archive: ZipFile opened for writing.
+        """
+        self.zip_archive = zip_archive
+
+    def get_info(self, name, file_size=0):
+        """
+        Creates a ZipInfo for an entry of the archive.
+
+        :param name: name of the entry
+        :param file_size: size of the entry, if known. Entries which are larger than 2 GB need zip64 extensions.
+        :return: ZipInfo
+        """
+        info = ZipInfo(str(name), date_time=ARCHIVE_DATE_TIME)
+        info.compress_type = self.zip_archive.compression
+        info.file_size = file_size
+        # Permissions are only respected by unzip when the entry is marked as created on Unix.
+        info.create_system = 3
+        info.external_attr = (stat.S_IFREG | ARCHIVE_FILE_MODES.get(str(name), 0o644)) << 16
+        return info
+
+    def add_bytes(self, name, data: bytes):
+        """
+        Adds an entry with the given content.
+
+        :param name: name of the entry
+        :param data: content of the entry
+        :return: None
+        """
+        self.zip_archive.writestr(self.get_info(name), data)
+
+    def add_file(self, name, path: Path):
+        """
+        Copies a file into the archive, block by block.
+
+        :param name: name of the entry
+        :param path: path to the file
+        :return: None
+        """
+        with open(path, "rb") as source, \
+                self.zip_archive.open(self.get_info(name, file_size=os.path.getsize(path)), "w") as destination:
+            shutil.copyfileobj(source, destination, ARCHIVE_BLOCK_SIZE)
+
+    def add_stream(self, name, write):
+        """
+        Adds an entry which content is written by a function, without keeping the whole content in memory.
+
+        :param name: name of the entry
+        :param write: function which takes a binary file object and writes the content into it.
+        :return: None
+        """
+        # The size is not known in advance, so the entry is always ready for being larger than 2 GB.
+        with self.zip_archive.open(self.get_info(name), "w", force_zip64=True) as destination:
+            write(destination)
@@ -0,0 +1,270 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import sysconfig
+from pathlib import Path
+
+try:
+    from importlib import metadata
+except ImportError:
+    # Python 3.7
+    import importlib_metadata as metadata
+
+from gspack.helpers import UserFailure
+
+# Files which are scanned for imports when requirements are found for a whole directory.
+SCANNED_SUFFIXES = (".py", ".ipynb")
+
+
+def find_requirements(path: Path, import_cache: dict = None):
+    """
+    Lists the (non-standard) Python packages which a solution imports. Only the code which the solution can
+    actually run is scanned: the solution itself, and the local modules which it imports, recursively.
+    Code cells of Jupyter notebooks are scanned too. Imported modules are mapped to the installed distributions
+    which provide them, e.g. `sklearn` becomes `scikit-learn`; modules from the standard library and local modules
+    are skipped.
+
+    :param path: path to the solution file. If it's a directory, all Python files and notebooks in it
+            (but not in its sub-directories) are treated as solutions.
+    :param import_cache: dictionary "hash of a file's content" - "imports of the file", which is used
+            for not parsing the same files again, and which is updated with the newly parsed ones.
+    :return: sorted list of distributions' names
+    """
+    _, external_modules = walk_local_imports(path, import_cache)
+
+    distributions = get_module_distributions()
+    requirements = set()
+    for module_name in external_modules:
+        if is_standard_module(module_name):
+            continue
+        # Modules which are not installed keep their names: that's the best guess.
+        requirements.update(distributions.get(module_name, [module_name]))
+    return sorted(requirements, key=str.lower)
+
+
+def find_local_sources(path: Path, import_cache: dict = None):
+    """
+    Lists the files which a solution can actually run: the solution itself, and the local modules
+    which it imports, recursively, see `find_requirements`.
+
+    :param path: path to the solution file
+    :param import_cache: see `find_requirements`
+    :return: sorted list of paths to the files
+    """
+    local_sources, _ = walk_local_imports(path, import_cache)
+    return sorted(local_sources)
+
+
+def walk_local_imports(path: Path, import_cache: dict = None):
+    """
+    Walks the graph of local imports, starting from a solution, see `find_requirements`.
+
+    :param path: path to the solution file, or a directory with solutions
+    :param import_cache: see `find_requirements`
+    :return: tuple: set of the paths to the scanned files (the solutions and the local modules),
+            and set of the names of the top-level modules which are not local.
+    """
+    path = Path(path).absolute()
+    if path.is_dir():
+        root_dir = path
+        roots = [file for file in sorted(path.iterdir()) if file.suffix in SCANNED_SUFFIXES and file.is_file()]
+    else:
+        root_dir = path.parent
+        roots = [path]
+    if import_cache is None:
+        import_cache = {}
+
+    external_modules = set()
+    visited = set()
+    pending = list(roots)
+    while pending:
+        file_path = pending.pop()
+        if file_path in visited:
+            continue
+        visited.add(file_path)
+        for module_name, level in get_file_imports(file_path, import_cache):
+            local_path = resolve_local_module(module_name, level, file_path, root_dir)
+            if local_path is not None:
+                pending += local_path
+            elif level == 0:
+                external_modules.add(module_name.split(".")[0])
+    return visited, external_modules
+
+
+def get_file_imports(file_path: Path, import_cache: dict):
+    """
+    Lists the imports of a Python file or of a notebook's code cells.
+
+    :param file_path: path to the file
+    :param import_cache: see `find_requirements`
+    :return: list of [module name, level] pairs, where level is the number of dots of a relative import.
+    """
+    with open(file_path, "rb") as f:
+        content = f.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+    if content_hash not in import_cache:
+        if file_path.suffix == ".ipynb":
+            sources = get_notebook_sources(content, file_path)
+        else:
+            sources = [content]
+        imports = []
+        for source in sources:
+            try:
+                tree = ast.parse(source, filename=str(file_path))
+            except (SyntaxError, ValueError):
+                # The solution was executed successfully, so it's a code which only IPython understands,
+                # or a local module which is never imported.
+                continue
+            imports += find_imports(tree)
+        import_cache[content_hash] = sorted(set(tuple(i) for i in imports))
+    return [tuple(i) for i in import_cache[content_hash]]
+
+
+def get_notebook_sources(content: bytes, file_path: Path):
+    """
+    Extracts the code of a notebook's cells. Lines with IPython magics, shell commands, and help requests
+    are commented out, and cells with cell magics are skipped, since they're not Python code.
+    The notebook is read as plain JSON, so that nbformat is not imported for that.
+
+    :param content: content of the notebook's file
+    :param file_path: path to the notebook, for the error message
+    :return: list of sources, one per code cell
+    """
+    try:
+        notebook = json.loads(content.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise UserFailure(f"Notebook can not be read: {file_path}\n{e}")
+    sources = []
+    for cell in notebook.get("cells", []):
+        if cell.get("cell_type", None) != "code":
+            continue
+        source = cell.get("source", "")
+        if isinstance(source, list):
+            source = "".join(source)
+        if source.lstrip().startswith("%%"):
+            continue
+        lines = ["# " + line if line.lstrip().startswith(("%", "!")) or line.rstrip().endswith("?") else line
+                 for line in source.splitlines()]
+        sources.append("\n".join(lines))
+    return sources
+
+
+def find_imports(tree: ast.AST):
+    """
+    Finds all imports in a syntax tree, including the ones inside functions and conditional blocks.
+
+    :param tree: syntax tree of a module
+    :return: list of (module name, level) pairs
+    """
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports += [(alias.name, 0) for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            if node.module is not None:
+                imports.append((node.module, node.level))
+            # "from package import module" can import a sub-module of a local package
+            imports += [(f"{node.module}.{alias.name}" if node.module else alias.name, node.level)
+                        for alias in node.names if alias.name != "*"]
+    return imports
+
+
+def resolve_local_module(module_name: str, level: int, importer_path: Path, root_dir: Path):
+    """
+    Finds the files of a local module: a module which is a file or a package in the solution's directory.
+
+    :param module_name: name of the imported module
+    :param level: level of a relative import
+    :param importer_path: path to the file which imports the module
+    :param root_dir: solution's directory
+    :return: list of the module's files (the package's __init__.py and the module itself),
+            or None if the module is not local.
+    """
+    if level > 0:
+        base_dir = importer_path.parent
+        for _ in range(level - 1):
+            base_dir = base_dir.parent
+    else:
+        base_dir = root_dir
+    parts = module_name.split(".")
+    files = []
+    for i, part in enumerate(parts):
+        package_dir = base_dir.joinpath(*parts[:i + 1])
+        module_file = base_dir.joinpath(*parts[:i]) / f"{part}.py"
+        if (package_dir / "__init__.py").is_file():
+            files.append(package_dir / "__init__.py")
+        elif module_file.is_file():
+            files.append(module_file)
+            break
+        elif not package_dir.is_dir():
+            # An attribute of a local module ("from module import function"), or not a local module at all
+            break
+    if level == 0 and len(files) == 0 and not (root_dir / parts[0]).is_dir():
+        return None
+    return files
+
+
+def is_standard_module(module_name: str):
+    """
+    Checks whether a top-level module comes with Python itself.
+
+    :param module_name: name of a top-level module
+    :return: True if it's a module from the standard library or a built-in one.
+    """
+    if module_name in sys.builtin_module_names:
+        return True
+    if hasattr(sys, "stdlib_module_names"):
+        return module_name in sys.stdlib_module_names
+    # Before Python 3.10, the standard library is found by where the module is installed.
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return False
+    if spec is None or spec.origin is None:
+        return False
+    origin = os.path.realpath(spec.origin)
+    stdlib_dirs = {os.path.realpath(sysconfig.get_paths()[name]) for name in ("stdlib", "platstdlib")}
+    return (any(origin.startswith(stdlib_dir + os.sep) for stdlib_dir in stdlib_dirs)
+            and "site-packages" not in origin and "dist-packages" not in origin)
+
+
+def get_module_distributions():
+    """
+    Maps top-level modules to the installed distributions which provide them.
+
+    :return: dictionary "module name" - "list of distributions' names"
+    """
+    if hasattr(metadata, "packages_distributions"):
+        return metadata.packages_distributions()
+    # Python < 3.10: modules are taken from the distributions' top_level.txt or from the lists of their files.
+    distributions = {}
+    for distribution in metadata.distributions():
+        name = distribution.metadata["Name"]
+        top_level = distribution.read_text("top_level.txt")
+        if top_level is not None:
+            modules = top_level.split()
+        else:
+            modules = [file.parts[0].split(".")[0] for file in (distribution.files or ())
+                       if file.suffix == ".py" or len(file.parts) > 1 and file.parts[1] == "__init__.py"]
+        for module in set(modules):
+            distributions.setdefault(module, []).append(name)
+    return distributions
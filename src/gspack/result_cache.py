@@ -0,0 +1,198 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import tempfile
+from itertools import chain
+from pathlib import Path
+
+from gspack.__about__ import __version__
+from gspack.directories import VALUES_INDEX_JSON
+from gspack.helpers import all_supported_platforms
+from gspack.values_store import find_values_path
+
+# Default bound on the total size of a result cache, in bytes.
+DEFAULT_CACHE_SIZE = 1024 ** 3
+
+# Suffixes of the submissions' source files, see `ResultCache.get_key`.
+SOURCE_SUFFIXES = tuple(chain(*all_supported_platforms.values()))
+
+# Size of blocks in which files are read for hashing.
+HASH_BLOCK_SIZE = 1024 ** 2
+
+
+def hash_file(path: Path, digest):
+    """
+    Feeds the file's content to a hashlib digest, block by block.
+
+    :param path: path to the file
+    :param digest: an instance of hashlib's hash object
+    :return: None
+    """
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+
+def hash_directory(path: Path, digest, ignored_files=(), suffixes=None):
+    """
+    Feeds names and contents of all files in the directory (including sub-directories)
+    to a hashlib digest, in a deterministic order.
+
+    :param path: path to the directory
+    :param digest: an instance of hashlib's hash object
+    :param ignored_files: names of the files and sub-directories in the directory's root which should be skipped
+    :param suffixes: if provided, only the files with these suffixes are hashed
+    :return: None
+    """
+    for root, dirs, files in os.walk(path):
+        if Path(root) == Path(path):
+            dirs[:] = [d for d in dirs if d not in ignored_files]
+        dirs.sort()
+        for file_name in sorted(files):
+            full_path = Path(root) / file_name
+            relative_path = full_path.relative_to(path)
+            if str(relative_path) in ignored_files or (suffixes is not None and full_path.suffix not in suffixes):
+                continue
+            digest.update(str(relative_path).encode("utf-8") + b"\0")
+            hash_file(full_path, digest)
+            digest.update(b"\0")
+
+
+class ResultCache:
+    """
+    Keeps grading results of submissions on disk, keyed by a hash of the submission's files, the rubric, and
+    the rubric's true values, so that byte-identical resubmissions are not executed again.
+    Each entry is a JSON file; the total size of the cache is bounded, and the least recently used entries
+    are evicted first.
+    """
+    def __init__(self, cache_dir: Path, max_size=DEFAULT_CACHE_SIZE):
+        """
+        Creates an instance of ResultCache.
+
+        :param cache_dir: directory to keep the entries in. Created if it does not exist.
+        :param max_size: maximal total size of the entries, in bytes.
+        """
+        self.cache_dir = Path(cache_dir).absolute()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self._rubric_hashes = {}
+
+    def hash_rubric(self, rubric_path: Path, test_values_path: Path):
+        """
+        Hashes the rubric and its true values. The hash is memorized for as long as the files don't change,
+        so that a batch of submissions only reads them once.
+
+        :param rubric_path: path to the rubric's JSON file
+        :param test_values_path: path to the true values (a values store or a pickle file),
+                resolved like `gspack.values_store.load_values` does.
+        :return: hex digest
+        """
+        values_path = find_values_path(test_values_path)
+        stamped_paths = [rubric_path]
+        if values_path is not None:
+            # Files of a values store can be rewritten in place, which doesn't change the directory's stamp
+            stamped_paths += [values_path, values_path / VALUES_INDEX_JSON] if values_path.is_dir() else [values_path]
+        stamps = tuple((str(path), path.stat().st_mtime_ns, path.stat().st_size) for path in stamped_paths
+                       if path.exists())
+        if stamps not in self._rubric_hashes:
+            digest = hashlib.sha256(__version__.encode("utf-8"))
+            hash_file(rubric_path, digest)
+            if values_path is not None and values_path.is_dir():
+                hash_directory(values_path, digest)
+            elif values_path is not None:
+                hash_file(values_path, digest)
+            self._rubric_hashes[stamps] = digest.hexdigest()
+        return self._rubric_hashes[stamps]
+
+    def get_key(self, submission_dir: Path, rubric_path: Path, test_values_path: Path, ignored_files=()):
+        """
+        Computes the key of a submission from its source files: the files of the supported platforms.
+        Other files are not a part of the key, since the student's code can write them into its own directory,
+        and then the same submission would never be found in the cache when it's graded again in place.
+
+        :param submission_dir: directory with the student's submission
+        :param rubric_path: path to the rubric's JSON file
+        :param test_values_path: path to the true values
+        :param ignored_files: names of files in `submission_dir` which are not a part of the submission,
+                like extra files from the rubric or results.json.
+        :return: hex digest
+        """
+        digest = hashlib.sha256(self.hash_rubric(rubric_path, test_values_path).encode("utf-8"))
+        hash_directory(submission_dir, digest, ignored_files=ignored_files, suffixes=SOURCE_SUFFIXES)
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """
+        Looks up results by the key.
+
+        :param key: key from `get_key`
+        :return: results, or None if there are no results for this key.
+        """
+        entry_path = self.cache_dir / f"{key}.json"
+        try:
+            with open(entry_path, "r") as f:
+                results = json.load(f)
+            # Mark the entry as recently used
+            os.utime(entry_path)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return results
+
+    def put(self, key: str, results: dict):
+        """
+        Saves results under the key, and evicts the least recently used entries if the cache is too big.
+
+        :param key: key from `get_key`
+        :param results: grading results
+        :return: None
+        """
+        # Entries are written to a temporary file first, so that concurrent readers never see a partial entry.
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(results, f)
+        os.replace(temp_path, self.cache_dir / f"{key}.json")
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits into `self.max_size`.
+
+        :return: None
+        """
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total_size += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process has already evicted it
+                pass
+            total_size -= size
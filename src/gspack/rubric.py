@@ -15,12 +15,18 @@
 #     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import json
-import pickle
 from itertools import chain
 
 from gspack.directories import *
+from gspack.function_tests import function_test_runners, get_call_failure
 from gspack.helpers import UserFailure, GspackFailure
 from gspack.helpers import all_supported_platforms
+from gspack.values_store import save_values
+
+# Types of tests: "variable" tests check a variable left in the solution's namespace after its execution,
+# the others ("function", "performance", "memory") call a function from the namespace,
+# see `gspack.function_tests.function_test_runners`.
+TEST_TYPES = ("variable",) + tuple(function_test_runners.keys())
 
 
 class Rubric:
@@ -38,6 +44,10 @@ class Rubric:
                  verbose=False,
                  main_file_name=None,
                  requirements=None,
+                 time_limit=None,
+                 cpu_time_limit=None,
+                 memory_limit=None,
+                 headless=False,
                  **kwargs):
         """
         Initialises Rubric class. It does not check the correctness of the provided information,
@@ -54,6 +64,11 @@ class Rubric:
                 Not a regular expression.
         :param requirements: List of packages required by the solution. Will be installed to Gradescope.
                 Note: does not support MATLAB Toolboxes, since those should come with MATLAB distribution itself.
+        :param time_limit: Wall-clock time limit (seconds) for executing a Python or Jupyter submission.
+        :param cpu_time_limit: CPU time limit (seconds) for executing a Python or Jupyter submission.
+        :param memory_limit: Memory (address space) limit (megabytes) for executing a Python or Jupyter submission.
+        :param headless: Whether to execute Python and Jupyter submissions without drawing figures
+                and without slow notebook magics, see `Executor`.
         :param kwargs: storage for unused keyword arguments (for initializing as Rubric(**module)).
         """
         self.test_suite = test_suite
@@ -66,13 +81,59 @@ class Rubric:
         self.verbose = verbose
         self.main_file_name = main_file_name
         self.requirements = requirements
+        self.time_limit = time_limit
+        self.cpu_time_limit = cpu_time_limit
+        self.memory_limit = memory_limit
+        self.headless = headless
         if "matlab" in self.supported_platforms:
             self.matlab_config = {
-                "variables_to_take": [test["variable_name"] for test in test_suite]
+                "variables_to_take": self.get_test_variables()
             }
         else:
             self.matlab_config = None
 
+    def get_test_variables(self):
+        """
+        Lists the names of the variables which the test suite checks.
+
+        :return: list of variables' names
+        """
+        return [test["variable_name"] for test in self.test_suite if get_test_type(test) == "variable"]
+
+    def get_function_tests(self, values=None):
+        """
+        Lists the tests which call functions, for `Executor` to run them against the executed file's namespace.
+
+        :param values: values of the test suite's variables. Inputs which are given by a variable's name
+                are taken from there. If None, they're taken from the executed file's namespace.
+        :return: list of function tests, see `get_function_tests`.
+        """
+        return get_function_tests(self.test_suite, values=values)
+
+    def needs_reference_solution(self):
+        """
+        Checks whether the solution has to be shipped with the archive: performance tests time it
+        on the grading machine, alongside with the submission.
+
+        :return: True if the rubric has performance tests.
+        """
+        return any(test["type"] == "performance" for test in self.get_function_tests())
+
+    def get_resource_limits(self):
+        """
+        Collects the limits for executing a submission, if any are set. See `Executor.execute_in_sandbox`.
+
+        :return: dictionary with `time_limit`, `cpu_time_limit`, and `memory_limit`, or None if no limit is set.
+        """
+        limits = {
+            "time_limit": self.time_limit,
+            "cpu_time_limit": self.cpu_time_limit,
+            "memory_limit": self.memory_limit
+        }
+        if all(limit is None for limit in limits.values()):
+            return None
+        return limits
+
     @staticmethod
     def from_json(rubric_path: Path, verbose=False, **kwargs):
         """
@@ -154,7 +215,7 @@ class Rubric:
                     try:
                         score_from_rubric = float(test['score'])
                     except Exception:
-                        raise UserFailure(f"Score for {test['test_name']} ({test['variable_name']}) is not a number.")
+                        raise UserFailure(f"Score for {test['test_name']} is not a number.")
 
                     if abs(score_from_rubric - score_per_test) > 1e-2 and score_per_test is not None:
                         raise UserFailure(
@@ -169,6 +230,8 @@ class Rubric:
             except Exception:
                 raise UserFailure(f"Tolerances for test {test['test_name']}: rtol and atol should be float numbers")
 
+            Rubric.check_test_fields(test)
+
             actual_total_score += float(test['score'])
             if verbose:
                 print(f"-> {test['test_name']}: OK")
@@ -210,6 +273,14 @@ class Rubric:
         if verbose:
             print(f"Supported platforms: {', '.join(supported_platforms)}")
 
+        # Functions can only be called from Python code
+        if "matlab" in supported_platforms and len(get_function_tests(test_suite)) > 0:
+            raise UserFailure("Tests of functions, their performance and memory are not supported for MATLAB. " +
+                              "Remove 'matlab' from supported_platforms or replace these tests with tests of variables.")
+        function_test_names = [test["test_name"] for test in get_function_tests(test_suite)]
+        if len(set(function_test_names)) != len(function_test_names):
+            raise UserFailure("Tests of functions must have different test names.")
+
         # Check the main file's name
         main_file_name = rubric.get("main_file_name", None)
         if main_file_name is not None:
@@ -224,6 +295,29 @@ class Rubric:
                 raise UserFailure("extra_files should be a list of file names"
                                   " located in the same directory as the solution")
 
+        # Check the resource limits
+        for limit_name in ("time_limit", "cpu_time_limit", "memory_limit"):
+            limit = rubric.get(limit_name, None)
+            if limit is None:
+                continue
+            try:
+                limit = float(limit)
+            except Exception:
+                raise UserFailure(f"{limit_name} should be a number.")
+            if limit <= 0:
+                raise UserFailure(f"{limit_name} should be positive.")
+            rubric[limit_name] = limit
+            if verbose:
+                print(f"{limit_name}: {limit:g}")
+
+        # Check the headless mode
+        headless = rubric.get("headless", None)
+        if headless is not None:
+            if type(headless) is not bool:
+                raise UserFailure("headless should be True or False.")
+            if verbose:
+                print(f"Headless mode: {'on' if headless else 'off'}")
+
         # Check the list of requirements
         requirements = rubric.get("requirements", None)
         if requirements is not None:
@@ -232,6 +326,59 @@ class Rubric:
 
         return True
 
+    @staticmethod
+    def check_test_fields(test: dict):
+        """
+        Checks that a test has the fields which its type needs. Raises UserFailure if it doesn't.
+
+        :param test: test from the test suite
+        :return: None
+        """
+        test_type = get_test_type(test)
+        if test_type not in TEST_TYPES:
+            raise UserFailure(f"{test['test_name']}: unrecognized test type: {test_type}. " +
+                              f"Options are: {', '.join(TEST_TYPES)}")
+        if test_type == "variable":
+            if type(test.get("variable_name", None)) is not str:
+                raise UserFailure(f"{test['test_name']}: variable_name should be a string.")
+            return
+        if type(test.get("function_name", None)) is not str:
+            raise UserFailure(f"{test['test_name']}: function_name should be a string.")
+        inputs = test.get("inputs", None)
+        if not (type(inputs) in (list, str) and len(inputs) > 0):
+            raise UserFailure(f"{test['test_name']}: inputs should be a non-empty list of input cases, " +
+                              "or the name of a variable which contains them.")
+        call_time_limit = test.get("call_time_limit", None)
+        if call_time_limit is not None:
+            if isinstance(call_time_limit, bool) or not isinstance(call_time_limit, (int, float)):
+                raise UserFailure(f"{test['test_name']}: call_time_limit should be a number.")
+            if call_time_limit <= 0:
+                raise UserFailure(f"{test['test_name']}: call_time_limit should be positive.")
+        if test_type == "memory":
+            for field_name in ("memory_budget", "memory_slack"):
+                value = test.get(field_name, None)
+                if value is None:
+                    continue
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    raise UserFailure(f"{test['test_name']}: {field_name} should be a number.")
+                if value < 0 or (field_name == "memory_budget" and value == 0):
+                    raise UserFailure(f"{test['test_name']}: {field_name} should be positive.")
+        if test_type != "performance":
+            return
+        repeat = test.get("repeat", None)
+        if repeat is not None and (type(repeat) is not int or repeat <= 0):
+            raise UserFailure(f"{test['test_name']}: repeat should be a positive integer.")
+        speed_curve = test.get("speed_curve", None)
+        if speed_curve is not None:
+            try:
+                ratios, fractions = zip(*[(float(ratio), float(fraction)) for ratio, fraction in speed_curve])
+            except Exception:
+                raise UserFailure(f"{test['test_name']}: speed_curve should be a list of pairs " +
+                                  "[time / reference time, fraction of the points].")
+            if list(ratios) != sorted(set(ratios)) or not all(0 <= fraction <= 1 for fraction in fractions):
+                raise UserFailure(f"{test['test_name']}: speed_curve's time ratios should increase, " +
+                                  "and its fractions of the points should be between 0 and 1.")
+
     def fetch_values_for_tests(self, variables: dict):
         """
         Goes through the rubric and variables, and saves the values from variables from test_suite to the rubric.
@@ -243,28 +390,124 @@ class Rubric:
             raise GspackFailure("Rubric was not initialized properly: test_suite is None.")
         self.test_suite_values = {}
         for test in self.test_suite:
-            test_value = variables.get(test["variable_name"], None)
-            if test_value is None:
-                raise UserFailure(f"{test['test_name']}: variable {test['variable_name']} is set to be checked" +
-                                  f" but it's not defined after the solution finishes its execution.")
-            self.test_suite_values[test["variable_name"]] = test_value
+            for name in get_test_value_names(test):
+                test_value = variables.get(name, None)
+                if test_value is None and get_test_type(test) != "variable" and name == get_test_value_name(test):
+                    raise UserFailure(f"{test['test_name']}: outputs of {test['function_name']} can not be saved." +
+                                      f" Make sure that the function returns values which can be pickled.")
+                if test_value is None:
+                    raise UserFailure(f"{test['test_name']}: variable {name} is set to be checked" +
+                                      f" but it's not defined after the solution finishes its execution.")
+                # The solution's functions must succeed on every input case
+                failure = None
+                if get_test_type(test) != "variable" and name == get_test_value_name(test):
+                    failure = get_call_failure(test_value)
+                if failure is not None and failure[0] is None:
+                    raise UserFailure(f"{test['test_name']}: {failure[1].message}")
+                if failure is not None:
+                    raise UserFailure(f"{test['test_name']}: calling {test['function_name']} from the solution" +
+                                      f" failed for input #{failure[0] + 1}: {failure[1].message}")
+                self.test_suite_values[name] = test_value
 
-    def save_to(self, path):
+    def to_dict(self):
         """
-        Saves the content of the rubric to a JSON file and pickles the test suite variables' values, if attached.
+        Returns the content of the rubric which is saved to its JSON file.
 
-        :param path: Path to the directory where the files should be saved
-        :return: None if success, otherwise raises an error.
+        :return: dictionary which `Rubric.from_dict` can load the rubric from.
         """
-        dict_to_save = {
+        return {
             "test_suite": self.test_suite,
             "number_of_attempts": self.number_of_attempts,
             "supported_platforms": self.supported_platforms,
             "extra_files": self.extra_files,
             "main_file_name": self.main_file_name,
+            "time_limit": self.time_limit,
+            "cpu_time_limit": self.cpu_time_limit,
+            "memory_limit": self.memory_limit,
+            "headless": self.headless,
         }
+
+    def save_to(self, path):
+        """
+        Saves the content of the rubric to a JSON file and the test suite variables' values, if attached,
+        to a values store (see `gspack.values_store`).
+
+        :param path: Path to the directory where the files should be saved
+        :return: None if success, otherwise raises an error.
+        """
         with open(path / RUBRIC_JSON, "w") as f:
-            json.dump(dict_to_save, f)
+            json.dump(self.to_dict(), f)
         if self.test_suite_values is not None:
-            with open(path / TEST_SUITE_VALUES_FILE, "wb") as f:
-                pickle.dump(self.test_suite_values, f)
+            save_values(self.test_suite_values, path / TEST_SUITE_VALUES_DIR)
+
+
+def get_test_type(test: dict):
+    """
+    :param test: test from the test suite
+    :return: type of the test, see `TEST_TYPES`.
+    """
+    return test.get("type", None) or "variable"
+
+
+def get_test_value_name(test: dict):
+    """
+    Gives the name which the true value of a test is stored under, see `Rubric.test_suite_values`.
+    It's the name of the checked variable, or, for function tests, a name which can't be a variable's one.
+
+    :param test: test from the test suite
+    :return: name of the value
+    """
+    if get_test_type(test) == "variable":
+        return test["variable_name"]
+    return f"{test['function_name']}: {test['test_name']}"
+
+
+def get_test_value_names(test: dict):
+    """
+    Lists all the values which a test needs from the solution: the true value and, for function tests
+    which inputs are given by a variable's name, the inputs.
+
+    :param test: test from the test suite
+    :return: list of values' names
+    """
+    names = [get_test_value_name(test)]
+    if get_test_type(test) != "variable" and isinstance(test["inputs"], str):
+        names.append(test["inputs"])
+    return names
+
+
+def get_function_tests(test_suite, values=None):
+    """
+    Lists the tests which call functions, for `Executor` to run them, see `function_test_runners`.
+
+    :param test_suite: list of tests
+    :param values: values of the test suite's variables. Inputs which are given by a variable's name
+            are taken from there. If None, they're taken from the executed file's namespace.
+    :return: list of copies of the tests, with their "type", the "name" of the value they produce,
+            and their "inputs".
+    """
+    function_tests = []
+    for test in test_suite:
+        if get_test_type(test) not in function_test_runners:
+            continue
+        function_test = dict(test, type=get_test_type(test), name=get_test_value_name(test))
+        if values is not None and isinstance(test["inputs"], str):
+            function_test["inputs"] = values[test["inputs"]]
+        function_tests.append(function_test)
+    return function_tests
+
+
+def get_namespace_function_tests(namespace: dict):
+    """
+    Lists the function tests from the test suite defined in a solution's namespace, when the rubric
+    is a part of the solution itself. Malformed tests are skipped: the rubric is checked later.
+
+    :param namespace: namespace of the executed solution
+    :return: list of function tests, see `get_function_tests`.
+    """
+    test_suite = namespace.get("test_suite", None)
+    if type(test_suite) is not list:
+        return []
+    tests = [test for test in test_suite if isinstance(test, dict) and "test_name" in test
+             and "function_name" in test and type(test.get("inputs", None)) in (list, str)]
+    return get_function_tests(tests)
@@ -0,0 +1,168 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import pickle
+import signal
+import sys
+import tempfile
+import time
+
+from gspack.helpers import UserFailure, GspackFailure
+from gspack.timings import maxrss_to_megabytes
+
+# How often the parent process checks whether the sandboxed child has finished, in seconds.
+POLL_INTERVAL = 0.005
+MAX_POLL_INTERVAL = 0.1
+
+
+def sandbox_is_supported():
+    """
+    Checks whether the current OS supports the sandbox: it needs os.fork and rlimits.
+
+    :return: True if the sandbox can be used.
+    """
+    try:
+        import resource
+    except ImportError:
+        return False
+    return hasattr(os, "fork") and hasattr(os, "wait4")
+
+
+class ResourceUsage:
+    """
+    Resources which a sandboxed child process actually used.
+    """
+    def __init__(self, wall_time, cpu_time, peak_memory):
+        """
+        :param wall_time: wall-clock time, in seconds
+        :param cpu_time: user + system CPU time, in seconds
+        :param peak_memory: maximal resident set size, in megabytes
+        """
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.peak_memory = peak_memory
+
+    @staticmethod
+    def from_rusage(wall_time, rusage):
+        return ResourceUsage(wall_time, rusage.ru_utime + rusage.ru_stime, maxrss_to_megabytes(rusage.ru_maxrss))
+
+    def __str__(self):
+        return (f"Resources used: wall time {self.wall_time:.2f} s, CPU time {self.cpu_time:.2f} s," +
+                f" peak memory {self.peak_memory:.0f} MB.")
+
+
+def run_in_sandbox(function, time_limit=None, cpu_time_limit=None, memory_limit=None):
+    """
+    Calls `function()` in a child process with limited resources and returns its result.
+    The child is killed once it exceeds its wall-clock time; its CPU time and address space are limited
+    via rlimits. Exceeding any of the limits leads to a UserFailure which reports the resources used.
+
+    :param function: function without arguments. Its result must be picklable.
+    :param time_limit: wall-clock time limit, in seconds
+    :param cpu_time_limit: CPU time limit, in seconds
+    :param memory_limit: address space limit, in megabytes
+    :return: whatever `function` returns. If `function` raises an exception, it's re-raised in the parent.
+    """
+    fd, result_path = tempfile.mkstemp(prefix="gspack_sandbox_")
+    os.close(fd)
+    try:
+        # Flush buffers so that the child does not print the parent's pending output second time
+        sys.stdout.flush()
+        sys.stderr.flush()
+        start = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            _run_child(function, result_path, cpu_time_limit, memory_limit)
+        timed_out, status, rusage = _wait_for_child(pid, time_limit)
+        usage = ResourceUsage.from_rusage(time.monotonic() - start, rusage)
+
+        if timed_out:
+            raise UserFailure(f"Your code did not finish within the time limit of {time_limit} seconds. {usage}")
+        if os.WIFSIGNALED(status):
+            if os.WTERMSIG(status) == signal.SIGXCPU:
+                raise UserFailure(f"Your code exceeded the CPU time limit of {cpu_time_limit} seconds. {usage}")
+            raise UserFailure(f"Your code was terminated by the signal {signal.Signals(os.WTERMSIG(status)).name}" +
+                              f" (it might have crashed or run out of memory). {usage}")
+
+        try:
+            with open(result_path, "rb") as f:
+                succeeded, result = pickle.load(f)
+        except Exception as e:
+            raise GspackFailure(f"The sandboxed process exited without reporting its results: {e}")
+        if not succeeded:
+            if isinstance(result, MemoryError):
+                raise UserFailure(f"Your code exceeded the memory limit of {memory_limit} MB. {usage}")
+            if isinstance(result, UserFailure):
+                # The same exception is re-raised, so that attributes which the function attached to it are kept
+                result.args = (f"{result} \n{usage}",)
+            raise result
+        return result
+    finally:
+        os.remove(result_path)
+
+
+def _run_child(function, result_path, cpu_time_limit, memory_limit):
+    # This function never returns: the child must not continue running the parent's code.
+    try:
+        # A separate process group allows killing everything the student's code spawned.
+        os.setpgid(0, 0)
+        _set_limits(cpu_time_limit, memory_limit)
+        try:
+            outcome = (True, function())
+        except BaseException as e:
+            outcome = (False, e)
+        with open(result_path, "wb") as f:
+            try:
+                pickle.dump(outcome, f)
+            except Exception as e:
+                f.seek(0)
+                f.truncate()
+                pickle.dump((False, GspackFailure(f"Results can't be transferred from the sandbox: {e}")), f)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+
+def _set_limits(cpu_time_limit, memory_limit):
+    import resource
+    if cpu_time_limit is not None:
+        # The soft limit sends SIGXCPU, and the hard one SIGKILL, in case SIGXCPU is handled by the student's code.
+        cpu_time_limit = int(max(1, round(cpu_time_limit)))
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_time_limit, cpu_time_limit + 1))
+    if memory_limit is not None:
+        memory_limit = int(memory_limit * 1024 ** 2)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def _wait_for_child(pid, time_limit):
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+    poll_interval = POLL_INTERVAL
+    while True:
+        waited_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+        if waited_pid != 0:
+            return False, status, rusage
+        if deadline is not None and time.monotonic() > deadline:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                os.kill(pid, signal.SIGKILL)
+            _, status, rusage = os.wait4(pid, 0)
+            return True, status, rusage
+        time.sleep(poll_interval)
+        # Short submissions are noticed quickly, while long ones don't keep the parent busy.
+        poll_interval = min(2 * poll_interval, MAX_POLL_INTERVAL)
@@ -0,0 +1,474 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path, PurePosixPath
+from zipfile import ZipFile
+
+import click
+
+from gspack.__about__ import __version__
+from gspack.directories import RUBRIC_JSON, TEST_SUITE_VALUES_DIR, VALUES_INDEX_JSON, RESULTS_JSON
+from gspack.environment import Environment
+from gspack.grader import load_rubric, run_grader, get_runtime_modules
+from gspack.helpers import UserFailure, GspackFailure
+from gspack.workers import fork_is_supported, preload_modules, ForkDispatcher
+
+# Default number of requests which can wait for a free worker. Requests beyond that are rejected.
+DEFAULT_QUEUE_SIZE = 16
+
+# Default wall-clock time limit of grading one submission, seconds.
+DEFAULT_REQUEST_TIME_LIMIT = 600
+
+# Maximal size of a request's body, in bytes.
+MAX_REQUEST_SIZE = 64 * 1024 ** 2
+
+# Fields of a grading request which are passed to the submission's Environment.
+ENVIRONMENT_FIELDS = ("name", "email", "attempt_number", "max_previous_score")
+
+
+class ServedRubric:
+    """
+    A rubric which a grading server grades against, alongside with its true values. The rubric comes either
+    from an autograder archive or from a rubric's JSON file (with its values store next to it),
+    and it's reloaded when the file changes.
+    """
+    def __init__(self, name, path: Path, verbose=False):
+        """
+        Loads the rubric.
+
+        :param name: name of the rubric, which requests refer to it by.
+        :param path: path to an autograder.zip or to a rubric.json
+        :param verbose: whether to report reloads.
+        """
+        self.name = name
+        self.path = Path(path).absolute()
+        self.verbose = verbose
+        self.rubric = None
+        self.rubric_path = None
+        self.test_values_path = None
+        self.stamp = None
+        # Archives are extracted to temporary directories. Old ones are kept until the server stops,
+        # since submissions which are being graded can still use them.
+        self.extracted_dirs = []
+        self._lock = threading.Lock()
+        if not self.path.is_file():
+            raise UserFailure(f"Rubric does not exist: \n -> {self.path}")
+        self.get()
+
+    def _get_stamp(self):
+        if self.path.suffix == ".zip":
+            paths = [self.path]
+        else:
+            paths = [self.path, self.path.parent / TEST_SUITE_VALUES_DIR / VALUES_INDEX_JSON]
+        return tuple((path.stat().st_mtime_ns, path.stat().st_size) if path.exists() else None for path in paths)
+
+    def get(self):
+        """
+        Returns the rubric, after reloading it if its file has changed since it was loaded.
+
+        :return: tuple: Rubric with its true values attached, path to its JSON file, path to its values.
+        """
+        with self._lock:
+            stamp = self._get_stamp()
+            if stamp != self.stamp:
+                try:
+                    self._load()
+                    self.stamp = stamp
+                    if self.verbose:
+                        print(f"Loaded the rubric '{self.name}': \n-> {self.path}")
+                except Exception as e:
+                    # E.g. the archive is being rewritten right now: the previous version is served until
+                    # a new one can be loaded.
+                    if self.rubric is None:
+                        raise
+                    print(f"WARNING: The rubric '{self.name}' can't be reloaded, the previous version is used: {e}")
+            return self.rubric, self.rubric_path, self.test_values_path
+
+    def _load(self):
+        if self.path.suffix == ".zip":
+            extracted_dir = Path(tempfile.mkdtemp(prefix="gspack_rubric_"))
+            self.extracted_dirs.append(extracted_dir)
+            with ZipFile(self.path) as archive:
+                archive.extractall(extracted_dir)
+            rubric_path = extracted_dir / RUBRIC_JSON
+        else:
+            rubric_path = self.path
+        test_values_path = rubric_path.parent / TEST_SUITE_VALUES_DIR
+        self.rubric = load_rubric(rubric_path, test_values_path)
+        self.rubric_path = rubric_path
+        self.test_values_path = test_values_path
+
+    def close(self):
+        """
+        Removes the extracted archives.
+
+        :return: None
+        """
+        for extracted_dir in self.extracted_dirs:
+            shutil.rmtree(extracted_dir, ignore_errors=True)
+
+
+class GradingServer:
+    """
+    Grades submissions against rubrics which are loaded once and kept in memory. Every submission is
+    executed in a fresh child process forked from the server's dispatcher process (see `ForkDispatcher`),
+    so submissions can't affect each other or the server, while the rubrics, their values, and the grading runtime
+    are inherited by the children for free. A submission which takes longer than `request_time_limit` is killed.
+
+    At most `workers` submissions are graded at the same time, and at most `queue_size` more wait for
+    a free worker. Requests beyond that are rejected right away, so that clients can retry later
+    instead of piling up.
+    """
+    def __init__(self, rubrics: dict, workers=None, queue_size=DEFAULT_QUEUE_SIZE, verbose=False,
+                 request_time_limit=DEFAULT_REQUEST_TIME_LIMIT):
+        """
+        Creates an instance of GradingServer. Create it before starting any threads, see `ForkDispatcher`.
+
+        :param rubrics: dictionary "name" - "path to an autograder.zip or to a rubric.json"
+        :param workers: maximal number of submissions graded at the same time. Defaults to the number of CPUs.
+        :param queue_size: maximal number of submissions waiting for a free worker.
+        :param verbose: whether to report reloads of the rubrics.
+        :param request_time_limit: wall-clock time limit of grading one submission, seconds. A submission which
+                exceeds it is killed, so that its worker is freed even if the rubric sets no `time_limit`.
+        """
+        if not fork_is_supported():
+            raise GspackFailure("Grading server requires os.fork, which is not available on this OS.")
+        if len(rubrics) == 0:
+            raise UserFailure("At least one rubric is needed for grading.")
+        self.rubrics = {name: ServedRubric(name, path, verbose=verbose) for name, path in rubrics.items()}
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue_size = queue_size
+        self._running = threading.BoundedSemaphore(self.workers)
+        self._admitted = threading.BoundedSemaphore(self.workers + queue_size)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self.request_time_limit = request_time_limit
+        # Import the grading runtime and the rubrics' requirements once: children inherit them.
+        runtime_modules = []
+        for served_rubric in self.rubrics.values():
+            runtime_modules += get_runtime_modules(served_rubric.rubric, served_rubric.rubric_path)
+        preload_modules(sorted(set(runtime_modules)))
+        # Submissions are forked by a single-threaded dispatcher process, not by the threads serving
+        # the requests. The dispatcher keeps its own copies of the rubrics up-to-date.
+        self._dispatcher = ForkDispatcher(_grade_forked_submission, prepare=self._attach_rubric,
+                                          finish=self._close_rubrics)
+
+    def get_status(self):
+        """
+        :return: dictionary with the names of the rubrics and the numbers of workers and requests being served.
+        """
+        return {"rubrics": sorted(self.rubrics), "workers": self.workers, "queue_size": self.queue_size,
+                "pending": self._pending}
+
+    def grade(self, rubric_name, request: dict):
+        """
+        Grades a submission.
+
+        :param rubric_name: name of the rubric to grade against. Can be None if the server has only one rubric.
+        :param request: dictionary with the submission: either "files" (dictionary "file name" - "content")
+                or "submission_dir" (path to a directory on the server's host, which is copied and not modified).
+                It can also contain the student's "name", "email", "attempt_number", and "max_previous_score".
+        :return: tuple: HTTP status code, and the content of results.json or a dictionary with the "error".
+        """
+        if not self._admitted.acquire(blocking=False):
+            return 503, {"error": "The grading queue is full, try again later."}
+        try:
+            with self._pending_lock:
+                self._pending += 1
+            with self._running:
+                return self._grade(rubric_name, request)
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+            self._admitted.release()
+
+    def _grade(self, rubric_name, request):
+        if rubric_name is None and len(self.rubrics) == 1:
+            rubric_name = next(iter(self.rubrics))
+        if rubric_name not in self.rubrics:
+            return 404, {"error": f"Unknown rubric: {rubric_name}. Available rubrics: {', '.join(self.rubrics)}"}
+        with tempfile.TemporaryDirectory(prefix="gspack_submission_") as work_dir:
+            submission_dir = Path(work_dir) / "submission"
+            try:
+                write_submission(request, submission_dir)
+            except UserFailure as e:
+                return 400, {"error": str(e)}
+            # The rubric's paths are filled in by the dispatcher, see `_attach_rubric`
+            environment = Environment(
+                submission_dir=submission_dir,
+                results_path=Path(work_dir) / RESULTS_JSON,
+                **{field: request[field] for field in ENVIRONMENT_FIELDS if field in request}
+            )
+            exit_code, message = self._dispatcher.run((environment, rubric_name), time_limit=self.request_time_limit)
+            if message is not None:
+                return 500, {"error": f"The submission was not graded: {message}"}
+            try:
+                with open(environment.results_path, "r") as f:
+                    return 200, json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                return 500, {"error": f"No results were produced (exit code {exit_code}): {e}"}
+
+    def _attach_rubric(self, task):
+        # Called in the dispatcher process before a submission is forked: reloads the rubric if it has changed.
+        environment, rubric_name = task
+        rubric, environment.rubric_path, environment.test_values_path = self.rubrics[rubric_name].get()
+        return environment, rubric
+
+    def _close_rubrics(self):
+        for served_rubric in self.rubrics.values():
+            served_rubric.close()
+
+    def close(self):
+        """
+        Stops the dispatcher process and releases the resources of the rubrics.
+
+        :return: None
+        """
+        self._dispatcher.close()
+        self._close_rubrics()
+
+
+def _grade_forked_submission(task):
+    environment, rubric = task
+    return 0 if run_grader(environment, rubric=rubric) == 0 else 1
+
+
+def write_submission(request: dict, submission_dir: Path):
+    """
+    Puts the submission's files from a grading request to a directory.
+
+    :param request: grading request, see `GradingServer.grade`
+    :param submission_dir: directory to put the files to. Must not exist.
+    :return: None
+    """
+    if "files" in request:
+        submission_dir.mkdir()
+        if not isinstance(request["files"], dict) or len(request["files"]) == 0:
+            raise UserFailure("'files' must be a non-empty dictionary 'file name' - 'content'.")
+        for file_name, content in request["files"].items():
+            relative_path = PurePosixPath(file_name)
+            # Files must stay inside the submission's directory
+            if relative_path.is_absolute() or ".." in relative_path.parts or not isinstance(content, str):
+                raise UserFailure(f"Invalid file in the submission: {file_name}")
+            (submission_dir / relative_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(submission_dir / relative_path, "w") as f:
+                f.write(content)
+    elif "submission_dir" in request:
+        source_dir = Path(str(request["submission_dir"]))
+        if not source_dir.is_dir():
+            raise UserFailure(f"Submission directory does not exist: {source_dir}")
+        shutil.copytree(source_dir, submission_dir)
+    else:
+        raise UserFailure("The request must contain either 'files' or 'submission_dir'.")
+
+
+class GradingRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of a grading server:
+
+    - `POST /grade/<rubric name>` (or `POST /grade` if there is only one rubric) with a JSON body described in
+      `GradingServer.grade` responds with the content of results.json. 503 means that the queue is full.
+    - `GET /status` responds with the server's status, see `GradingServer.get_status`.
+    """
+    server_version = f"gspack/{__version__}"
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/status":
+            self.respond(200, self.server.grading_server.get_status())
+        else:
+            self.respond(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if parts[0] != "grade" or len(parts) > 2:
+            self.respond(404, {"error": f"Unknown path: {self.path}"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_REQUEST_SIZE:
+            self.respond(413, {"error": f"The request is larger than {MAX_REQUEST_SIZE} bytes."})
+            return
+        try:
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            if not isinstance(request, dict):
+                raise ValueError("a JSON object is expected.")
+        except ValueError as e:
+            self.respond(400, {"error": f"Invalid request: {e}"})
+            return
+        status, payload = self.server.grading_server.grade(parts[1] if len(parts) == 2 else None, request)
+        self.respond(status, payload)
+
+    def respond(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of Unix sockets have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server which listens on a Unix socket.
+    """
+    daemon_threads = True
+
+
+def make_http_server(grading_server: GradingServer, socket_path=None, port=None, verbose=False):
+    """
+    Creates an HTTP server for the grading server. It's not started.
+
+    :param grading_server: GradingServer to serve the requests with
+    :param socket_path: path of a Unix socket to listen on.
+    :param port: port to listen on at localhost, if `socket_path` is not provided. 0 means any free port.
+    :param verbose: whether to log the requests
+    :return: an instance of socketserver.BaseServer
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        http_server = UnixHTTPServer(str(socket_path), GradingRequestHandler)
+    elif port is not None:
+        http_server = ThreadingHTTPServer(("127.0.0.1", port), GradingRequestHandler)
+    else:
+        raise UserFailure("Either a Unix socket or a port is needed.")
+    http_server.grading_server = grading_server
+    http_server.verbose = verbose
+    return http_server
+
+
+@click.command(
+    help="Grades submissions sent over HTTP, on a Unix socket or on a localhost port, keeping the rubrics in memory"
+)
+@click.version_option(
+    version=__version__
+)
+@click.option(
+    "--rubric",
+    "rubrics",
+    multiple=True,
+    required=True,
+    type=str,
+    help="[NAME=]PATH to an autograder.zip or a rubric.json; can be repeated. " +
+         "NAME defaults to the name of the file's directory"
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    default=None,
+    type=str,
+    help="path of a Unix socket to listen on"
+)
+@click.option(
+    "--port",
+    default=None,
+    type=int,
+    help="port to listen on at localhost"
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="number of submissions graded at the same time (default: number of CPUs)"
+)
+@click.option(
+    "--queue-size",
+    default=DEFAULT_QUEUE_SIZE,
+    type=int,
+    help="number of submissions which can wait for a free worker; more are rejected with 503"
+)
+@click.option(
+    "--request-time-limit",
+    default=DEFAULT_REQUEST_TIME_LIMIT,
+    type=float,
+    help=f"seconds after which grading a submission is stopped (default: {DEFAULT_REQUEST_TIME_LIMIT})"
+)
+@click.option(
+    "--verbose",
+    is_flag=True,
+    help="log every request"
+)
+def serve_from_terminal(rubrics, socket_path, port, workers, queue_size, request_time_limit, verbose):
+    """
+    Wrapper function which is called when gsgrade_serve is called from the terminal.
+
+    :param rubrics: list of "[NAME=]PATH" strings
+    :param socket_path: path of a Unix socket to listen on
+    :param port: port to listen on at localhost
+    :param workers: number of submissions graded at the same time
+    :param queue_size: number of submissions which can wait for a free worker
+    :param request_time_limit: wall-clock time limit of grading one submission, seconds
+    :param verbose: whether to log every request
+    :return: 0 (zero) if the server stopped normally, otherwise -1
+    """
+    rubric_paths = {}
+    for rubric in rubrics:
+        name, _, path = rubric.rpartition("=")
+        rubric_paths[name or Path(path).absolute().parent.name] = path
+    try:
+        serve(rubric_paths, socket_path=socket_path, port=port, workers=workers, queue_size=queue_size,
+              request_time_limit=request_time_limit, verbose=verbose)
+    except UserFailure as e:
+        print(f"ERROR: {e}")
+        return -1
+    return 0
+
+
+def serve(rubrics: dict, socket_path=None, port=None, workers=None, queue_size=DEFAULT_QUEUE_SIZE,
+          request_time_limit=DEFAULT_REQUEST_TIME_LIMIT, verbose=False):
+    """
+    Runs a grading server until it's interrupted, see `GradingServer` and `GradingRequestHandler`.
+
+    :param rubrics: dictionary "name" - "path to an autograder.zip or to a rubric.json"
+    :param socket_path: path of a Unix socket to listen on.
+    :param port: port to listen on at localhost, if `socket_path` is not provided.
+    :param workers: maximal number of submissions graded at the same time. Defaults to the number of CPUs.
+    :param queue_size: maximal number of submissions waiting for a free worker.
+    :param request_time_limit: wall-clock time limit of grading one submission, seconds.
+    :param verbose: whether to log every request.
+    :return: None
+    """
+    grading_server = GradingServer(rubrics, workers=workers, queue_size=queue_size, verbose=verbose,
+                                   request_time_limit=request_time_limit)
+    try:
+        http_server = make_http_server(grading_server, socket_path=socket_path, port=port, verbose=verbose)
+        with http_server:
+            address = socket_path if socket_path is not None else f"http://127.0.0.1:{http_server.server_address[1]}"
+            print(f"Serving {', '.join(sorted(rubrics))} with {grading_server.workers} workers: \n-> {address}")
+            try:
+                http_server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        grading_server.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
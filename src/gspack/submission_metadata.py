@@ -0,0 +1,194 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import re
+from pathlib import Path
+
+from gspack.helpers import GspackFailure
+
+# Size of pieces in which JSON files are read, in characters.
+JSON_READ_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_START = "-0123456789"
+_NUMBER_END = re.compile(r"[^-+.eE0-9]")
+_DECODER = json.JSONDecoder()
+
+
+class JsonStream:
+    """
+    Reads a JSON document from a file piece by piece. Objects and arrays can be walked through
+    element by element, so that only the elements which are needed are decoded, and the memory is bounded
+    by the size of the largest element rather than by the size of the document.
+    Every element is decoded by the standard JSON decoder.
+    """
+    def __init__(self, f, read_size=JSON_READ_SIZE):
+        """
+        Creates an instance of JsonStream.
+
+        :param f: text file object
+        :param read_size: size of pieces in which the file is read, in characters.
+        """
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def _read_more(self, size):
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        # The part of the buffer which was already decoded is dropped
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+        return True
+
+    def peek(self):
+        """
+        Skips whitespaces and returns the next character without consuming it.
+
+        :return: the next character
+        """
+        while True:
+            self.position = _WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read_more(self.read_size):
+                raise GspackFailure("Malformed JSON: unexpected end of the file.")
+
+    def take(self, expected: str):
+        """
+        Consumes the next character, which must be one of the expected ones.
+
+        :param expected: string with the expected characters
+        :return: the character
+        """
+        character = self.peek()
+        if character not in expected:
+            raise GspackFailure(f"Malformed JSON: expected one of {expected!r}, got {character!r}.")
+        self.position += 1
+        return character
+
+    def value(self):
+        """
+        Decodes the next value.
+
+        :return: the value
+        """
+        read_size = self.read_size
+        if self.peek() in _NUMBER_START:
+            # A number at the end of the buffer can continue in the next piece of the file
+            while _NUMBER_END.search(self.buffer, self.position) is None and self._read_more(read_size):
+                pass
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.position)
+                self.position = end
+                return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise GspackFailure(f"Malformed JSON: {e}")
+            # The value does not fit into the buffer. Pieces grow, so that a large value is decoded
+            # a logarithmic number of times.
+            self._read_more(read_size)
+            read_size *= 2
+
+    def iter_object(self):
+        """
+        Walks through an object. The caller must consume every value, e.g. by `value()` or `iter_object()`,
+        before asking for the next key.
+
+        :return: generator of the object's keys
+        """
+        self.take("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self.take(":")
+            yield key
+            if self.take(",}") == "}":
+                return
+
+    def iter_array(self):
+        """
+        Walks through an array. The caller must consume every element before asking for the next one.
+
+        :return: generator of the elements' indices
+        """
+        self.take("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        i = 0
+        while True:
+            yield i
+            i += 1
+            if self.take(",]") == "]":
+                return
+
+
+def read_submission_metadata(path: Path, read_size=JSON_READ_SIZE):
+    """
+    Reads Gradescope's submission_metadata.json. Previous submissions are streamed one by one,
+    and only their scores and outcomes are decoded: results of their tests, which make the most of the file
+    for students with many attempts, are skipped. The memory used does not depend on the number of attempts.
+
+    :param path: path to submission_metadata.json
+    :param read_size: size of pieces in which the file is read, see `JsonStream`.
+    :return: dictionary with the student(s) ("users"), the number of previous attempts which count
+            towards the limit ("attempts"), and the maximal score of those attempts ("max_previous_score").
+    """
+    metadata = {"users": None, "attempts": 0, "max_previous_score": 0}
+    with open(path, "r", encoding="utf-8") as f:
+        stream = JsonStream(f, read_size=read_size)
+        for key in stream.iter_object():
+            if key == "users":
+                metadata["users"] = stream.value()
+            elif key == "previous_submissions" and stream.peek() == "[":
+                for _ in stream.iter_array():
+                    results = _read_previous_results(stream)
+                    if results is None:
+                        # it happens sometimes when the autograder failed to
+                        # produce any output at all during one of the previous submissions
+                        # due to a bug in the autograder itself.
+                        continue
+                    extra_data = results.get("extra_data", None)
+                    if extra_data is not None and extra_data["success"] and not extra_data["pretest"]:
+                        metadata["attempts"] += 1
+                        metadata["max_previous_score"] = max(metadata["max_previous_score"], results["score"])
+            else:
+                stream.value()
+    return metadata
+
+
+def _read_previous_results(stream: JsonStream):
+    # Only the score and the extra data are taken from the results of a previous submission
+    results = None
+    for key in stream.iter_object():
+        if key == "results" and stream.peek() == "{":
+            results = {}
+            for results_key in stream.iter_object():
+                value = stream.value()
+                if results_key in ("score", "extra_data"):
+                    results[results_key] = value
+        else:
+            stream.value()
+    return results
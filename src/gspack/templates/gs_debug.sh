@@ -1,6 +1,5 @@
 #!/usr/bin/env bash
 
-python3.7 -m pip uninstall -y gspack
-git clone https://github.com/aksholokhov/gspack
-cd gspack || exit
-python3.7 setup.py develop
\ No newline at end of file
+# Re-install gspack from the wheel which comes with the archive
+python3.10 -m pip uninstall -y gspack
+python3.10 -m pip install --no-deps /autograder/source/gspack-*.whl
@@ -13,10 +13,9 @@ if [[ -f "/autograder/source/requirements.txt" ]]; then
     python3.10 -m pip install -r /autograder/source/requirements.txt
 fi
 
-git clone https://github.com/aksholokhov/gspack
-cd gspack || exit
-python3.10 setup.py install
-cd .. || exit
+# Install gspack from the wheel which comes with the archive:
+# it's the same version which created the archive, and it does not need to be downloaded.
+python3.10 -m pip install /autograder/source/gspack-*.whl
 
 matlab=$(jq '.matlab_support' /autograder/source/config.json)
 if [ $matlab = 1 ]; then
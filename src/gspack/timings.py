@@ -0,0 +1,127 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def maxrss_to_megabytes(maxrss):
+    """
+    Converts `ru_maxrss` from `resource.getrusage` to megabytes.
+
+    :param maxrss: maximal resident set size, as reported by the OS
+    :return: the same in megabytes
+    """
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    return maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def get_peak_memory():
+    """
+    Returns the peak memory of the current process and its finished child processes
+    (e.g. the sandbox which executed the student's code).
+
+    :return: maximal resident set size so far, in megabytes, or None if the OS does not report it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                 resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(maxrss_to_megabytes(maxrss), 1)
+
+
+class PhaseTimer:
+    """
+    Records how long each phase of grading (or packaging) takes, and the peak memory by the end of each phase.
+    """
+    def __init__(self):
+        """
+        Creates an instance of PhaseTimer.
+        """
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measures one phase. Phases which fail are recorded as well.
+
+        :param name: name of the phase, like "execute"
+        :return: context manager which measures the code inside it
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append({
+                "phase": name,
+                "seconds": round(time.monotonic() - start, 6),
+                "peak_memory_mb": get_peak_memory()
+            })
+
+    def write_log(self, log_path: Path, **fields):
+        """
+        Appends the timings as one line to a JSON-lines log.
+
+        :param log_path: path to the log
+        :param fields: extra fields which identify the record, like the submission's name
+        :return: None
+        """
+        record = {"time": time.time(), **fields, "phases": self.phases}
+        # The whole line is written at once, so that processes which share the log don't interleave their records.
+        with open(log_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+@contextmanager
+def profiling(profiler):
+    """
+    Enables a profiler for the code inside the context, if any.
+
+    :param profiler: an instance of cProfile.Profile, or None
+    :return: context manager
+    """
+    if profiler is None:
+        yield
+        return
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+
+@contextmanager
+def not_profiling(profiler):
+    """
+    Pauses a profiler for the code inside the context, if any. Meant for excluding the student's code
+    from profiles of gspack's own work.
+
+    :param profiler: an instance of cProfile.Profile, or None
+    :return: context manager
+    """
+    if profiler is None:
+        yield
+        return
+    profiler.disable()
+    try:
+        yield
+    finally:
+        profiler.enable()
@@ -0,0 +1,146 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import pickle
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+
+from gspack.directories import VALUES_INDEX_JSON, TEST_SUITE_VALUES_FILE
+from gspack.helpers import GspackFailure
+
+# Version of the values store's layout, saved to its index.
+VALUES_STORE_FORMAT = 1
+
+# Python types which are stored right in the index, as JSON.
+JSON_TYPES = (bool, int, float, str)
+
+
+def iter_value_files(values: dict, metadata: dict = None):
+    """
+    Lays out values as files of a values store: every array is saved to its own .npy file,
+    so that it can be memory-mapped independently from the others; plain numbers and strings are
+    kept in a small JSON index; everything else is pickled into its own file.
+
+    :param values: dictionary "name" - "value"
+    :param metadata: JSON-serializable dictionary which is saved to the index alongside with the values
+    :return: generator of tuples (file name, function which writes the file's content into a binary file object).
+            The index goes last.
+    """
+    index = {"format": VALUES_STORE_FORMAT, "metadata": metadata or {}, "values": {}}
+    for i, (name, value) in enumerate(values.items()):
+        if type(value) in JSON_TYPES:
+            index["values"][name] = {"kind": "json", "value": value}
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            file_name = f"{i}.npy"
+            index["values"][name] = {"kind": "npy", "file": file_name}
+            yield file_name, lambda f, value=value: np.save(f, value, allow_pickle=False)
+        else:
+            file_name = f"{i}.pickle"
+            index["values"][name] = {"kind": "pickle", "file": file_name}
+            yield file_name, lambda f, value=value: pickle.dump(value, f)
+    yield VALUES_INDEX_JSON, lambda f: f.write(json.dumps(index).encode("utf-8"))
+
+
+def save_values(values: dict, path: Path, metadata: dict = None):
+    """
+    Saves values to a values store, see `iter_value_files`.
+
+    :param values: dictionary "name" - "value"
+    :param path: directory to save the store to. Created if it does not exist.
+    :param metadata: JSON-serializable dictionary which is saved alongside with the values
+    :return: None
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    for file_name, write in iter_value_files(values, metadata=metadata):
+        with open(path / file_name, "wb") as f:
+            write(f)
+
+
+class StoredValues(Mapping):
+    """
+    Read-only dictionary of values from a values store. Values are loaded lazily, on the first access,
+    and arrays are memory-mapped, so only the values which are actually used are read from the disk.
+    """
+    def __init__(self, path: Path):
+        """
+        Opens a values store.
+
+        :param path: directory with the store
+        """
+        self.path = Path(path)
+        with open(self.path / VALUES_INDEX_JSON, "r") as f:
+            index = json.load(f)
+        if index.get("format", None) != VALUES_STORE_FORMAT:
+            raise GspackFailure(f"Unsupported format of the values store: {self.path}")
+        self.metadata = index.get("metadata", {})
+        self._index = index["values"]
+        self._loaded = {}
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            entry = self._index[name]
+            if entry["kind"] == "json":
+                value = entry["value"]
+            elif entry["kind"] == "npy":
+                value = np.load(self.path / entry["file"], mmap_mode="r", allow_pickle=False)
+            else:
+                with open(self.path / entry["file"], "rb") as f:
+                    value = pickle.load(f)
+            self._loaded[name] = value
+        return self._loaded[name]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+def find_values_path(path: Path):
+    """
+    Finds where the values which `load_values` loads from a path actually are.
+
+    :param path: path to a values store's directory or to a pickle file
+    :return: path to the values store's directory, or to the pickle file next to it (archives created
+            by older versions of gspack keep all values in one), or None if there are no values.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return path
+    for pickle_path in (path, path.parent / TEST_SUITE_VALUES_FILE):
+        if pickle_path.is_file():
+            return pickle_path
+    return None
+
+
+def load_values(path: Path):
+    """
+    Opens stored values. Supports both values stores and pickled dictionaries,
+    which were used by archives created with older versions of gspack.
+
+    :param path: path to a values store's directory or to a pickle file
+    :return: dictionary-like object "name" - "value"
+    """
+    values_path = find_values_path(path)
+    if values_path is None:
+        raise GspackFailure(f"True values for the rubric's tests are not found: \n -> {path}")
+    if values_path.is_dir():
+        return StoredValues(values_path)
+    with open(values_path, "rb") as f:
+        return pickle.load(f)
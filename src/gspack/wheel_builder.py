@@ -0,0 +1,137 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import base64
+import hashlib
+import io
+import os
+from pathlib import Path
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+try:
+    from importlib import metadata
+except ImportError:
+    # Python 3.7
+    import importlib_metadata as metadata
+
+from gspack.__about__ import __title__, __summary__, __uri__, __version__, __author__, __email__, __license__
+from gspack.__about__ import __python_requires__, __console_scripts__
+from gspack.helpers import GspackFailure
+
+# All entries of the wheel get the same timestamp, so that wheels of the same code are byte-identical.
+WHEEL_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Files of the package which are not needed for running it.
+IGNORED_DIRS = ("__pycache__",)
+IGNORED_SUFFIXES = (".pyc", ".pyo")
+
+
+def get_wheel_name():
+    """
+    :return: file name of the gspack's wheel, which follows the wheels' naming convention.
+    """
+    return f"{__title__}-{__version__}-py3-none-any.whl"
+
+
+def get_package_files():
+    """
+    Lists the files of the gspack package which is currently running (its modules and templates).
+
+    :return: sorted list of tuples (name inside the wheel, path to the file)
+    """
+    package_dir = Path(os.path.dirname(__file__))
+    files = []
+    for root, dirs, file_names in os.walk(package_dir):
+        dirs[:] = sorted(d for d in dirs if d not in IGNORED_DIRS)
+        for file_name in sorted(file_names):
+            if file_name.endswith(IGNORED_SUFFIXES):
+                continue
+            path = Path(root) / file_name
+            files.append(((Path(__title__) / path.relative_to(package_dir)).as_posix(), path))
+    return files
+
+
+def get_requirements():
+    """
+    Lists the dependencies of gspack: from the installed distribution's metadata, or, if gspack runs from
+    its source tree without being installed, from the tree's requirements.txt.
+
+    :return: list of requirements
+    """
+    try:
+        return metadata.requires(__title__) or []
+    except metadata.PackageNotFoundError:
+        pass
+    requirements_path = Path(os.path.dirname(__file__)).parents[1] / "requirements.txt"
+    if not requirements_path.exists():
+        raise GspackFailure("Requirements of gspack can't be found: it's neither installed nor runs from its " +
+                            "source tree. Reinstall gspack.")
+    with open(requirements_path, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_wheel():
+    """
+    Builds a wheel of the gspack package which is currently running, in memory.
+    The wheel is deterministic: the same code gives byte-identical wheels.
+
+    :return: content of the wheel
+    """
+    dist_info = f"{__title__}-{__version__}.dist-info"
+    files = [(name, path.read_bytes()) for name, path in get_package_files()]
+    files.append((f"{dist_info}/METADATA", get_metadata().encode("utf-8")))
+    files.append((f"{dist_info}/WHEEL", (f"Wheel-Version: 1.0\nGenerator: {__title__} ({__version__})\n" +
+                                         "Root-Is-Purelib: true\nTag: py3-none-any\n").encode("utf-8")))
+    files.append((f"{dist_info}/entry_points.txt",
+                  ("[console_scripts]\n" + "".join(f"{script}\n" for script in __console_scripts__)).encode("utf-8")))
+    files.append((f"{dist_info}/top_level.txt", f"{__title__}\n".encode("utf-8")))
+
+    # RECORD lists hashes and sizes of all the other files
+    record = ""
+    for name, content in files:
+        digest = base64.urlsafe_b64encode(hashlib.sha256(content).digest()).rstrip(b"=").decode("ascii")
+        record += f"{name},sha256={digest},{len(content)}\n"
+    record += f"{dist_info}/RECORD,,\n"
+    files.append((f"{dist_info}/RECORD", record.encode("utf-8")))
+
+    wheel = io.BytesIO()
+    with ZipFile(wheel, "w", compression=ZIP_DEFLATED) as zip_file:
+        for name, content in files:
+            info = ZipInfo(name, date_time=WHEEL_DATE_TIME)
+            info.compress_type = ZIP_DEFLATED
+            info.create_system = 3
+            info.external_attr = 0o644 << 16
+            zip_file.writestr(info, content)
+    return wheel.getvalue()
+
+
+def get_metadata():
+    """
+    :return: content of the wheel's METADATA file
+    """
+    lines = [
+        "Metadata-Version: 2.1",
+        f"Name: {__title__}",
+        f"Version: {__version__}",
+        f"Summary: {__summary__}",
+        f"Home-page: {__uri__}",
+        f"Author: {__author__}",
+        f"Author-email: {__email__}",
+        f"License: {__license__}",
+        f"Requires-Python: {__python_requires__}",
+    ]
+    lines += [f"Requires-Dist: {requirement}" for requirement in get_requirements()]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,302 @@
+#     GSPack: Programming Assignment Packager for GradeScope AutoGrader
+#     Copyright (C) 2020  Aleksei Sholokhov
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import importlib
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from gspack.helpers import GspackFailure
+
+# How often ForkServerPool and ForkDispatcher check whether their children have finished, seconds
+CHILD_POLL_INTERVAL = 0.005
+
+
+def fork_is_supported():
+    """
+    Checks whether the current OS can fork processes (i.e. it's not Windows).
+
+    :return: True if os.fork is available.
+    """
+    return hasattr(os, "fork")
+
+
+def preload_modules(module_names, verbose=False):
+    """
+    Imports modules into the current process, so that processes forked from it
+    get them for free. Modules that fail to import are skipped: the child process
+    will try again and report the error, if any, to the student as usual.
+
+    :param module_names: names of modules to import, like "numpy" or "matplotlib.pyplot"
+    :param verbose: whether to print the modules which failed to import
+    :return: list of names of modules which were imported successfully
+    """
+    imported = []
+    for name in module_names:
+        try:
+            importlib.import_module(name)
+            imported.append(name)
+        except Exception as e:
+            if verbose:
+                print(f"-> {name}: can't preload ({e})")
+    return imported
+
+
+def requirement_to_module_name(requirement: str):
+    """
+    Makes a best guess about the importable module name for a requirement,
+    e.g. "scikit-image>=0.18" -> "scikit_image".
+
+    :param requirement: a line from requirements.txt
+    :return: a module name
+    """
+    name = re.split(r"[<>=!~;\[ ]", requirement.strip(), maxsplit=1)[0]
+    return name.replace("-", "_")
+
+
+class ForkServerPool:
+    """
+    Runs every task in a fresh child process, forked from the current (server) process.
+
+    The server imports the grading runtime once (see `preload_modules`), and every child gets it
+    through copy-on-write memory instead of importing it again. Every child runs exactly one task
+    and exits, so nothing that a student's code does in one child can affect other submissions.
+    """
+
+    def __init__(self, workers=None):
+        """
+        Creates an instance of ForkServerPool.
+
+        :param workers: maximal number of children running at the same time. Defaults to the number of CPUs.
+        """
+        if not fork_is_supported():
+            raise GspackFailure("ForkServerPool requires os.fork, which is not available on this OS.")
+        self.workers = max(1, workers or os.cpu_count() or 1)
+
+    def map(self, function, items):
+        """
+        Calls `function(item)` for every item, each in its own child process.
+
+        :param function: function which takes one item and returns an int exit code.
+                Its other outputs, if any, should be written to disk by the function itself.
+        :param items: list of arguments for `function`
+        :return: list of exit codes in the same order as `items`.
+                A negative code -N means that the child was killed by the signal N.
+        """
+        items = list(items)
+        exit_codes = [None] * len(items)
+        running = {}
+        next_item = 0
+        while next_item < len(items) or running:
+            while next_item < len(items) and len(running) < self.workers:
+                pid = fork_call(function, items[next_item])
+                running[pid] = next_item
+                next_item += 1
+            # Only the pool's own children are waited for: other children of the process, like a MATLAB engine
+            # or the caller's subprocesses, must keep their exit statuses to whoever started them.
+            finished = False
+            for pid in list(running):
+                waited_pid, status = os.waitpid(pid, os.WNOHANG)
+                if waited_pid == pid:
+                    exit_codes[running.pop(pid)] = _exit_code(status)
+                    finished = True
+            if not finished:
+                time.sleep(CHILD_POLL_INTERVAL)
+        return exit_codes
+
+
+class ForkDispatcher:
+    """
+    Runs tasks submitted from any thread of the current process, each in a fresh child process.
+
+    Forking from a multi-threaded process (e.g. a threading HTTP server) is unsafe: a lock which another
+    thread holds at that moment, like the one of stdout's buffer, stays locked in the child forever.
+    So the children are forked by a dispatcher process instead, which is forked once, when the dispatcher
+    is created, and never starts any threads. It inherits everything the current process has imported
+    or loaded by then, and passes it on to the children.
+    """
+
+    def __init__(self, function, prepare=None, finish=None):
+        """
+        Creates an instance of ForkDispatcher and forks its dispatcher process.
+        Create it before starting any threads.
+
+        :param function: function which takes one task and returns an int exit code. It's called in the children.
+        :param prepare: function which takes a task and returns the one for `function`, if any. It's called
+                in the dispatcher process before forking, e.g. to attach state which the dispatcher keeps up-to-date.
+        :param finish: function without arguments which is called in the dispatcher process when it stops, if any.
+        """
+        if not fork_is_supported():
+            raise GspackFailure("ForkDispatcher requires os.fork, which is not available on this OS.")
+        tasks_receiver, self._tasks = multiprocessing.Pipe(duplex=False)
+        self._results, results_sender = multiprocessing.Pipe(duplex=False)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._tasks.close()
+            self._results.close()
+            exit_code = 0
+            try:
+                self._dispatch(tasks_receiver, results_sender, function, prepare)
+                if finish is not None:
+                    finish()
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+        tasks_receiver.close()
+        results_sender.close()
+        self.pid = pid
+        self._lock = threading.Lock()
+        self._next_task_id = 0
+        self._waiting = {}
+        self._receiver = threading.Thread(target=self._receive_results, daemon=True)
+        self._receiver.start()
+
+    def run(self, task, time_limit=None):
+        """
+        Runs a task in a child process and waits until it's done. Can be called from any thread.
+
+        :param task: argument for `prepare` (or for `function` if there is no `prepare`), must be picklable.
+        :param time_limit: wall-clock time limit of the child, seconds. The child is killed when it expires.
+        :return: tuple: exit code of the child (a negative code -N means that it was killed by the signal N),
+                and a message explaining why the task failed to run, or None.
+        """
+        done = threading.Event()
+        with self._lock:
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            self._waiting[task_id] = [done, (-1, "The dispatcher process has stopped.")]
+            try:
+                self._tasks.send((task_id, task, time_limit))
+            except (OSError, ValueError):
+                del self._waiting[task_id]
+                return -1, "The dispatcher process has stopped."
+        done.wait()
+        with self._lock:
+            return self._waiting.pop(task_id)[1]
+
+    def close(self):
+        """
+        Stops the dispatcher process. Children which are still running are killed.
+
+        :return: None
+        """
+        self._tasks.close()
+        os.waitpid(self.pid, 0)
+        self._receiver.join()
+
+    def _receive_results(self):
+        # Runs in a thread of the current process: hands the results over to the waiting `run` calls.
+        while True:
+            try:
+                task_id, result = self._results.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                self._waiting[task_id][1] = result
+                self._waiting[task_id][0].set()
+        # The dispatcher has stopped: nothing else will come
+        with self._lock:
+            for done, _ in self._waiting.values():
+                done.set()
+
+    @staticmethod
+    def _dispatch(tasks, results, function, prepare):
+        # Runs in the dispatcher process: forks a child for every task, and reports its exit code
+        # when it exits or is killed after its time limit.
+        running = {}
+        while True:
+            if multiprocessing.connection.wait([tasks], timeout=CHILD_POLL_INTERVAL):
+                try:
+                    task_id, task, time_limit = tasks.recv()
+                except EOFError:
+                    break
+                try:
+                    if prepare is not None:
+                        task = prepare(task)
+                except Exception as e:
+                    results.send((task_id, (-1, f"The task can't be prepared: {e}")))
+                    continue
+                pid = fork_call(function, task)
+                deadline = None if time_limit is None else time.monotonic() + time_limit
+                running[pid] = (task_id, deadline, time_limit)
+            for pid, (task_id, deadline, time_limit) in list(running.items()):
+                timed_out = deadline is not None and time.monotonic() > deadline
+                if timed_out:
+                    os.kill(pid, signal.SIGKILL)
+                waited_pid, status = os.waitpid(pid, 0 if timed_out else os.WNOHANG)
+                if waited_pid == pid:
+                    del running[pid]
+                    message = f"It did not finish in {time_limit:g} seconds." if timed_out else None
+                    results.send((task_id, (_exit_code(status), message)))
+        # The current process has closed the dispatcher
+        for pid in running:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+
+def fork_call(function, item):
+    """
+    Calls `function(item)` in a child process forked from the current one. The child exits right after the call.
+
+    :param function: function which takes one item and returns an int exit code.
+    :param item: argument for `function`
+    :return: pid of the child. Its exit code can be collected by `wait_for_child`.
+    """
+    # Flush buffers so that the child does not print the parent's pending output second time
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    exit_code = 1
+    try:
+        exit_code = function(item)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # os._exit skips the parent's atexit handlers and finalizers, which the child must not run.
+        os._exit(exit_code & 0xff if isinstance(exit_code, int) else 0)
+
+
+def wait_for_child(pid):
+    """
+    Waits until a child process exits.
+
+    :param pid: pid of the child, see `fork_call`.
+    :return: exit code of the child. A negative code -N means that the child was killed by the signal N.
+    """
+    _, status = os.waitpid(pid, 0)
+    return _exit_code(status)
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
@@ -0,0 +1,53 @@
+import json
+
+from matplotlib import pyplot as plt
+
+from gspack.executor import Executor, make_headless_cell
+
+STUDENT_CODE = """
+import numpy as np
+from matplotlib import pyplot as plt
+
+figure, axes = plt.subplots()
+axes.plot(np.arange(10))
+plt.savefig("plot.png")
+figure.savefig("figure.png")
+plt.show()
+number_of_figures = len(plt.get_fignums())
+backend = plt.get_backend().lower()
+"""
+
+
+def make_notebook(cells):
+    return json.dumps({
+        "cells": [{"cell_type": "code", "execution_count": None, "metadata": {}, "outputs": [], "source": source}
+                  for source in cells],
+        "metadata": {},
+        "nbformat": 4,
+        "nbformat_minor": 4
+    })
+
+
+def test_headless_python_draws_nothing(tmp_path):
+    (tmp_path / "solution.py").write_text(STUDENT_CODE)
+    _, variables = Executor(headless=True).execute(tmp_path / "solution.py")
+    assert variables["number_of_figures"] == 1 and variables["backend"] == "agg"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["solution.py"]
+    # Saving figures works again after the execution
+    plt.figure()
+    plt.savefig(tmp_path / "plot.png")
+    plt.close("all")
+    assert (tmp_path / "plot.png").exists()
+
+
+def test_headless_notebook_skips_slow_magics(tmp_path):
+    (tmp_path / "solution.ipynb").write_text(make_notebook([
+        "%matplotlib inline\nimport numpy as np\nfrom matplotlib import pyplot as plt\nx = np.arange(5.0)",
+        "%%timeit\nnp.linalg.svd(np.ones((300, 300)))",
+        "!pip install no-such-package\nfor i in range(2):\n    %timeit x.sum()\nplt.figure()\nplt.figure()",
+        "open_figures = len(plt.get_fignums())\ntotal = x.sum()",
+    ]))
+    _, variables = Executor(headless=True).execute(tmp_path / "solution.ipynb")
+    # Figures are closed after every cell
+    assert variables["open_figures"] == 0 and variables["total"] == 10
+    assert make_headless_cell("  %timeit f()\n!ls\n!pip install numpy") == "  pass\n!ls\npass"
@@ -0,0 +1,61 @@
+import json
+import sys
+
+import pytest
+
+from gspack.executor import Executor
+
+# Every execution allocates about 1 MB in a reference cycle, alongside with a figure,
+# so memory grows by about 1 GB over the soak test unless the executor releases everything.
+STUDENT_CODE = """
+import numpy as np
+from matplotlib import pyplot as plt
+
+class Node:
+    pass
+
+node = Node()
+node.payload = np.ones(1 << 17)
+node.self_reference = node
+plt.figure()
+answer = float(node.payload.sum())
+"""
+
+NUMBER_OF_EXECUTIONS = 1000
+WARM_UP_EXECUTIONS = 50
+ALLOWED_GROWTH_MB = 50
+
+
+def get_rss_mb():
+    import resource
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+
+
+def make_notebook(code):
+    return json.dumps({
+        "cells": [{"cell_type": "code", "execution_count": None, "metadata": {}, "outputs": [],
+                   "source": code}],
+        "metadata": {},
+        "nbformat": 4,
+        "nbformat_minor": 4
+    })
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads RSS from /proc")
+@pytest.mark.parametrize("extension, content", [(".py", STUDENT_CODE), (".ipynb", make_notebook(STUDENT_CODE))])
+def test_memory_is_flat_over_many_executions(tmp_path, extension, content):
+    # Every execution is of a different student's file, like in a long-running grader
+    file_paths = []
+    for i in range(WARM_UP_EXECUTIONS + NUMBER_OF_EXECUTIONS):
+        file_paths.append(tmp_path / f"student{i}{extension}")
+        file_paths[-1].write_text(content)
+    executor = Executor(supported_platforms=["python", "jupyter"], variables_to_take=["answer"])
+    for file_path in file_paths[:WARM_UP_EXECUTIONS]:
+        executor.execute(file_path)
+    rss_before = get_rss_mb()
+    for file_path in file_paths[WARM_UP_EXECUTIONS:]:
+        _, variables = executor.execute(file_path)
+        assert variables == {"answer": float(1 << 17)}
+    assert get_rss_mb() - rss_before < ALLOWED_GROWTH_MB
+    assert not any(module_name.startswith("student") for module_name in sys.modules)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from gspack import function_tests
+from gspack.function_tests import FunctionCallFailure, PeakMemory, run_function_test, run_memory_test
+
+
+def test_peak_memory_without_resident_reset(monkeypatch):
+    # When the peak resident memory can't be reset, it's the process' old peak, which must not be charged
+    monkeypatch.setattr(function_tests, "_reset_resident_peak", lambda: False)
+    monkeypatch.setattr(function_tests, "_read_proc_status", lambda field: 400 * 1024 ** 2)
+    with PeakMemory() as peak:
+        sum(range(10))
+    assert peak.resident_growth is None
+    assert peak.peak_memory == peak.traced_peak < 1024 ** 2
+
+    with PeakMemory() as peak:
+        x = np.ones(1_000_000)
+        del x
+    assert 8_000_000 <= peak.peak_memory < 9_000_000
+
+
+def test_memory_test_can_not_be_measured(monkeypatch):
+    # If nothing can be measured (the code traces the memory itself), the peak is unknown rather than zero
+    monkeypatch.setattr(function_tests, "_reset_resident_peak", lambda: False)
+    monkeypatch.setattr(function_tests.tracemalloc, "is_tracing", lambda: True)
+    namespace = {"f": lambda x: x + 1, "cases": [1, 2]}
+    result = run_memory_test(namespace, {"function_name": "f", "inputs": "cases"})
+    assert result == {"outputs": [2, 3], "peak_memory": None}
+
+
+def retry_forever(x):
+    while True:
+        try:
+            raise ValueError(x)
+        except Exception:
+            pass
+
+
+def test_call_time_limit_is_not_swallowed():
+    namespace = {"f": retry_forever, "cases": [1]}
+    outputs = run_function_test(namespace, {"function_name": "f", "inputs": "cases", "call_time_limit": 0.2})
+    assert isinstance(outputs[0], FunctionCallFailure) and "did not finish in 0.2 seconds" in outputs[0].message
@@ -0,0 +1,362 @@
+import json
+import tracemalloc
+import zipfile
+
+import numpy as np
+
+from gspack.directories import AUTOGRADER_ZIP, RUBRIC_JSON, RESULTS_JSON, VARIABLES_SNAPSHOT_DIR
+from gspack.grader import compare_arrays, get_grades, get_runtime_modules, grade_batch, grade_locally, regrade
+from gspack.packager import create_autograder
+from gspack.result_cache import ResultCache
+from gspack.rubric import Rubric
+from gspack.values_store import load_values, save_values
+
+
+def reference_verdict(answer, true_answer, rtol, atol):
+    if np.isnan(answer).any():
+        return "nans"
+    if not np.allclose(answer, true_answer, rtol=rtol, atol=atol):
+        return "tolerance"
+    return None
+
+
+def test_compare_arrays_matches_allclose():
+    rng = np.random.default_rng(0)
+    true_answer = rng.normal(size=(300, 200))
+    true_answer[0, 0] = np.inf
+    cases = [true_answer.copy(), true_answer + 1e-9, np.asfortranarray(true_answer), true_answer.T.copy().T]
+    out_of_tolerance = true_answer.copy()
+    out_of_tolerance[-1, -1] += 1
+    cases.append(out_of_tolerance)
+    nan_at_the_end = out_of_tolerance.copy()
+    nan_at_the_end[-1, -2] = np.nan
+    cases.append(nan_at_the_end)
+    wrong_infinity = true_answer.copy()
+    wrong_infinity[0, 0] = -np.inf
+    cases.append(wrong_infinity)
+    for answer in cases:
+        for chunk_size in (97, 1000, 1 << 16):
+            assert (compare_arrays(answer, true_answer, rtol=1e-5, atol=1e-8, chunk_size=chunk_size)
+                    == reference_verdict(answer, true_answer, rtol=1e-5, atol=1e-8))
+
+
+def test_get_grades_does_not_copy_arrays(tmp_path):
+    # Grading a 32 MB answer against memory-mapped true values only needs the comparison's chunks
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": "Array", "variable_name": "A", "score": 1}],
+        "supported_platforms": ["python"],
+    })
+    save_values({"A": np.arange(4_000_000.0)}, tmp_path / "values")
+    rubric.test_suite_values = load_values(tmp_path / "values")
+    answer = {"A": np.arange(4_000_000.0)}
+    tracemalloc.start()
+    try:
+        results = get_grades(rubric, "python", answer)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert results["score"] == 1
+    assert peak < 4 * 1024 ** 2
+
+
+def test_get_grades_verdicts():
+    rubric = Rubric.from_dict({
+        "test_suite": [
+            {"test_name": "Scalar", "variable_name": "x", "score": 1},
+            {"test_name": "Matrix", "variable_name": "A", "score": 2, "hint_tolerance": "Check A."},
+            {"test_name": "NaNs", "variable_name": "B", "score": 1},
+            {"test_name": "Shape", "variable_name": "C", "score": 1},
+        ],
+        "supported_platforms": ["python"],
+    })
+    rubric.test_suite_values = {"x": 3, "A": np.eye(3), "B": np.ones(4), "C": np.ones((2, 3))}
+    results = get_grades(rubric, "python", {
+        "x": np.array([3.0]),
+        "A": np.eye(3) + 1e-3,
+        "B": [1, 1, np.nan, 1],
+        "C": np.ones((3, 2)),
+    })
+    outputs = [test["output"] for test in results["tests"]]
+    assert outputs[0] == "Correct."
+    assert outputs[1].startswith("Your answer is not within tolerance") and "Check A." in outputs[1]
+    assert outputs[2].startswith("Your variable B contains NaNs")
+    assert outputs[3].startswith("Wrong dimensions")
+    assert results["score"] == 1
+
+
+def test_get_grades_sparse_verdicts():
+    from scipy import sparse
+
+    n = 100_000
+    laplacian = sparse.diags([-1.0, 2.0, -1.0], [-1, 0, 1], shape=(n, n), format="csr")
+    with_tiny_entry = laplacian.tolil()
+    with_tiny_entry[0, n - 1] = 1e-12
+    wrong = laplacian.copy()
+    wrong.data[7] = 3.0
+    small = sparse.csr_matrix(np.eye(3))
+    tests = [("Same", laplacian.tocoo()), ("Other structure", with_tiny_entry.tocsr()), ("Wrong", wrong),
+             ("Shape", laplacian[:-1]), ("Dense", np.eye(3)), ("Type", np.ones(3))]
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": name, "variable_name": f"A{i}", "score": 1} for i, (name, _) in enumerate(tests)],
+        "supported_platforms": ["python"],
+    })
+    rubric.test_suite_values = {f"A{i}": small if i >= 4 else laplacian for i in range(len(tests))}
+    results = get_grades(rubric, "python", {f"A{i}": answer for i, (_, answer) in enumerate(tests)})
+    outputs = [test["output"] for test in results["tests"]]
+    assert outputs[:2] == ["Correct.", "Correct."] and outputs[4] == "Correct."
+    assert outputs[2].startswith("Your answer is not within tolerance")
+    assert outputs[3].startswith(f"Wrong dimensions: the shape of your variable A3 is ({n - 1}, {n})")
+    assert "should be a sparse matrix of shape (3, 3)" in outputs[5]
+    assert results["score"] == 3
+
+
+def test_get_grades_sparse_complex_answers():
+    from scipy import sparse
+
+    real = sparse.csr_matrix(np.array([[1.0, 0], [0, 2]]))
+    complex_answer = sparse.csr_matrix(np.array([[1 + 5j, 0], [0, 2]]))
+    tests = [("Imaginary part", complex_answer, real), ("Other structure", complex_answer, complex_answer.tocoo()),
+             ("Complex", complex_answer, complex_answer + sparse.csr_matrix(np.array([[0, 1j], [0, 0]]))),
+             ("Zero imaginary part", real.astype(complex), real)]
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": name, "variable_name": f"A{i}", "score": 1} for i, (name, _, _) in enumerate(tests)],
+        "supported_platforms": ["python"],
+    })
+    rubric.test_suite_values = {f"A{i}": true_answer for i, (_, _, true_answer) in enumerate(tests)}
+    results = get_grades(rubric, "python", {f"A{i}": answer for i, (_, answer, _) in enumerate(tests)})
+    outputs = [test["output"] for test in results["tests"]]
+    assert outputs[0].startswith("Your answer is not within tolerance")
+    assert outputs[1] == "Correct." and outputs[3] == "Correct."
+    assert outputs[2].startswith("Your answer is not within tolerance")
+
+
+def test_regrade_from_snapshots(tmp_path):
+    rubric = Rubric.from_dict({
+        "test_suite": [
+            {"test_name": "Scalar", "variable_name": "x", "score": 1},
+            {"test_name": "Vector", "variable_name": "v", "score": 2, "rtol": 1e-5},
+        ],
+        "supported_platforms": ["python"],
+    })
+    rubric.test_suite_values = {"x": 3, "v": np.arange(5.0)}
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    rubric.save_to(source_dir)
+    submissions_dir = tmp_path / "submissions"
+    for student, code in [("a", "x = 3\nv = np.arange(5.0)\n"), ("b", "x = 3\nv = np.arange(5.0) * 1.01\n"),
+                          ("c", "raise ValueError()\n")]:
+        (submissions_dir / student).mkdir(parents=True)
+        (submissions_dir / student / "hw.py").write_text("import numpy as np\n" + code)
+
+    summary = grade_batch(submissions_dir, source_dir / RUBRIC_JSON, workers=2, snapshot=True)
+    assert [entry["score"] for entry in summary] == [3, 1, 0]
+    assert not (submissions_dir / "c" / VARIABLES_SNAPSHOT_DIR).exists()
+
+    # Loosen the tolerance: the second student's answer becomes correct without executing it again.
+    (submissions_dir / "b" / "hw.py").write_text("raise RuntimeError('must not be executed')\n")
+    rubric.test_suite[1]["rtol"] = 0.1
+    rubric.save_to(source_dir)
+    summary = regrade(submissions_dir, source_dir / RUBRIC_JSON)
+    assert [entry["score"] for entry in summary] == [3, 3, 0]
+    assert [entry["success"] for entry in summary] == [True, True, False]
+
+
+def test_cached_results_come_with_their_own_snapshot(tmp_path):
+    rubric = Rubric.from_dict({"test_suite": [{"test_name": "Scalar", "variable_name": "x", "score": 1}],
+                               "supported_platforms": ["python"]})
+    rubric.test_suite_values = {"x": 3}
+    (tmp_path / "source").mkdir()
+    rubric.save_to(tmp_path / "source")
+    (tmp_path / "submission").mkdir()
+    submission_path = tmp_path / "submission" / "hw.py"
+    snapshot_path = tmp_path / "submission" / VARIABLES_SNAPSHOT_DIR
+    result_cache = ResultCache(tmp_path / "cache")
+
+    def grade(code, snapshot):
+        submission_path.write_text(code)
+        grade_locally(submission_path, tmp_path / "source" / RUBRIC_JSON, result_cache=result_cache, snapshot=snapshot)
+        return load_values(snapshot_path)["x"] if snapshot_path.exists() else None
+
+    assert grade("x = 3\n", snapshot=True) == 3
+    # Results written without a snapshot don't keep the one of another submission
+    assert grade("x = 4\n", snapshot=False) is None
+    assert grade("x = 4\n", snapshot=True) == 4
+    # The first submission's results are cached, but the snapshot next to them is of the second one
+    assert grade("x = 3\n", snapshot=True) == 3
+
+
+def test_cache_hits_when_submission_writes_files(tmp_path):
+    rubric = Rubric.from_dict({"test_suite": [{"test_name": "Scalar", "variable_name": "x", "score": 1}],
+                               "supported_platforms": ["python"]})
+    rubric.test_suite_values = {"x": 3}
+    (tmp_path / "source").mkdir()
+    rubric.save_to(tmp_path / "source")
+    (tmp_path / "submission").mkdir()
+    submission_path = tmp_path / "submission" / "hw.py"
+    # The submission counts its executions in a file next to it
+    submission_path.write_text("with open('executions.txt', 'a') as f:\n    f.write('x')\nx = 3\n")
+    result_cache = ResultCache(tmp_path / "cache")
+    for _ in range(2):
+        grade_locally(submission_path, tmp_path / "source" / RUBRIC_JSON, result_cache=result_cache)
+    assert (tmp_path / "submission" / "executions.txt").read_text() == "x"
+    with open(tmp_path / "submission" / RESULTS_JSON) as f:
+        assert json.load(f)["score"] == 1
+
+
+def test_grading_phases_are_timed(tmp_path):
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": "Scalar", "variable_name": "x", "score": 1}],
+        "supported_platforms": ["python"],
+    })
+    rubric.test_suite_values = {"x": 3}
+    rubric.save_to(tmp_path)
+    (tmp_path / "submission").mkdir()
+    (tmp_path / "submission" / "hw.py").write_text("x = 3\n")
+
+    timings_log = tmp_path / "timings.jsonl"
+    profile_path = tmp_path / "grading.prof"
+    assert grade_locally(tmp_path / "submission" / "hw.py", tmp_path / RUBRIC_JSON,
+                         timings_log=timings_log, profile_path=profile_path) == 0
+    with open(tmp_path / "submission" / RESULTS_JSON) as f:
+        timings = json.load(f)["extra_data"]["timings"]
+    assert [phase["phase"] for phase in timings] == ["load_rubric", "load_values", "find_submission",
+                                                     "execute", "grade"]
+    assert all(phase["seconds"] >= 0 for phase in timings)
+    with open(timings_log) as f:
+        assert json.loads(f.readline())["phases"] == timings
+    assert profile_path.exists()
+
+
+FUNCTION_SOLUTION = """
+import numpy as np
+
+def normalize(v, scale=1.0):
+    v /= np.linalg.norm(v)
+    return v * scale
+
+def parity(n):
+    return "even" if n % 2 == 0 else "odd"
+
+cases = [np.arange(1.0, k + 2) for k in range(20)]
+test_suite = [
+    {"test_name": "Normalize", "type": "function", "function_name": "normalize", "inputs": "cases", "score": 2,
+     "call_time_limit": 0.5},
+    {"test_name": "Scale", "type": "function", "function_name": "normalize",
+     "inputs": [{"args": [[3.0, 4.0]], "kwargs": {"scale": 2}}], "score": 1},
+    {"test_name": "Parity", "type": "function", "function_name": "parity", "inputs": [1, 2, 3], "score": 1},
+]
+requirements = ["numpy"]
+"""
+
+
+def test_function_tests(tmp_path):
+    (tmp_path / "solution.py").write_text(FUNCTION_SOLUTION)
+    create_autograder(tmp_path / "solution.py")
+    with zipfile.ZipFile(tmp_path / AUTOGRADER_ZIP) as archive:
+        archive.extractall(tmp_path / "source")
+
+    submissions_dir = tmp_path / "submissions"
+    normalize = "def normalize(v, scale=1.0):\n    v = np.asarray(v, dtype=float)\n"
+    for student, code in [
+        ("a", normalize + "    return scale * v / np.sqrt((v ** 2).sum())\n"
+                          "def parity(n):\n    return ['even', 'odd'][n % 2]\n"),
+        ("b", normalize + "    return v if len(v) == 7 else scale * v / np.sqrt((v ** 2).sum())\n"),
+        ("c", normalize + "    while len(v) == 3:\n        pass\n    return scale * v / np.sqrt((v ** 2).sum())\n"
+                          "def parity(n):\n    raise ValueError('no parity')\n"),
+    ]:
+        (submissions_dir / student).mkdir(parents=True)
+        (submissions_dir / student / "hw.py").write_text("import numpy as np\n" + code)
+
+    summary = grade_batch(submissions_dir, tmp_path / "source" / RUBRIC_JSON, workers=2)
+    assert [entry["score"] for entry in summary] == [4, 1, 1]
+    outputs = {}
+    for student in "bc":
+        with open(submissions_dir / student / RESULTS_JSON) as f:
+            outputs[student] = [test["output"] for test in json.load(f)["tests"]]
+    assert outputs["b"][0].startswith("Your function normalize gives a wrong output for input #7.")
+    assert outputs["b"][2].startswith("Function parity is not defined.")
+    assert outputs["c"][0].startswith("Your function normalize failed for input #3: the call did not finish")
+    assert outputs["c"][2].startswith("Your function parity failed for input #1: ValueError: no parity")
+
+
+def test_performance_scores_follow_speed_curve():
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": "Speed", "type": "performance", "function_name": "f", "inputs": [1, 2],
+                        "score": 4, "speed_curve": [[1, 1], [3, 0]]}],
+        "supported_platforms": ["python"],
+    })
+    name = "f: Speed"
+    rubric.test_suite_values = {name: {"outputs": [1, 4], "seconds": 5.0}}
+    reference_values = {name: {"outputs": [1, 4], "seconds": 1.0}}
+    for seconds, score in [(0.5, 4), (2.0, 2), (10.0, 0)]:
+        results = get_grades(rubric, "python", {name: {"outputs": [1, 4], "seconds": seconds}},
+                             reference_values=reference_values)
+        assert results["score"] == score
+        assert results["leaderboard"] == [{"name": "Speed", "value": seconds, "order": "asc"}]
+    # Without a measurement on the grading machine, the one from packaging is used
+    assert get_grades(rubric, "python", {name: {"outputs": [1, 4], "seconds": 2.0}})["score"] == 4
+    results = get_grades(rubric, "python", {name: {"outputs": [1, 5], "seconds": 0.1}})
+    assert results["score"] == 0 and "leaderboard" not in results
+
+
+def test_performance_reference_is_timed_when_grading(tmp_path):
+    (tmp_path / "solution.py").write_text(
+        "def total(n):\n    return sum(range(n))\n"
+        "test_suite = [{'test_name': 'Speed', 'type': 'performance', 'function_name': 'total',"
+        " 'inputs': [10000, 20000], 'score': 1, 'repeat': 3, 'speed_curve': [[5, 1], [50, 0]]}]\n"
+        "requirements = []\n")
+    create_autograder(tmp_path / "solution.py")
+    with zipfile.ZipFile(tmp_path / AUTOGRADER_ZIP) as archive:
+        archive.extractall(tmp_path / "source")
+    assert (tmp_path / "source" / "reference_solution.py").exists()
+
+    submissions_dir = tmp_path / "submissions"
+    for student, code in [("fast", "def total(n):\n    return sum(range(n))\n"),
+                          ("slow", "import time\ndef total(n):\n    time.sleep(0.1)\n    return sum(range(n))\n")]:
+        (submissions_dir / student).mkdir(parents=True)
+        (submissions_dir / student / "hw.py").write_text(code)
+    summary = grade_batch(submissions_dir, tmp_path / "source" / RUBRIC_JSON, workers=2, fork_server=False)
+    assert [entry["score"] for entry in summary] == [1, 0]
+    with open(submissions_dir / "fast" / RESULTS_JSON) as f:
+        results = json.load(f)
+    assert "time_reference" in [phase["phase"] for phase in results["extra_data"]["timings"]]
+    assert results["leaderboard"][0]["name"] == "Speed"
+
+
+def test_memory_tests_check_peak_memory(tmp_path):
+    (tmp_path / "solution.py").write_text(
+        "import numpy as np\n"
+        "def center(x):\n    x -= x.mean()\n    return x\n"
+        "cases = [np.ones(1_000_000) * k for k in range(3)]\n"
+        "test_suite = [{'test_name': 'In place', 'type': 'memory', 'function_name': 'center', 'inputs': 'cases',"
+        " 'score': 1, 'memory_budget': 2, 'hint_memory': 'Modify x in place.'}]\n"
+        "requirements = ['numpy']\n")
+    create_autograder(tmp_path / "solution.py")
+    with zipfile.ZipFile(tmp_path / AUTOGRADER_ZIP) as archive:
+        archive.extractall(tmp_path / "source")
+
+    submissions_dir = tmp_path / "submissions"
+    for student, code in [("a", "def center(x):\n    x -= x.mean()\n    return x\n"),
+                          ("b", "def center(x):\n    y = x.copy()\n    y = y - np.mean(y)\n    return y + 0\n")]:
+        (submissions_dir / student).mkdir(parents=True)
+        (submissions_dir / student / "hw.py").write_text("import numpy as np\n" + code)
+    summary = grade_batch(submissions_dir, tmp_path / "source" / RUBRIC_JSON, workers=2)
+    assert [entry["score"] for entry in summary] == [1, 0]
+    for student in "ab":
+        with open(submissions_dir / student / RESULTS_JSON) as f:
+            output = json.load(f)["tests"][0]["output"]
+        assert "MB on top of its arguments" in output
+        assert ("Modify x in place." in output) == (student == "b")
+
+
+def test_runtime_modules_include_scanned_requirements(tmp_path):
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": "Scalar", "variable_name": "x", "score": 1}],
+        "supported_platforms": ["python"],
+    })
+    (tmp_path / "requirements.txt").write_text("numpy\nscikit-image>=0.18\n")
+    modules = get_runtime_modules(rubric, tmp_path / "rubric.json")
+    assert modules[-1] == "scikit_image" and modules.count("numpy") == 1
+    # The 'requirements' variable takes precedence, like when the archive is created
+    rubric.requirements = ["scipy"]
+    assert get_runtime_modules(rubric, tmp_path / "rubric.json")[-1] == "scipy"
@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Console scripts must not import the heavy platform backends until a file of their platform is executed.
+HEAVY_MODULES = ["IPython", "matplotlib", "nbformat", "matlab"]
+
+# Generous wall-clock budget for importing a console script's module, on top of the interpreter's own start.
+# Importing IPython and Matplotlib alone takes longer than that.
+IMPORT_TIME_BUDGET = 0.5
+
+
+def run_python(code):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    start = time.monotonic()
+    output = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return time.monotonic() - start, output
+
+
+def get_loaded_heavy_modules(module_name):
+    _, output = run_python(f"import sys, json, {module_name}; "
+                           f"print(json.dumps([m for m in {HEAVY_MODULES} if m in sys.modules]))")
+    return json.loads(output)
+
+
+def test_heavy_modules_are_not_imported():
+    for module_name in ["gspack", "gspack.grader", "gspack.packager"]:
+        assert get_loaded_heavy_modules(module_name) == [], module_name
+
+
+def test_executing_a_file_does_not_import_matplotlib(tmp_path):
+    (tmp_path / "solution.py").write_text("x = sum(range(10))\n")
+    _, output = run_python(f"import sys, json; from pathlib import Path; from gspack.executor import Executor; "
+                           f"Executor().execute(Path({str(tmp_path / 'solution.py')!r})); "
+                           f"print(json.dumps([m for m in {HEAVY_MODULES} if m in sys.modules]))")
+    assert json.loads(output) == []
+
+
+def test_import_time_budget():
+    # take the best of several runs to make the test robust to a noisy machine
+    interpreter_start = min(run_python("pass")[0] for _ in range(3))
+    for module_name in ["gspack.grader", "gspack.packager"]:
+        import_time = min(run_python(f"import {module_name}")[0] for _ in range(3)) - interpreter_start
+        assert import_time < IMPORT_TIME_BUDGET, f"{module_name}: {import_time:.2f}s"
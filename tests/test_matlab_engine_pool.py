@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import pytest
+
+from gspack.helpers import GspackFailure
+from gspack.matlab_engine_pool import MatlabEnginePool, FakeMatlabEngine
+
+
+def homework(workspace):
+    workspace["A1"] = 42
+
+
+def make_pool(size=1):
+    engines = []
+
+    def start_engine():
+        engines.append(FakeMatlabEngine(scripts={"homework": homework}))
+        return engines[-1]
+    return MatlabEnginePool(size=size, start_engine=start_engine), engines
+
+
+def test_engine_is_reused_and_reset():
+    pool, engines = make_pool()
+    for _ in range(3):
+        with pool.engine(Path("/submission")) as eng:
+            assert eng.current_dir == "/submission"
+            assert eng.workspace == {}
+            eng.path("/submission:/matlab/toolbox", nargout=0)
+            eng.homework(nargout=0)
+            assert eng.workspace["A1"] == 42
+    assert pool.engines_started == 1
+    assert engines[0].workspace == {}
+    assert engines[0].current_dir == "/"
+    assert engines[0].current_path == "/matlab/toolbox"
+
+
+def test_engine_is_reset_after_failure():
+    pool, engines = make_pool()
+    with pytest.raises(ZeroDivisionError):
+        with pool.engine(Path("/submission")) as eng:
+            eng.homework(nargout=0)
+            _ = 1 / 0
+    with pool.engine(Path("/submission")) as eng:
+        assert eng.workspace == {}
+    assert pool.engines_started == 1
+
+
+def test_crashed_engine_is_replaced():
+    pool, engines = make_pool()
+    with pool.engine(Path("/submission")) as eng:
+        eng.crash()
+    with pool.engine(Path("/submission")) as eng:
+        eng.homework(nargout=0)
+    assert pool.engines_started == 2
+    assert not engines[0].alive
+
+
+def test_engine_which_died_while_idle_is_replaced():
+    pool, engines = make_pool()
+    with pool.engine(Path("/submission")):
+        pass
+    engines[0].crash()
+    with pool.engine(Path("/submission")) as eng:
+        assert eng is engines[1]
+
+
+def test_pool_keeps_at_most_size_idle_engines():
+    pool, engines = make_pool(size=1)
+    with pool.engine(Path("/a")):
+        with pool.engine(Path("/b")):
+            pass
+    assert pool.engines_started == 2
+    assert sum(engine.alive for engine in engines) == 1
+    pool.close()
+    assert not any(engine.alive for engine in engines)
+
+
+def test_start_failure():
+    def start_engine():
+        raise RuntimeError("no license")
+    pool = MatlabEnginePool(start_engine=start_engine)
+    with pytest.raises(GspackFailure):
+        with pool.engine(Path("/submission")):
+            pass
@@ -0,0 +1,185 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import stat
+import zipfile
+
+import numpy as np
+
+from gspack.__about__ import __version__
+from gspack.directories import AUTOGRADER_ZIP, RUBRIC_JSON, TEST_SUITE_VALUES_DIR, SETUP_FILE, PACKAGING_REPORT_JSON
+from gspack.packager import create_archive, create_autograder, create_autograders
+from gspack.rubric import Rubric
+from gspack.values_store import load_values
+from gspack.wheel_builder import build_wheel, get_wheel_name
+
+
+def make_rubric():
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": "Array", "variable_name": "A", "score": 1},
+                       {"test_name": "Scalar", "variable_name": "x", "score": 1}],
+        "supported_platforms": ["python"],
+        "extra_files": ["data.csv"],
+        "requirements": ["numpy"],
+    })
+    rubric.test_suite_values = {"A": np.arange(100000.0), "x": 3}
+    return rubric
+
+
+def test_archive_is_reproducible_and_compressed(tmp_path):
+    (tmp_path / "data.csv").write_text("1,2,3\n" * 10000)
+    archive_path = tmp_path / AUTOGRADER_ZIP
+    create_archive(archive_path, rubric=make_rubric(), platform="python")
+    first_build = archive_path.read_bytes()
+    # Timestamps of the inputs must not matter
+    os.utime(tmp_path / "data.csv", (0, 0))
+    create_archive(archive_path, rubric=make_rubric(), platform="python")
+    assert archive_path.read_bytes() == first_build
+    assert sorted(path.name for path in tmp_path.iterdir()) == [AUTOGRADER_ZIP, "data.csv"]
+
+    with zipfile.ZipFile(archive_path) as zip_archive:
+        infos = {info.filename: info for info in zip_archive.infolist()}
+        assert infos["data.csv"].compress_type == zipfile.ZIP_DEFLATED
+        assert infos["data.csv"].compress_size < infos["data.csv"].file_size / 10
+        assert stat.S_IMODE(infos[SETUP_FILE].external_attr >> 16) == 0o755
+        assert stat.S_IMODE(infos[RUBRIC_JSON].external_attr >> 16) == 0o644
+        zip_archive.extractall(tmp_path / "extracted")
+    values = load_values(tmp_path / "extracted" / TEST_SUITE_VALUES_DIR)
+    assert np.array_equal(values["A"], np.arange(100000.0)) and values["x"] == 3
+
+
+def test_archive_compression_is_selectable(tmp_path):
+    (tmp_path / "data.csv").write_text("1,2,3\n" * 10000)
+    create_archive(tmp_path / AUTOGRADER_ZIP, rubric=make_rubric(), platform="python", compression="stored")
+    with zipfile.ZipFile(tmp_path / AUTOGRADER_ZIP) as zip_archive:
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zip_archive.infolist())
+
+
+def test_packaging_reuses_unchanged_work(tmp_path):
+    # The solution counts its executions in a file next to it
+    (tmp_path / "solution.py").write_text(
+        "import numpy as np\n"
+        "with open('executions.txt', 'a') as f:\n"
+        "    f.write('x')\n"
+        "A = np.loadtxt('data.csv', delimiter=',')\n")
+    (tmp_path / "data.csv").write_text("1,2,3\n")
+    rubric = {"test_suite": [{"test_name": "Data", "variable_name": "A", "score": 1, "hint_wrong_size": "Hint"}],
+              "supported_platforms": ["python"], "extra_files": ["data.csv"], "requirements": ["numpy"]}
+    (tmp_path / "rubric.json").write_text(json.dumps(rubric))
+
+    def package(**kwargs):
+        create_autograder(tmp_path / "solution.py", rubric=tmp_path / "rubric.json", verbose=False, **kwargs)
+        return len((tmp_path / "executions.txt").read_text())
+
+    assert package() == 1
+    archive_stamp = (tmp_path / AUTOGRADER_ZIP).stat().st_mtime_ns
+    # Nothing has changed: neither the solution nor the archive are re-done
+    assert package() == 1
+    assert (tmp_path / AUTOGRADER_ZIP).stat().st_mtime_ns == archive_stamp
+    # Only the rubric has changed: the archive is rebuilt from the cached values
+    rubric["test_suite"][0]["hint_wrong_size"] = "Another hint"
+    (tmp_path / "rubric.json").write_text(json.dumps(rubric))
+    assert package() == 1
+    with zipfile.ZipFile(tmp_path / AUTOGRADER_ZIP) as zip_archive:
+        assert "Another hint" in zip_archive.read(RUBRIC_JSON).decode("utf-8")
+    # Extra files are inputs of the solution
+    (tmp_path / "data.csv").write_text("1,2,3,4\n")
+    assert package() == 2
+    with zipfile.ZipFile(tmp_path / AUTOGRADER_ZIP) as zip_archive:
+        zip_archive.extractall(tmp_path / "extracted")
+    assert np.array_equal(load_values(tmp_path / "extracted" / TEST_SUITE_VALUES_DIR)["A"], [1, 2, 3, 4])
+    assert package(force=True) == 3
+
+
+def test_packaging_reexecutes_only_for_the_solutions_inputs(tmp_path):
+    (tmp_path / "helpers.py").write_text("def double(x):\n    return 2 * x\n")
+    (tmp_path / "solution.py").write_text(
+        "import sys\n"
+        "sys.path.insert(0, '.')\n"
+        "from helpers import double\n"
+        "with open('executions.txt', 'a') as f:\n"
+        "    f.write('x')\n"
+        "cases = [1, 2]\n")
+    rubric = {"test_suite": [{"test_name": "Double", "type": "function", "function_name": "double",
+                              "inputs": "cases", "score": 1, "hint_not_defined": "Hint"}],
+              "supported_platforms": ["python"], "requirements": []}
+    (tmp_path / "rubric.json").write_text(json.dumps(rubric))
+
+    def package():
+        create_autograder(tmp_path / "solution.py", rubric=tmp_path / "rubric.json", verbose=False)
+        return len((tmp_path / "executions.txt").read_text())
+
+    assert package() == 1
+    # Other assignments and notebooks next to the solution are not a part of it
+    (tmp_path / "other_assignment.py").write_text("x = 1\n")
+    (tmp_path / "notes.ipynb").write_text("{}")
+    assert package() == 1
+    # Neither are the hints and scores of its function tests
+    rubric["test_suite"][0].update(hint_not_defined="Another hint", score=2)
+    (tmp_path / "rubric.json").write_text(json.dumps(rubric))
+    assert package() == 1
+    # Local modules which it imports are
+    (tmp_path / "helpers.py").write_text("def double(x):\n    return x + x\n")
+    assert package() == 2
+
+
+def test_bulk_packaging_reports_every_assignment(tmp_path):
+    (tmp_path / "hw1").mkdir()
+    (tmp_path / "hw1" / "hw1_solution.py").write_text(
+        "x = 5\ntest_suite = [{'test_name': 'x', 'variable_name': 'x', 'score': 1}]\nrequirements = []\n")
+    (tmp_path / "week2" / "hw2").mkdir(parents=True)
+    (tmp_path / "week2" / "hw2" / "solution.py").write_text("raise ValueError('broken')\n")
+    (tmp_path / "week2" / "hw2" / RUBRIC_JSON).write_text(json.dumps(
+        {"test_suite": [{"test_name": "x", "variable_name": "x", "score": 1}], "supported_platforms": ["python"]}))
+    (tmp_path / "week2" / "notes.py").write_text("this is not a solution")
+
+    report = create_autograders(tmp_path, workers=2)
+    assert [(entry["solution"], entry["rubric"], entry["success"]) for entry in report] == [
+        (os.path.join("hw1", "hw1_solution.py"), None, True),
+        (os.path.join("week2", "hw2", "solution.py"), os.path.join("week2", "hw2", RUBRIC_JSON), False),
+    ]
+    assert (tmp_path / "hw1" / AUTOGRADER_ZIP).exists()
+    assert not (tmp_path / "week2" / "hw2" / AUTOGRADER_ZIP).exists()
+    assert "broken" in report[1]["output"]
+    with open(tmp_path / PACKAGING_REPORT_JSON, "r") as f:
+        assert json.load(f) == report
+
+
+def test_archive_ships_an_installable_wheel(tmp_path):
+    (tmp_path / "data.csv").write_text("1,2,3\n")
+    create_archive(tmp_path / AUTOGRADER_ZIP, rubric=make_rubric(), platform="python")
+    with zipfile.ZipFile(tmp_path / AUTOGRADER_ZIP) as zip_archive:
+        wheel = zip_archive.read(get_wheel_name())
+    assert wheel == build_wheel()
+    with zipfile.ZipFile(io.BytesIO(wheel)) as wheel_archive:
+        names = wheel_archive.namelist()
+        assert "gspack/grader.py" in names and "gspack/templates/setup.sh" in names
+        assert not any("__pycache__" in name for name in names)
+        dist_info = f"gspack-{__version__}.dist-info"
+        entry_points = wheel_archive.read(f"{dist_info}/entry_points.txt").decode("utf-8")
+        assert "gsgrade_gradescope = gspack:grade_on_gradescope" in entry_points
+        # Every file is listed in RECORD with its hash
+        record = wheel_archive.read(f"{dist_info}/RECORD").decode("utf-8").splitlines()
+        assert sorted(line.split(",")[0] for line in record) == sorted(names)
+        for line in record:
+            name, digest, _ = line.split(",")
+            if digest:
+                expected = base64.urlsafe_b64encode(hashlib.sha256(wheel_archive.read(name)).digest()).rstrip(b"=")
+                assert digest == "sha256=" + expected.decode("ascii")
+
+
+def test_archive_requirements_come_from_the_solution_only(tmp_path):
+    (tmp_path / "data.csv").write_text("1,2,3\n")
+    (tmp_path / "solution.py").write_text("import numpy as np\nA = np.arange(3.0)\nx = 3\n")
+    # Another script in the same directory is not a part of the solution
+    (tmp_path / "plot_results.py").write_text("import scipy\n")
+    rubric = make_rubric()
+    rubric.requirements = None
+    import_cache = {}
+    create_archive(tmp_path / AUTOGRADER_ZIP, rubric=rubric, platform="python",
+                   solution_path=tmp_path / "solution.py", import_cache=import_cache)
+    with zipfile.ZipFile(tmp_path / AUTOGRADER_ZIP) as zip_archive:
+        assert zip_archive.read("requirements.txt").decode("utf-8") == "numpy"
+    assert len(import_cache) == 1
@@ -0,0 +1,39 @@
+import json
+
+from gspack.requirements_scanner import find_requirements
+
+
+def test_only_reachable_imports_are_scanned(tmp_path):
+    (tmp_path / "solution.py").write_text(
+        "import os, json\n"
+        "import numpy as np\n"
+        "from helpers import load\n"
+        "from tools.plots import plot\n"
+        "def f():\n"
+        "    import yaml\n")
+    (tmp_path / "helpers.py").write_text("from dateutil import parser\ndef load(): pass\n")
+    (tmp_path / "tools").mkdir()
+    (tmp_path / "tools" / "__init__.py").write_text("")
+    (tmp_path / "tools" / "plots.py").write_text("from .style import STYLE\nimport matplotlib.pyplot as plt\n")
+    (tmp_path / "tools" / "style.py").write_text("from PIL import Image\nSTYLE = 1\n")
+    # Files which the solution doesn't import don't matter, even if they are broken
+    (tmp_path / "unrelated.py").write_text("import click\nthis is not python")
+
+    import_cache = {}
+    requirements = find_requirements(tmp_path / "solution.py", import_cache=import_cache)
+    assert requirements == ["matplotlib", "numpy", "pillow", "python-dateutil", "PyYAML"]
+    assert len(import_cache) == 5
+    # Cached imports are used instead of parsing the files again
+    assert find_requirements(tmp_path / "solution.py", import_cache=import_cache) == requirements
+
+
+def test_notebook_cells_are_scanned(tmp_path):
+    cells = [
+        {"cell_type": "markdown", "source": ["import click"]},
+        {"cell_type": "code", "source": ["%matplotlib inline\n", "import numpy as np\n", "!pip install yaml"]},
+        {"cell_type": "code", "source": "%%timeit\nimport click"},
+        {"cell_type": "code", "source": "from scipy import linalg\nnp.zeros(3)?"},
+        {"cell_type": "code", "source": "import not_installed_package"},
+    ]
+    (tmp_path / "solution.ipynb").write_text(json.dumps({"cells": cells, "nbformat": 4, "nbformat_minor": 4}))
+    assert find_requirements(tmp_path / "solution.ipynb") == ["not_installed_package", "numpy", "scipy"]
@@ -0,0 +1,70 @@
+import os
+import pickle
+
+from gspack.directories import TEST_SUITE_VALUES_DIR, TEST_SUITE_VALUES_FILE
+from gspack.result_cache import ResultCache
+from gspack.values_store import save_values
+
+
+def make_submission(path, content):
+    path.mkdir(parents=True, exist_ok=True)
+    (path / "hw.py").write_text(content)
+    return path
+
+
+def test_cache_hits_and_invalidation(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    rubric_path = tmp_path / "source" / "rubric.json"
+    rubric_path.parent.mkdir()
+    rubric_path.write_text('{"test_suite": []}')
+    values_path = tmp_path / "source" / TEST_SUITE_VALUES_DIR
+    save_values({"x": 3}, values_path)
+
+    submission = make_submission(tmp_path / "a", "x = 3\n")
+    key = cache.get_key(submission, rubric_path, values_path, ignored_files=["results.json"])
+    assert cache.get(key) is None
+    cache.put(key, {"score": 1})
+    # An identical submission of another student hits the cache, files which are not a part of it don't matter
+    other_submission = make_submission(tmp_path / "b", "x = 3\n")
+    (other_submission / "results.json").write_text("{}")
+    assert cache.get_key(other_submission, rubric_path, values_path, ignored_files=["results.json"]) == key
+    assert cache.get(key) == {"score": 1}
+
+    # Changing the submission, the rubric, or the true values changes the key
+    keys = {key}
+    (other_submission / "hw.py").write_text("x = 4\n")
+    keys.add(cache.get_key(other_submission, rubric_path, values_path))
+    rubric_path.write_text('{"test_suite": [], "total_score": 2}')
+    keys.add(cache.get_key(submission, rubric_path, values_path))
+    save_values({"x": 4}, values_path)
+    keys.add(cache.get_key(submission, rubric_path, values_path))
+    assert len(keys) == 4
+
+
+def test_cache_hashes_legacy_values(tmp_path):
+    # Archives created by older versions of gspack keep the true values in one pickle file
+    cache = ResultCache(tmp_path / "cache")
+    rubric_path = tmp_path / "source" / "rubric.json"
+    rubric_path.parent.mkdir()
+    rubric_path.write_text('{"test_suite": []}')
+    submission = make_submission(tmp_path / "a", "x = 3\n")
+    keys = []
+    for true_x in (3, 10 ** 6):
+        with open(rubric_path.parent / TEST_SUITE_VALUES_FILE, "wb") as f:
+            pickle.dump({"x": true_x}, f)
+        keys.append(cache.get_key(submission, rubric_path, rubric_path.parent / TEST_SUITE_VALUES_DIR))
+    assert keys[0] != keys[1]
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_size=250)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, {"output": "x" * 100})
+        # Distinct modification times, regardless of the file system's resolution
+        os.utime(tmp_path / "cache" / f"{key}.json", ns=(i * 10 ** 9, i * 10 ** 9))
+        if key == "b":
+            # "a" is used after "b" was added, so "b" is the least recently used one when "c" comes
+            assert cache.get("a") is not None
+            os.utime(tmp_path / "cache" / "a.json", ns=(5 * 10 ** 9, 5 * 10 ** 9))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
@@ -0,0 +1,56 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from gspack.helpers import UserFailure, GspackFailure
+from gspack.sandbox import run_in_sandbox
+
+
+def sleep_forever():
+    time.sleep(60)
+
+
+def spin_forever():
+    while True:
+        pass
+
+
+def allocate_too_much():
+    return len(bytearray(512 * 1024 ** 2))
+
+
+def test_sandbox_returns_results():
+    assert run_in_sandbox(lambda: {"x": 3}, time_limit=10, cpu_time_limit=10, memory_limit=4096) == {"x": 3}
+    with pytest.raises(ValueError, match="student's error"):
+        run_in_sandbox(lambda: int("student's error"))
+
+
+def test_sandbox_wall_time_limit():
+    start = time.monotonic()
+    with pytest.raises(UserFailure, match=r"did not finish within the time limit of 0.5 seconds\. Resources used"):
+        run_in_sandbox(sleep_forever, time_limit=0.5)
+    assert time.monotonic() - start < 10
+
+
+def test_sandbox_cpu_time_limit():
+    with pytest.raises(UserFailure, match=r"exceeded the CPU time limit of 1 seconds\. Resources used: .* CPU time"):
+        run_in_sandbox(spin_forever, time_limit=30, cpu_time_limit=1)
+
+
+def test_sandbox_memory_limit():
+    with pytest.raises(UserFailure, match=r"exceeded the memory limit of 256 MB\. Resources used: .* peak memory"):
+        run_in_sandbox(allocate_too_much, memory_limit=256)
+
+
+def test_sandbox_reports_crashed_child():
+    # A child killed by a signal is reported as a failure of the student's code
+    with pytest.raises(UserFailure, match="terminated by the signal SIGKILL"):
+        run_in_sandbox(lambda: os.kill(os.getpid(), signal.SIGKILL))
+    # Results which can't be pickled and a child which exits on its own are reported as well
+    with pytest.raises(GspackFailure, match="Results can't be transferred from the sandbox"):
+        run_in_sandbox(lambda: threading.Lock())
+    with pytest.raises(GspackFailure, match="exited without reporting its results"):
+        run_in_sandbox(lambda: os._exit(0))
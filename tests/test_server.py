@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from gspack.directories import RUBRIC_JSON
+from gspack.rubric import Rubric
+from gspack.server import GradingServer, make_http_server
+
+
+def save_rubric(source_dir, true_x):
+    rubric = Rubric.from_dict({
+        "test_suite": [{"test_name": "Scalar", "variable_name": "x", "score": 1}],
+        "supported_platforms": ["python"],
+    })
+    rubric.test_suite_values = {"x": true_x}
+    source_dir.mkdir(exist_ok=True)
+    rubric.save_to(source_dir)
+    return source_dir / RUBRIC_JSON
+
+
+def start_server(rubric_path, workers=2, queue_size=4, request_time_limit=60):
+    grading_server = GradingServer({"hw": rubric_path}, workers=workers, queue_size=queue_size,
+                                   request_time_limit=request_time_limit)
+    http_server = make_http_server(grading_server, port=0)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server, f"http://127.0.0.1:{http_server.server_address[1]}"
+
+
+def post(url, request):
+    http_request = urllib.request.Request(url, data=json.dumps(request).encode("utf-8"), method="POST",
+                                          headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_server_grades_submissions(tmp_path):
+    http_server, url = start_server(save_rubric(tmp_path / "source", 3))
+    try:
+        status, results = post(f"{url}/grade/hw", {"files": {"hw.py": "x = 3\n"}})
+        assert status == 200 and results["score"] == 1
+        status, results = post(f"{url}/grade", {"files": {"hw.py": "x = 4\n"}, "name": "A. Student"})
+        assert status == 200 and results["score"] == 0
+        submission_dir = tmp_path / "submission"
+        submission_dir.mkdir()
+        (submission_dir / "hw.py").write_text("x = 3\n")
+        status, results = post(f"{url}/grade/hw", {"submission_dir": str(submission_dir)})
+        assert status == 200 and results["score"] == 1
+        # The submission's directory is not modified
+        assert os.listdir(submission_dir) == ["hw.py"]
+
+        assert post(f"{url}/grade/hw", {"files": {"../hw.py": "x = 3\n"}})[0] == 400
+        assert post(f"{url}/grade/other", {"files": {"hw.py": "x = 3\n"}})[0] == 404
+    finally:
+        http_server.shutdown()
+        http_server.grading_server.close()
+
+
+def test_server_rejects_requests_when_queue_is_full(tmp_path):
+    http_server, url = start_server(save_rubric(tmp_path / "source", 3), workers=1, queue_size=0)
+    try:
+        slow_results = []
+        slow_request = threading.Thread(target=lambda: slow_results.append(
+            post(f"{url}/grade/hw", {"files": {"hw.py": "import time\ntime.sleep(2)\nx = 3\n"}})))
+        slow_request.start()
+        time.sleep(0.5)
+        status, payload = post(f"{url}/grade/hw", {"files": {"hw.py": "x = 3\n"}})
+        assert status == 503 and "queue is full" in payload["error"]
+        slow_request.join()
+        assert slow_results[0][0] == 200 and slow_results[0][1]["score"] == 1
+    finally:
+        http_server.shutdown()
+        http_server.grading_server.close()
+
+
+def test_server_reloads_changed_rubric(tmp_path):
+    rubric_path = save_rubric(tmp_path / "source", 3)
+    http_server, url = start_server(rubric_path)
+    try:
+        assert post(f"{url}/grade/hw", {"files": {"hw.py": "x = 4\n"}})[1]["score"] == 0
+        save_rubric(tmp_path / "source", np.float64(4))
+        assert post(f"{url}/grade/hw", {"files": {"hw.py": "x = 4\n"}})[1]["score"] == 1
+    finally:
+        http_server.shutdown()
+        http_server.grading_server.close()
+
+
+def test_server_stops_submissions_after_time_limit(tmp_path):
+    http_server, url = start_server(save_rubric(tmp_path / "source", 3), workers=1, request_time_limit=1)
+    try:
+        start = time.monotonic()
+        status, payload = post(f"{url}/grade/hw", {"files": {"hw.py": "while True:\n    pass\n"}})
+        assert status == 500 and "did not finish in 1 seconds" in payload["error"]
+        assert time.monotonic() - start < 10
+        # The only worker is free again
+        status, results = post(f"{url}/grade/hw", {"files": {"hw.py": "x = 3\n"}})
+        assert status == 200 and results["score"] == 1
+    finally:
+        http_server.shutdown()
+        http_server.grading_server.close()
@@ -0,0 +1,63 @@
+import json
+import tracemalloc
+
+from gspack.submission_metadata import read_submission_metadata
+
+
+def make_previous_submission(score, success=True, pretest=False, output_size=100):
+    return {
+        "submission_time": "2021-01-01T00:00:00.000000-08:00",
+        "score": score,
+        "results": {
+            "score": score,
+            "output": "x" * output_size,
+            "tests": [{"name": f"Test {i}", "score": 1, "output": "y" * output_size} for i in range(10)],
+            "extra_data": {"success": success, "pretest": pretest, "timings": [{"phase": "execute"}]},
+        }
+    }
+
+
+def write_metadata(path, previous_submissions, indent=None):
+    metadata = {
+        "id": 123456,
+        "created_at": "2021-01-01T00:00:00.000000-08:00",
+        "assignment": {"title": "Homework 0", "total_points": 5.0},
+        "users": [{"email": "student@uw.edu", "id": 1, "name": "Student"}],
+        "previous_submissions": previous_submissions,
+    }
+    with open(path, "w") as f:
+        json.dump(metadata, f, indent=indent)
+
+
+def test_previous_submissions_are_counted(tmp_path):
+    previous_submissions = [
+        make_previous_submission(3),
+        make_previous_submission(5, pretest=True),
+        make_previous_submission(4.5, success=False),
+        {"submission_time": "2021-01-01T00:00:00.000000-08:00", "score": 0, "results": None},
+        {"submission_time": "2021-01-01T00:00:00.000000-08:00", "score": 0},
+        make_previous_submission(12345678),
+    ]
+    expected = {"users": [{"email": "student@uw.edu", "id": 1, "name": "Student"}], "attempts": 2,
+                "max_previous_score": 12345678}
+    for indent in (None, 2):
+        write_metadata(tmp_path / "submission_metadata.json", previous_submissions, indent=indent)
+        # Small pieces make values (including numbers) cross the pieces' boundaries
+        for read_size in (1, 7, 64, 1024 ** 2):
+            assert read_submission_metadata(tmp_path / "submission_metadata.json", read_size=read_size) == expected
+    write_metadata(tmp_path / "submission_metadata.json", [])
+    assert read_submission_metadata(tmp_path / "submission_metadata.json")["attempts"] == 0
+
+
+def test_memory_does_not_grow_with_history(tmp_path):
+    write_metadata(tmp_path / "submission_metadata.json",
+                   [make_previous_submission(i, output_size=1000) for i in range(1000)])
+    file_size = (tmp_path / "submission_metadata.json").stat().st_size
+    tracemalloc.start()
+    try:
+        metadata = read_submission_metadata(tmp_path / "submission_metadata.json")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert metadata["attempts"] == 1000 and metadata["max_previous_score"] == 999
+    assert peak < file_size / 20
@@ -0,0 +1,33 @@
+import pickle
+import random
+
+from gspack.executor import Executor
+from gspack.helpers import TailBuffer
+
+
+def test_tail_buffer_keeps_the_last_bytes():
+    rng = random.Random(0)
+    for capacity in (1, 7, 100, 4096):
+        buffer = TailBuffer(capacity)
+        written = ""
+        for i in range(3000):
+            text = str(i) * rng.randint(0, 40) + rng.choice(["", "\n", "é"])
+            buffer.write(text)
+            written += text
+            if i % 100 == 0:
+                # Passing the buffer through pickle is what the sandbox does
+                for restored in (buffer, pickle.loads(pickle.dumps(buffer))):
+                    expected = written.encode("utf-8")[-capacity:].decode("utf-8", errors="ignore")
+                    assert restored.getvalue() == expected
+                    assert restored.dropped_bytes == max(0, len(written.encode("utf-8")) - capacity)
+
+
+def test_executor_captures_the_tail_of_the_output(tmp_path):
+    file_path = tmp_path / "hw.py"
+    file_path.write_text("import sys\nfor i in range(100000):\n    print(i)\nprint('done', file=sys.stderr)\nx = 1\n")
+    executor = Executor(supported_platforms=["python"], output_tail_size=1000)
+    _, variables = executor.execute(file_path)
+    assert variables["x"] == 1
+    assert executor.captured_output.getvalue().endswith("99998\n99999\ndone\n")
+    assert len(executor.captured_output.getvalue()) == 1000
+    assert list(tmp_path.iterdir()) == [file_path]
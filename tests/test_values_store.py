@@ -0,0 +1,42 @@
+import pickle
+from pathlib import Path
+from tempfile import mkdtemp
+
+import numpy as np
+
+from gspack.directories import TEST_SUITE_VALUES_DIR, TEST_SUITE_VALUES_FILE
+from gspack.values_store import save_values, load_values, StoredValues
+
+VALUES = {
+    "A1": 4.858407346410207,
+    "A2": 1000,
+    "A3": np.arange(12, dtype=float).reshape(3, 4),
+    "name": "gspack",
+    "z": 1 + 2j,
+}
+
+
+def check_values(values):
+    assert set(values.keys()) == set(VALUES.keys())
+    for name, value in VALUES.items():
+        if isinstance(value, np.ndarray):
+            assert np.array_equal(values[name], value)
+        else:
+            assert values[name] == value
+
+
+def test_values_store_round_trip():
+    path = Path(mkdtemp()) / TEST_SUITE_VALUES_DIR
+    save_values(VALUES, path)
+    values = load_values(path)
+    assert isinstance(values, StoredValues)
+    check_values(values)
+    # arrays are memory-mapped rather than read into memory
+    assert isinstance(values["A3"], np.memmap)
+
+
+def test_old_pickle_format_is_loaded():
+    source_dir = Path(mkdtemp())
+    with open(source_dir / TEST_SUITE_VALUES_FILE, "wb") as f:
+        pickle.dump(VALUES, f)
+    check_values(load_values(source_dir / TEST_SUITE_VALUES_DIR))
@@ -0,0 +1,40 @@
+import os
+import signal
+import time
+
+from gspack.workers import ForkServerPool, fork_call, wait_for_child
+
+
+def exit_with_item(item):
+    # Children finish in the reverse order of their items
+    time.sleep(0.05 * (3 - item))
+    return item
+
+
+def fail(item):
+    if item == "raise":
+        raise ValueError("Student's code is broken")
+    if item == "kill":
+        os.kill(os.getpid(), signal.SIGKILL)
+    if item == "exit":
+        os._exit(3)
+    return 0
+
+
+def test_fork_server_pool_keeps_order():
+    assert ForkServerPool(workers=2).map(exit_with_item, [0, 1, 2, 3]) == [0, 1, 2, 3]
+    assert ForkServerPool(workers=1).map(exit_with_item, []) == []
+
+
+def test_fork_server_pool_reports_failed_children():
+    exit_codes = ForkServerPool(workers=4).map(fail, ["ok", "raise", "kill", "exit"])
+    assert exit_codes == [0, 1, -signal.SIGKILL, 3]
+    assert wait_for_child(fork_call(fail, "exit")) == 3
+
+
+def test_fork_server_pool_leaves_other_children_alone():
+    # A child which the pool did not start keeps its exit status for its owner
+    other_pid = fork_call(fail, "exit")
+    time.sleep(0.1)
+    assert ForkServerPool(workers=2).map(exit_with_item, [1, 2]) == [1, 2]
+    assert wait_for_child(other_pid) == 3